@@ -0,0 +1,220 @@
+"""
+Module for stochastic arrival processes, i.e. the times at which a device publishes.
+A fixed rate hides the bursts that overload brokers in practice. An arrival process replaces
+the next_interval() method of a device and hands out the intervals between its arrivals,
+generated 'batch' at a time with a few NumPy calls. Processes:
+- fixed: one message every 1/rate seconds
+- poisson: exponentially distributed intervals with mean 1/rate
+- onoff: Poisson arrivals at 'rate' during bursts, silence during pauses, both with
+  exponentially distributed durations of mean 'burst' and 'pause' seconds
+- storm: all devices of a group publish 'messages' messages within the same 'window' seconds,
+  storms start every 'every' seconds on average, in between the devices publish Poisson
+  arrivals at 'rate' (unless 'background' is false)
+- diurnal: Poisson arrivals whose rate follows a daily cosine with the given 'amplitude'
+  around 'rate', peaking 'peak' seconds after the start of every 'period' seconds
+The storm times of a group are drawn from a random stream seeded with the group's seed only,
+so all devices of the group (also in other worker processes) see the same storms.
+"""
+
+import random
+import statistics
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PROCESSES = ("fixed", "poisson", "onoff", "storm", "diurnal")
+
+
+def arrival_config(config) -> dict:
+    """
+    Function to normalize the arrival configuration of a device group, either the name of the
+    process or a dict with 'process' and its parameters. Without a 'seed', a random seed is chosen,
+    so that all devices of the group share their storms.
+    """
+    config = {"process": config} if isinstance(config, str) else dict(config)
+    if config.get("process") not in PROCESSES:
+        raise ValueError(f"Unknown arrival process '{config.get('process')}', choose from {', '.join(PROCESSES)}")
+    config.setdefault("seed", random.randrange(2**32))
+    return config
+
+
+class ArrivalProcess():
+    """
+    Abstract arrival process of a single device publishing 'rate' messages per second on average.
+    Subclasses implement arrivals() returning the next 'batch' arrival times (seconds after the start)
+    following 'self.time', the time of the last generated arrival.
+    """
+    def __init__(self, rate: float, seed: int = None, batch: int = 256):
+        if np is None:
+            raise ImportError("Arrival processes require numpy")
+        if rate <= 0:
+            raise ValueError("Arrival rate has to be positive")
+        self.rate = rate
+        self.batch = batch
+        self.rng = np.random.default_rng(seed)
+        self.time = 0.0
+        self.__intervals = []
+        self.__cursor = 0
+
+    def arrivals(self):
+        """
+        Function returning the next 'batch' arrival times as NumPy array.
+        """
+        raise NotImplementedError
+
+    def __generate(self):
+        times = self.arrivals()
+        intervals = np.diff(times, prepend=self.time)
+        self.time = float(times[-1])
+        # handing out plain python floats keeps NumPy scalar overhead off the per-tick path
+        self.__intervals = np.maximum(intervals, 0.0).tolist()
+        self.__cursor = 0
+
+    def next_interval(self) -> float:
+        """
+        Function returning the delay in seconds until the next arrival, the first call returns
+        the time of the first arrival.
+        """
+        if self.__cursor >= len(self.__intervals):
+            self.__generate()
+        interval = self.__intervals[self.__cursor]
+        self.__cursor += 1
+        return interval
+
+
+class FixedArrivals(ArrivalProcess):
+    """
+    One arrival every 1/'rate' seconds.
+    """
+    def arrivals(self):
+        return self.time + np.arange(1, self.batch + 1) / self.rate
+
+
+class PoissonArrivals(ArrivalProcess):
+    """
+    Poisson process with 'rate' arrivals per second.
+    """
+    def arrivals(self):
+        return self.time + np.cumsum(self.rng.exponential(1 / self.rate, self.batch))
+
+
+class OnOffArrivals(ArrivalProcess):
+    """
+    Poisson arrivals at 'rate' during bursts of mean length 'burst', none during pauses of mean length 'pause'.
+    Every device starts within a pause, so the bursts of a group are not aligned.
+    """
+    def __init__(self, rate: float, seed: int = None, batch: int = 256, burst: float = 10, pause: float = 50):
+        super().__init__(rate, seed, batch)
+        self.burst = burst
+        self.pause = pause
+        # time of the last arrival and end of the current burst
+        self.clock = self.rng.exponential(pause)
+        self.burst_end = self.clock + self.rng.exponential(burst)
+
+    def arrivals(self):
+        gaps = self.rng.exponential(1 / self.rate, self.batch)
+        times = np.empty(self.batch)
+        now = self.clock
+        for index, gap in enumerate(gaps.tolist()):
+            now += gap
+            # exponential gaps are memoryless, the part beyond the burst continues after the pause
+            while now > self.burst_end:
+                pause, burst = self.rng.exponential(self.pause), self.rng.exponential(self.burst)
+                now += pause
+                self.burst_end += pause + burst
+            times[index] = now
+        self.clock = now
+        return times
+
+
+class StormArrivals(ArrivalProcess):
+    """
+    Correlated storms: starting every 'every' seconds on average (drawn from 'storm_seed', shared by the group),
+    the device publishes 'messages' messages at uniformly distributed times within 'window' seconds.
+    With 'background', Poisson arrivals at 'rate' are added in between.
+    """
+    def __init__(self, rate: float, seed: int = None, batch: int = 256, storm_seed: int = None,
+                 every: float = 60, window: float = 1, messages: int = 1, background: bool = True):
+        super().__init__(rate, seed, batch)
+        self.every = every
+        self.window = window
+        self.messages = messages
+        self.background = background
+        self.storms = np.random.default_rng(storm_seed)
+        self.storm_time = 0.0
+        # arrivals after the start of the last storm, the next storms and background arrivals may precede them
+        self.pending = np.empty(0)
+
+    def arrivals(self):
+        count = -(-self.batch // self.messages)
+        times = self.pending
+        while True:
+            starts = self.storm_time + np.cumsum(self.storms.exponential(self.every, count))
+            offsets = np.sort(self.rng.uniform(0, self.window, (count, self.messages)), axis=1)
+            times = np.concatenate((times, (starts[:, None] + offsets).ravel()))
+            if self.background:
+                horizon = starts[-1] - self.storm_time
+                background = self.rng.uniform(self.storm_time, starts[-1], self.rng.poisson(self.rate * horizon))
+                times = np.concatenate((times, background))
+            self.storm_time = float(starts[-1])
+            times = np.sort(times)
+            ready = int(np.searchsorted(times, self.storm_time, side="right"))
+            if ready:
+                self.pending = times[ready:]
+                return times[:ready]
+
+
+class DiurnalArrivals(ArrivalProcess):
+    """
+    Poisson arrivals with rate 'rate' * (1 + 'amplitude' * cos(2 pi (t - 'peak') / 'period')), generated by thinning.
+    """
+    def __init__(self, rate: float, seed: int = None, batch: int = 256, period: float = 86400,
+                 amplitude: float = 0.8, peak: float = None):
+        super().__init__(rate, seed, batch)
+        if not 0 <= amplitude <= 1:
+            raise ValueError("Amplitude of the diurnal arrival rate has to be within [0, 1]")
+        self.period = period
+        self.amplitude = amplitude
+        self.peak = period / 2 if peak is None else peak
+
+    def arrivals(self):
+        peak_rate = self.rate * (1 + self.amplitude)
+        accepted = []
+        count = 0
+        start = self.time
+        while count < self.batch:
+            candidates = start + np.cumsum(self.rng.exponential(1 / peak_rate, 2 * self.batch))
+            start = candidates[-1]
+            curve = 1 + self.amplitude * np.cos(2 * np.pi * (candidates - self.peak) / self.period)
+            candidates = candidates[self.rng.uniform(0, 1 + self.amplitude, candidates.size) < curve]
+            accepted.append(candidates)
+            count += candidates.size
+        return np.concatenate(accepted)[:self.batch]
+
+
+ARRIVAL_PROCESSES = {"fixed": FixedArrivals, "poisson": PoissonArrivals, "onoff": OnOffArrivals,
+                     "storm": StormArrivals, "diurnal": DiurnalArrivals}
+
+
+def attach_arrivals(device, config: dict, rate: float = None) -> ArrivalProcess:
+    """
+    Function to let 'device' publish according to the arrival process 'config' (see arrival_config())
+    with 'rate' messages per second on average. Without a rate, the device keeps the mean rate of
+    its own next_interval().
+    """
+    options = dict(config)
+    process = options.pop("process")
+    seed = options.pop("seed")
+    if rate is None:
+        rate = 1 / statistics.mean(device.next_interval() for _ in range(32))
+    if process == "storm":
+        options["storm_seed"] = seed
+    arrivals = ARRIVAL_PROCESSES[process](rate, [seed, zlib.crc32(device.name.encode('utf-8'))], **options)
+    device.next_interval = arrivals.next_interval
+    device.arrivals = arrivals
+    if getattr(device, "window", None):
+        device.window.attach(device)
+    return arrivals
@@ -0,0 +1,138 @@
+"""
+Module for bounding the number of messages a client has in flight.
+paho queues every publish that cannot be sent or acknowledged yet, without a limit. Under load,
+especially with QoS 1/2, this queue and the memory of the process grow until the run falls over.
+A window admits at most 'max_in_flight' publishes that have not been acknowledged by on_publish yet.
+When the window is full, a publish either blocks until a slot frees up, is dropped, or is dropped
+and the device slows down (adaptive). The time a window spends full is reported as throttled time.
+"""
+
+import threading
+import time
+
+POLICIES = ("block", "drop", "adaptive")
+
+
+class InFlightWindow():
+    """
+    Window of at most 'max_in_flight' unacknowledged publishes.
+    Policies when the window is full:
+    - block: wait up to 'timeout' seconds for a free slot, then drop the message
+    - drop: drop the message
+    - adaptive: drop the message and double the device's interval (up to 'max_slowdown' times),
+      every acknowledgement while the window is less than half full speeds it up again by 5%
+    Blocking requires the acknowledgements to arrive on another thread (paho's network thread).
+    Devices ticked by a RateScheduler from one thread shared by the whole fleet must not block it:
+    their window is 'deferrable', acquire() never waits and the scheduler defers the device's ticks
+    instead while ready() returns False.
+    """
+    def __init__(self, max_in_flight: int, policy: str = "drop", timeout: float = 1.0, max_slowdown: float = 64):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}'")
+        self.max_in_flight = max_in_flight
+        self.policy = policy
+        self.timeout = timeout
+        self.max_slowdown = max_slowdown
+        self.in_flight = 0
+        self.slowdown = 1.0
+        self.dropped = 0
+        self.blocked = 0
+        self.deferrable = False
+        self.__throttled = 0.0
+        self.__full_since = None
+        self.__deferred_since = None
+        self.__condition = threading.Condition()
+
+    def attach(self, device):
+        """
+        Function to let the adaptive policy stretch the intervals of 'device' by the current slowdown.
+        """
+        if self.policy == "adaptive" and hasattr(device, "next_interval"):
+            next_interval = device.next_interval
+            device.next_interval = lambda: next_interval() * self.slowdown
+
+    def acquire(self, block: bool = True) -> bool:
+        """
+        Function to take a slot for the next publish, returns False if the message has to be dropped.
+        Without 'block', the block policy drops immediately as well.
+        """
+        with self.__condition:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                self.__deferred_since = None
+                return True
+            if self.__full_since is None:
+                self.__full_since = time.monotonic()
+            # a deferred message waited long enough, the next one is deferred anew
+            self.__deferred_since = None
+            if self.policy == "block" and block and not self.deferrable:
+                self.blocked += 1
+                if self.__condition.wait_for(lambda: self.in_flight < self.max_in_flight, self.timeout):
+                    self.in_flight += 1
+                    return True
+            elif self.policy == "adaptive":
+                self.slowdown = min(self.slowdown * 2, self.max_slowdown)
+            self.dropped += 1
+            return False
+
+    def ready(self) -> bool:
+        """
+        Function returning whether the device may publish now, False while the window of the block
+        policy is full, for at most 'timeout' seconds per message (see 'deferrable').
+        """
+        with self.__condition:
+            if self.policy != "block" or self.in_flight < self.max_in_flight:
+                return True
+            now = time.monotonic()
+            if self.__full_since is None:
+                self.__full_since = now
+            if self.__deferred_since is None:
+                self.__deferred_since = now
+                self.blocked += 1
+            return now - self.__deferred_since >= self.timeout
+
+    def release(self):
+        """
+        Function to free the slot of an acknowledged (or failed) publish.
+        """
+        with self.__condition:
+            self.in_flight = max(self.in_flight - 1, 0)
+            self.__unblock()
+            if self.slowdown > 1 and self.in_flight < self.max_in_flight / 2:
+                self.slowdown = max(self.slowdown * 0.95, 1.0)
+
+    def clear(self):
+        """
+        Function to free all slots, e.g. after a disconnect the pending acknowledgements never arrive.
+        """
+        with self.__condition:
+            self.in_flight = 0
+            self.__unblock()
+
+    def __unblock(self):
+        # called with the condition held
+        if self.__full_since is not None:
+            self.__throttled += time.monotonic() - self.__full_since
+            self.__full_since = None
+        self.__condition.notify()
+
+    @property
+    def throttled(self) -> float:
+        """
+        Seconds the window was full while the device wanted to publish.
+        """
+        with self.__condition:
+            if self.__full_since is None:
+                return self.__throttled
+            return self.__throttled + time.monotonic() - self.__full_since
+
+    def reset(self):
+        """
+        Function to reset the statistics, e.g. at the end of a warm-up.
+        """
+        with self.__condition:
+            self.dropped = 0
+            self.blocked = 0
+            self.__throttled = 0.0
+            if self.__full_since is not None:
+                self.__full_since = time.monotonic()
@@ -0,0 +1,161 @@
+"""
+Module for detecting performance regressions of the simulator.
+Reruns the standard scenarios of scenarios/benchmark/ against the embedded broker (broker.py, started
+in its own process so it does not compete with the simulated devices for the GIL), records the results
+(see results.py) and compares the throughput and latency of every step with a stored baseline.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from latency import LatencyCollector
+import mqttClient
+import payload
+import run
+from results import ResultsRecorder, git_revision
+from scenario import load_scenario
+
+logger = logging.getLogger('Evaluation')
+
+# latency changes below this many milliseconds are considered noise
+MIN_LATENCY_DELTA = 1.0
+# a percentile is only compared if at least this many latency samples lie above it, e.g. 1000 samples for p99
+MIN_TAIL_SAMPLES = 10
+
+
+def free_port() -> int:
+    """
+    Function returning a currently unused TCP port on localhost.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_broker(port: int, timeout: float = 10) -> subprocess.Popen:
+    """
+    Function to start the embedded broker on localhost:'port' in a separate process
+    and wait until it accepts connections.
+    """
+    broker = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "broker.py"),
+                               "--host", "127.0.0.1", "--port", str(port)])
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return broker
+        except OSError:
+            time.sleep(0.1)
+    broker.kill()
+    raise RuntimeError(f"Broker did not start listening on port {port} within {timeout}s")
+
+
+def summarize(rows: list) -> dict:
+    """
+    Function reducing the steps.csv rows of a scenario to the compared metrics per step scale.
+    """
+    return {str(row["scale"]): {"rate": row["rate"], "errors": row["errors"],
+                                "p50": row["p50_ms"], "p99": row["p99_ms"], "count": row["latency_count"]}
+            for row in rows}
+
+
+def compare(scenario: str, current: dict, baseline: dict, rate_tolerance: float, latency_tolerance: float) -> list:
+    """
+    Function returning the regressions of 'current' against 'baseline' (both as returned by summarize()).
+    Throughput regresses if it drops by more than 'rate_tolerance', latency if p50 or p99 grow
+    by more than 'latency_tolerance' (relative) and MIN_LATENCY_DELTA (absolute). Percentiles of steps
+    with too few samples above them (see MIN_TAIL_SAMPLES) in either run are run-to-run noise and skipped.
+    """
+    regressions = []
+    for scale, metrics in current.items():
+        reference = baseline.get(scale)
+        if not reference:
+            continue
+        if metrics["rate"] < reference["rate"] * (1 - rate_tolerance):
+            regressions.append(f"{scenario} step {scale}: throughput {metrics['rate']:.1f} msg/s, "
+                               f"baseline {reference['rate']:.1f} msg/s")
+        if metrics["errors"] > reference["errors"]:
+            regressions.append(f"{scenario} step {scale}: {metrics['errors']} publish errors, "
+                               f"baseline {reference['errors']}")
+        # baselines stored before the sample count was recorded only limit by the current run
+        count = min(metrics["count"], reference.get("count", metrics["count"]))
+        for percentile, share in (("p50", 0.5), ("p99", 0.01)):
+            value, limit = metrics[percentile], reference[percentile]
+            if value is None or limit is None or count * share < MIN_TAIL_SAMPLES:
+                continue
+            if value > limit * (1 + latency_tolerance) and value - limit > MIN_LATENCY_DELTA:
+                regressions.append(f"{scenario} step {scale}: {percentile} latency {value:.3f}ms, "
+                                   f"baseline {limit:.3f}ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regression benchmark of the simulator against a local broker.")
+    parser.add_argument("scenarios", nargs="*", help="scenario files to run (default: scenarios/benchmark/*)")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json", help="file with the stored baseline")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store the results as new baseline instead of comparing against it")
+    parser.add_argument("--results", default="results", help="directory to record the results of every run in")
+    parser.add_argument("--rate-tolerance", type=float, default=0.05,
+                        help="relative throughput drop reported as regression")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5,
+                        help="relative latency increase reported as regression")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="asyncio", help="engine of run.py")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes of run.py")
+    args = parser.parse_args()
+
+    paths = args.scenarios or sorted(glob.glob(os.path.join("scenarios", "benchmark", "*")))
+    port = free_port()
+    broker = start_broker(port)
+    run.MQTTClient.broker_url, run.MQTTClient.broker_port = "127.0.0.1", port
+    mqttClient.host, mqttClient.port = "127.0.0.1", port
+    run.MQTTClient.correlation_stamp = "monotonic"
+    payload.ENCODING = "json"
+    summaries = {}
+    try:
+        for path in paths:
+            scenario = load_scenario(path)
+            collector = LatencyCollector("127.0.0.1", port, topic=f"{run.MQTTClient.main_topic}/#")
+            collector.start()
+            recorder = ResultsRecorder(args.results, scenario.name, {
+                "benchmark": path, "engine": args.engine, "processes": args.processes,
+                "scenario": scenario.to_dict()})
+            rows = run.run_scenario(scenario, args.engine, args.processes, collector=collector, recorder=recorder)
+            recorder.close()
+            collector.stop()
+            summaries[scenario.name] = summarize(rows)
+    finally:
+        broker.send_signal(signal.SIGINT)
+        broker.wait()
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"revision": git_revision(), "engine": args.engine, "processes": args.processes,
+                       "scenarios": summaries}, file, indent=2)
+        logger.info("Stored baseline of %s scenarios in %s", len(summaries), args.baseline)
+        sys.exit(0)
+    if not os.path.exists(args.baseline):
+        logger.warning("No baseline in %s, run with --update-baseline first", args.baseline)
+        sys.exit(0)
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    regressions = []
+    for name, summary in summaries.items():
+        if name not in baseline["scenarios"]:
+            logger.warning("Scenario '%s' is not part of the baseline", name)
+            continue
+        regressions += compare(name, summary, baseline["scenarios"][name],
+                               args.rate_tolerance, args.latency_tolerance)
+    for regression in regressions:
+        logger.error("Regression: %s", regression)
+    logger.info("%s regressions against baseline of revision %s", len(regressions), baseline["revision"])
+    sys.exit(1 if regressions else 0)
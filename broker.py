@@ -0,0 +1,562 @@
+"""
+Module providing a small embedded MQTT broker for offline, reproducible benchmarks.
+It covers the subset of MQTT v5 (and v3.1.1) used by the simulated clients:
+CONNECT, PUBLISH with QoS 0/1/2 and properties (including topic aliases), SUBSCRIBE and
+UNSUBSCRIBE with '+' and '#' wildcards, PINGREQ and DISCONNECT.
+Sessions are not persisted, retained messages and wills are not supported.
+Messages are forwarded without retransmission, QoS 0 messages to subscribers whose socket
+buffer exceeds 'max_buffer' bytes are dropped and counted. QoS 1/2 messages are not dropped,
+instead the publisher is not read from until such subscribers drained their buffers, which
+pushes back on the publisher through TCP flow control. These stalls are counted as well.
+"""
+
+import argparse
+import asyncio
+import logging
+import struct
+import threading
+
+logger = logging.getLogger('Evaluation')
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+MQTTv311 = 4
+MQTTv5 = 5
+
+PROPERTY_TOPIC_ALIAS = 0x23
+PROPERTY_TOPIC_ALIAS_MAXIMUM = 0x22
+
+# sizes of the MQTT v5 property values by identifier: fixed byte counts,
+# or "varint", "string" (2 byte length prefix) and "pair" (two strings)
+PROPERTY_SIZES = {
+    0x01: 1, 0x17: 1, 0x19: 1, 0x24: 1, 0x25: 1, 0x28: 1, 0x29: 1, 0x2A: 1,
+    0x13: 2, 0x21: 2, 0x22: 2, 0x23: 2,
+    0x02: 4, 0x11: 4, 0x18: 4, 0x27: 4,
+    0x0B: "varint",
+    0x03: "string", 0x08: "string", 0x09: "string", 0x12: "string", 0x15: "string", 0x16: "string",
+    0x1A: "string", 0x1C: "string", 0x1F: "string",
+    0x26: "pair",
+}
+
+UINT16 = struct.Struct(">H")
+
+
+class ProtocolError(Exception):
+    """
+    Raised for malformed or unsupported packets, the connection is closed.
+    """
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    Function encoding 'value' as MQTT variable byte integer.
+    """
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        encoded.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(encoded)
+
+
+def decode_varint(buffer, position: int) -> tuple:
+    """
+    Function decoding a variable byte integer at 'position', returns (value, next position).
+    Returns (None, position) if the buffer ends within the integer.
+    """
+    value = 0
+    for index in range(4):
+        if position + index >= len(buffer):
+            return None, position
+        byte = buffer[position + index]
+        value |= (byte & 0x7F) << (7 * index)
+        if not byte & 0x80:
+            return value, position + index + 1
+    raise ProtocolError("Malformed variable byte integer")
+
+
+def encode_string(value: bytes) -> bytes:
+    """
+    Function encoding 'value' with its two byte length prefix.
+    """
+    return UINT16.pack(len(value)) + value
+
+
+def decode_string(buffer, position: int) -> tuple:
+    """
+    Function decoding a length prefixed string at 'position', returns (bytes, next position).
+    """
+    length, = UINT16.unpack_from(buffer, position)
+    return bytes(buffer[position + 2:position + 2 + length]), position + 2 + length
+
+
+def split_properties(properties: bytes) -> tuple:
+    """
+    Function splitting an encoded property block into a dictionary of the fixed size integer
+    properties and the encoded block without the topic alias, which is only valid per connection.
+    """
+    values = {}
+    remaining = bytearray()
+    position = 0
+    while position < len(properties):
+        start = position
+        identifier = properties[position]
+        position += 1
+        size = PROPERTY_SIZES.get(identifier)
+        if size is None:
+            raise ProtocolError(f"Unknown property {identifier:#x}")
+        if size == "varint":
+            _, position = decode_varint(properties, position)
+        elif size == "string":
+            position += 2 + UINT16.unpack_from(properties, position)[0]
+        elif size == "pair":
+            for _ in range(2):
+                position += 2 + UINT16.unpack_from(properties, position)[0]
+        else:
+            values[identifier] = int.from_bytes(properties[position:position + size], "big")
+            position += size
+        if identifier != PROPERTY_TOPIC_ALIAS:
+            remaining += properties[start:position]
+    return values, bytes(remaining)
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """
+    Function checking whether 'topic' matches 'topic_filter' including '+' and '#' wildcards.
+    """
+    if topic.startswith("$") and topic_filter[:1] in ("+", "#"):
+        return False
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels) or (level != "+" and level != topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class SubscriptionTree():
+    """
+    Topic tree of all subscriptions, every node maps subscribed sessions to their QoS and options.
+    """
+    def __init__(self):
+        self.__root = ({}, {})
+
+    def add(self, topic_filter: str, session, options: int):
+        """
+        Function to subscribe 'session' to 'topic_filter' with the subscription 'options' byte.
+        """
+        node = self.__root
+        for level in topic_filter.split("/"):
+            node = node[0].setdefault(level, ({}, {}))
+        node[1][session] = options
+
+    def remove(self, topic_filter: str, session) -> bool:
+        """
+        Function to unsubscribe 'session' from 'topic_filter', returns False if it was not subscribed.
+        """
+        node = self.__root
+        for level in topic_filter.split("/"):
+            node = node[0].get(level)
+            if node is None:
+                return False
+        return node[1].pop(session, None) is not None
+
+    def match(self, topic: str) -> dict:
+        """
+        Function returning the subscribed sessions for 'topic' with the options of their best matching filter.
+        """
+        levels = topic.split("/")
+        matches = {}
+
+        def collect(subscribers):
+            for session, options in subscribers.items():
+                if session not in matches or (options & 0x03) > (matches[session] & 0x03):
+                    matches[session] = options
+
+        def walk(node, index):
+            children = node[0]
+            if "#" in children and not (index == 0 and topic.startswith("$")):
+                collect(children["#"][1])
+            if index == len(levels):
+                collect(node[1])
+                return
+            child = children.get(levels[index])
+            if child is not None:
+                walk(child, index + 1)
+            if "+" in children and not (index == 0 and topic.startswith("$")):
+                walk(children["+"], index + 1)
+
+        walk(self.__root, 0)
+        return matches
+
+
+class Session():
+    """
+    State of one client connection.
+    """
+    def __init__(self, broker: "Broker", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.version = MQTTv5
+        self.keepalive = 0
+        self.topic_aliases = {}
+        self.subscriptions = set()
+        self.received_qos2 = set()
+        # subscribers above the buffer limit after QoS 1/2 messages of this session were forwarded to them
+        self.congested = set()
+        self.__packet_id = 0
+
+    def next_packet_id(self) -> int:
+        """
+        Function returning the packet identifier for the next outgoing QoS 1/2 message.
+        """
+        self.__packet_id = self.__packet_id % 65535 + 1
+        return self.__packet_id
+
+    def send(self, packet_type: int, flags: int, body: bytes):
+        """
+        Function to write a packet with fixed header to the client.
+        """
+        self.writer.write(bytes((packet_type << 4 | flags,)) + encode_varint(len(body)) + body)
+
+    def send_ack(self, packet_type: int, packet_id: int):
+        """
+        Function to acknowledge 'packet_id' with a PUBACK, PUBREC, PUBREL or PUBCOMP packet.
+        """
+        # success reason code and no properties may be omitted in MQTT v5
+        self.send(packet_type, 0x02 if packet_type == PUBREL else 0, UINT16.pack(packet_id))
+
+    async def serve(self):
+        """
+        Function reading and handling packets until the connection is closed.
+        """
+        buffer = bytearray()
+        try:
+            while True:
+                timeout = self.keepalive * 1.5 if self.keepalive else None
+                data = await asyncio.wait_for(self.reader.read(65536), timeout)
+                if not data:
+                    break
+                buffer += data
+                position = 0
+                while len(buffer) - position >= 2:
+                    length, body_start = decode_varint(buffer, position + 1)
+                    if length is None or len(buffer) < body_start + length:
+                        break
+                    header = buffer[position]
+                    body = memoryview(buffer)[body_start:body_start + length]
+                    try:
+                        closing = self.handle(header >> 4, header & 0x0F, body)
+                    finally:
+                        body.release()
+                    position = body_start + length
+                    if closing:
+                        return
+                del buffer[:position]
+                while self.congested:
+                    await self.congested.pop().drain()
+        except asyncio.TimeoutError:
+            logger.debug("Broker: %s timed out", self.client_id)
+        except (ProtocolError, struct.error, UnicodeDecodeError) as err:
+            logger.warning("Broker: closing %s, %s", self.client_id, err)
+        except ConnectionError:
+            pass
+        finally:
+            self.broker.remove_session(self)
+            self.writer.close()
+
+    async def drain(self):
+        """
+        Function waiting until the write buffer of the client fell below its low-water mark.
+        """
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            # the subscriber is gone, its session is removed by its own serve()
+            pass
+
+    def handle(self, packet_type: int, flags: int, body) -> bool:
+        """
+        Function handling one packet, returns True if the connection is to be closed.
+        """
+        if self.client_id is None and packet_type != CONNECT:
+            raise ProtocolError("First packet is not CONNECT")
+        if packet_type == PUBLISH:
+            self.handle_publish(flags, body)
+        elif packet_type == PUBACK or packet_type == PUBCOMP:
+            pass
+        elif packet_type == PUBREC:
+            self.send_ack(PUBREL, UINT16.unpack_from(body, 0)[0])
+        elif packet_type == PUBREL:
+            packet_id, = UINT16.unpack_from(body, 0)
+            self.received_qos2.discard(packet_id)
+            self.send_ack(PUBCOMP, packet_id)
+        elif packet_type == CONNECT:
+            self.handle_connect(body)
+        elif packet_type == SUBSCRIBE:
+            self.handle_subscribe(body)
+        elif packet_type == UNSUBSCRIBE:
+            self.handle_unsubscribe(body)
+        elif packet_type == PINGREQ:
+            self.send(PINGRESP, 0, b"")
+        elif packet_type == DISCONNECT:
+            return True
+        else:
+            raise ProtocolError(f"Unsupported packet type {packet_type}")
+        return False
+
+    def read_properties(self, body, position: int) -> tuple:
+        """
+        Function returning the encoded properties at 'position' (empty for MQTT v3.1.1) and the next position.
+        """
+        if self.version != MQTTv5:
+            return b"", position
+        length, position = decode_varint(body, position)
+        return bytes(body[position:position + length]), position + length
+
+    def handle_connect(self, body):
+        if self.client_id is not None:
+            raise ProtocolError("Second CONNECT")
+        _, position = decode_string(body, 0)
+        self.version = body[position]
+        if self.version not in (MQTTv311, MQTTv5):
+            self.send(CONNACK, 0, b"\x00\x01")
+            raise ProtocolError(f"Unsupported protocol level {self.version}")
+        flags = body[position + 1]
+        self.keepalive, = UINT16.unpack_from(body, position + 2)
+        _, position = self.read_properties(body, position + 4)
+        client_id, position = decode_string(body, position)
+        if flags & 0x04:
+            raise ProtocolError("Will messages are not supported")
+        self.client_id = client_id.decode("utf-8") or f"auto-{id(self):x}"
+        self.broker.add_session(self)
+        if self.version == MQTTv5:
+            properties = bytes((PROPERTY_TOPIC_ALIAS_MAXIMUM,)) + UINT16.pack(self.broker.topic_alias_maximum)
+            self.send(CONNACK, 0, b"\x00\x00" + encode_varint(len(properties)) + properties)
+        else:
+            self.send(CONNACK, 0, b"\x00\x00")
+
+    def handle_publish(self, flags: int, body):
+        qos = (flags >> 1) & 0x03
+        topic, position = decode_string(body, 0)
+        packet_id = None
+        if qos:
+            packet_id, = UINT16.unpack_from(body, position)
+            position += 2
+        properties, position = self.read_properties(body, position)
+        if properties:
+            values, properties = split_properties(properties)
+            alias = values.get(PROPERTY_TOPIC_ALIAS)
+            if alias is not None:
+                if not 0 < alias <= self.broker.topic_alias_maximum:
+                    raise ProtocolError(f"Invalid topic alias {alias}")
+                if topic:
+                    self.topic_aliases[alias] = topic
+                else:
+                    topic = self.topic_aliases.get(alias)
+                    if topic is None:
+                        raise ProtocolError(f"Unknown topic alias {alias}")
+        if not topic:
+            raise ProtocolError("PUBLISH without topic")
+        payload = bytes(body[position:])
+        if qos == 1:
+            self.send_ack(PUBACK, packet_id)
+        elif qos == 2:
+            self.send_ack(PUBREC, packet_id)
+            if packet_id in self.received_qos2:
+                return
+            self.received_qos2.add(packet_id)
+        self.broker.route(self, topic, qos, properties, payload)
+
+    def handle_subscribe(self, body):
+        packet_id, = UINT16.unpack_from(body, 0)
+        _, position = self.read_properties(body, 2)
+        reason_codes = bytearray()
+        while position < len(body):
+            topic_filter, position = decode_string(body, position)
+            options = body[position]
+            position += 1
+            topic_filter = topic_filter.decode("utf-8")
+            self.broker.subscriptions.add(topic_filter, self, options)
+            self.subscriptions.add(topic_filter)
+            reason_codes.append(options & 0x03)
+        properties = b"\x00" if self.version == MQTTv5 else b""
+        self.send(SUBACK, 0, UINT16.pack(packet_id) + properties + bytes(reason_codes))
+
+    def handle_unsubscribe(self, body):
+        packet_id, = UINT16.unpack_from(body, 0)
+        _, position = self.read_properties(body, 2)
+        reason_codes = bytearray()
+        while position < len(body):
+            topic_filter, position = decode_string(body, position)
+            topic_filter = topic_filter.decode("utf-8")
+            self.subscriptions.discard(topic_filter)
+            reason_codes.append(0x00 if self.broker.subscriptions.remove(topic_filter, self) else 0x11)
+        if self.version == MQTTv5:
+            self.send(UNSUBACK, 0, UINT16.pack(packet_id) + b"\x00" + bytes(reason_codes))
+        else:
+            self.send(UNSUBACK, 0, UINT16.pack(packet_id))
+
+
+class Broker():
+    """
+    Embedded MQTT broker listening on 'host':'port' (port 0 picks a free port).
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 1883, max_buffer: int = 4 * 1024 * 1024,
+                 topic_alias_maximum: int = 65535):
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self.topic_alias_maximum = topic_alias_maximum
+        self.subscriptions = SubscriptionTree()
+        self.sessions = {}
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        # QoS 1/2 messages after which their publisher was held back for a slow subscriber
+        self.stalled = 0
+        self.__server = None
+
+    async def start(self):
+        """
+        Function to start listening, 'port' is updated with the actual port.
+        """
+        self.__server = await asyncio.start_server(self.__accept, self.host, self.port)
+        self.port = self.__server.sockets[0].getsockname()[1]
+        logger.info("Broker listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        """
+        Function to stop listening and close all connections.
+        """
+        self.__server.close()
+        for session in list(self.sessions.values()):
+            session.writer.close()
+        await self.__server.wait_closed()
+
+    async def __accept(self, reader, writer):
+        await Session(self, reader, writer).serve()
+
+    def add_session(self, session: Session):
+        """
+        Function to register a connected session, an existing session with the same client id is taken over.
+        """
+        previous = self.sessions.get(session.client_id)
+        if previous is not None:
+            # session takeover, the previous connection with the same client id is closed
+            self.remove_session(previous)
+            previous.writer.close()
+        self.sessions[session.client_id] = session
+
+    def remove_session(self, session: Session):
+        """
+        Function to unregister a session and drop its subscriptions.
+        """
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+        for topic_filter in session.subscriptions:
+            self.subscriptions.remove(topic_filter, session)
+        session.subscriptions = set()
+
+    def route(self, sender: Session, topic: bytes, qos: int, properties: bytes, payload: bytes):
+        """
+        Function forwarding a message to all matching subscribers.
+        """
+        self.received += 1
+        subscribers = self.subscriptions.match(topic.decode("utf-8"))
+        if not subscribers:
+            return
+        encoded_topic = encode_string(topic)
+        encoded_properties = encode_varint(len(properties)) + properties
+        qos0_packets = {}
+        for session, options in subscribers.items():
+            if options & 0x04 and session is sender:
+                continue
+            transport = session.writer.transport
+            if transport.is_closing():
+                continue
+            granted = min(qos, options & 0x03)
+            if granted == 0:
+                if transport.get_write_buffer_size() > self.max_buffer:
+                    self.dropped += 1
+                    continue
+                packet = qos0_packets.get(session.version)
+                if packet is None:
+                    body = encoded_topic + (encoded_properties if session.version == MQTTv5 else b"") + payload
+                    packet = qos0_packets[session.version] = b"\x30" + encode_varint(len(body)) + body
+                session.writer.write(packet)
+            else:
+                body = (encoded_topic + UINT16.pack(session.next_packet_id())
+                        + (encoded_properties if session.version == MQTTv5 else b"") + payload)
+                session.send(PUBLISH, granted << 1, body)
+                if transport.get_write_buffer_size() > self.max_buffer:
+                    self.stalled += 1
+                    sender.congested.add(session)
+            self.delivered += 1
+
+
+class BrokerThread():
+    """
+    Runs a Broker within its own event loop in a background thread.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **options):
+        self.broker = Broker(host, port, **options)
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(name="broker", target=self.__loop.run_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        """
+        Address the broker listens on.
+        """
+        return self.broker.host
+
+    @property
+    def port(self) -> int:
+        """
+        Port the broker listens on, known after start().
+        """
+        return self.broker.port
+
+    def start(self):
+        """
+        Function to start the broker, returns once it is listening.
+        """
+        self.__thread.start()
+        asyncio.run_coroutine_threadsafe(self.broker.start(), self.__loop).result()
+
+    def stop(self):
+        """
+        Function to stop the broker and its thread.
+        """
+        asyncio.run_coroutine_threadsafe(self.broker.stop(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level="INFO")
+    parser = argparse.ArgumentParser(description="Embedded MQTT v5 broker for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=1883, help="port to listen on")
+    args = parser.parse_args()
+
+    async def main():
+        broker = Broker(args.host, args.port)
+        await broker.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            logger.info("Broker received %s and delivered %s messages, %s dropped, %s stalled",
+                        broker.received, broker.delivered, broker.dropped, broker.stalled)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,261 @@
+"""
+Module for benchmarking the request/response path of the actuators in mqttClient.py.
+A command driver publishes toggle commands to '<name>/toggleState' at a configurable rate with a
+bounded number of outstanding commands, matches the state updates echoed by the actuators via their
+CorrelationData and records the command round-trip latency and timeouts.
+"""
+
+# pylint: disable=unused-argument
+
+import argparse
+import itertools
+import json
+import logging
+import random
+import struct
+import threading
+import time
+
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+import paho.mqtt.client as mqtt
+
+from broker import BrokerThread
+import mqttClient
+from latency import Histogram
+
+logger = logging.getLogger('Evaluation')
+
+ACTUATORS = {
+    "door-actuator": mqttClient.DoorActuator,
+    "fire-alarm": mqttClient.FireAlarm,
+    "thermostat": mqttClient.Thermostat,
+    "shutter": mqttClient.Shutter,
+    "led-bulb": mqttClient.LEDBulb,
+}
+
+# actuators expecting a value next to their toggle field when activated
+VALUE_FIELDS = {
+    mqttClient.Thermostat: "state",
+    mqttClient.Shutter: "percentage",
+}
+
+CORRELATION = struct.Struct(">Q")
+
+
+def toggle_command(actuator_class, state: bool) -> str:
+    """
+    Function returning a toggle command for 'actuator_class' switching it to 'state'.
+    """
+    command = {next(iter(json.loads(actuator_class.toggle))): state}
+    if state and actuator_class in VALUE_FIELDS:
+        command[VALUE_FIELDS[actuator_class]] = random.randint(0, 100)
+    return json.dumps(command)
+
+
+class CommandReport():
+    """
+    Result of a command driver run.
+    """
+    def __init__(self, duration: float, sent: int, received: int, timeouts: int, unmatched: int,
+                 throttled: int, histogram: Histogram, actuators: dict):
+        self.duration = duration
+        self.sent = sent
+        self.received = received
+        self.timeouts = timeouts
+        self.unmatched = unmatched
+        self.throttled = throttled
+        self.histogram = histogram
+        self.actuators = actuators
+
+    def log(self):
+        """
+        Function to log the round-trip summary.
+        """
+        summary = self.histogram.summary()
+        logger.info("Sent %s commands in %.1fs (%.1f/s), %s responses, %s timeouts, %s unmatched, %s throttled",
+                    self.sent, self.duration, self.sent / self.duration if self.duration else 0.0,
+                    self.received, self.timeouts, self.unmatched, self.throttled)
+        if summary["count"]:
+            logger.info("Round trip: p50 %.3fms p99 %.3fms p99.9 %.3fms max %.3fms",
+                        summary["p50"], summary["p99"], summary["p99.9"], summary["max"])
+        for name, histogram in sorted(self.actuators.items()):
+            summary = histogram.summary()
+            if summary["count"]:
+                logger.info("  %s: %s responses, p50 %.3fms p99 %.3fms max %.3fms",
+                            name, summary["count"], summary["p50"], summary["p99"], summary["max"])
+
+
+class CommandDriver():
+    """
+    Sends toggle commands round-robin to the actuators in 'targets' (name -> actuator class).
+    At most 'concurrency' commands are outstanding at any time, a command without response
+    after 'timeout' seconds is counted as timed out.
+    """
+    def __init__(self, targets: dict, rate: float, concurrency: int = 100, timeout: float = 5.0,
+                 client_id: str = "command-driver"):
+        self.targets = targets
+        self.rate = rate
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        self.client.on_connect = self.__on_connect
+        self.client.on_message = self.__on_message
+        self.__condition = threading.Condition()
+        self.__pending = {}
+        self.__states = {name: False for name in targets}
+        self.__ids = itertools.count()
+        self.__reset()
+
+    def __reset(self):
+        self.sent = 0
+        self.received = 0
+        self.timeouts = 0
+        self.unmatched = 0
+        self.throttled = 0
+        self.histogram = Histogram()
+        self.actuators = {name: Histogram(5) for name in self.targets}
+
+    def connect(self):
+        """
+        Function to connect to the broker and subscribe to the state topics of all targets.
+        """
+        self.client.connect(mqttClient.host, mqttClient.port, keepalive=60)
+        self.client.loop_start()
+
+    def disconnect(self):
+        """
+        Function to disconnect from the broker.
+        """
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def __on_connect(self, client, userdata, flags, response_code, properties):
+        if response_code == 0:
+            client.subscribe([(mqttClient.main_topic + name, 0) for name in self.targets])
+        else:
+            logger.warning("Command driver failed to connect, return code %d", response_code)
+
+    def __on_message(self, client, userdata, message):
+        received_ns = time.monotonic_ns()
+        correlation = getattr(message.properties, "CorrelationData", None)
+        with self.__condition:
+            pending = self.__pending.pop(correlation, None) if correlation else None
+            if pending is None:
+                self.unmatched += 1
+                return
+            sent_ns, name = pending
+            self.received += 1
+            self.histogram.record(received_ns - sent_ns)
+            self.actuators[name].record(received_ns - sent_ns)
+            self.__condition.notify()
+
+    def __expire(self, now_ns: int):
+        # called with the condition held
+        deadline = now_ns - int(self.timeout * 1e9)
+        expired = [correlation for correlation, (sent_ns, _) in self.__pending.items() if sent_ns < deadline]
+        for correlation in expired:
+            del self.__pending[correlation]
+        self.timeouts += len(expired)
+
+    def __prepare(self, name: str):
+        # called with the condition held, the command is pending before it is published
+        self.__states[name] = not self.__states[name]
+        payload = toggle_command(self.targets[name], self.__states[name])
+        correlation = CORRELATION.pack(next(self.__ids))
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.CorrelationData = correlation
+        self.__pending[correlation] = (time.monotonic_ns(), name)
+        self.sent += 1
+        return mqttClient.main_topic + name + "/toggleState", payload, properties
+
+    def run(self, duration: float) -> CommandReport:
+        """
+        Function to send commands for 'duration' seconds and wait for the outstanding responses.
+        While all 'concurrency' slots are taken the driver waits, afterwards it continues
+        at the configured rate instead of bursting the skipped commands.
+        """
+        self.__reset()
+        names = itertools.cycle(sorted(self.targets))
+        interval = 1 / self.rate
+        started = time.monotonic()
+        end = started + duration
+        deadline = started
+        while deadline < end:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            with self.__condition:
+                self.__expire(time.monotonic_ns())
+                if len(self.__pending) >= self.concurrency:
+                    # waiting 'timeout' seconds at most frees at least the oldest slot
+                    self.throttled += 1
+                    self.__condition.wait_for(lambda: len(self.__pending) < self.concurrency,
+                                              timeout=min(self.timeout, max(0.0, end - time.monotonic())))
+                    self.__expire(time.monotonic_ns())
+                    if len(self.__pending) >= self.concurrency:
+                        if time.monotonic() >= end:
+                            break
+                        continue
+                    deadline = time.monotonic()
+                topic, payload, properties = self.__prepare(next(names))
+            self.client.publish(topic, payload=payload, qos=0, properties=properties)
+            deadline += interval
+        with self.__condition:
+            self.__condition.wait_for(lambda: not self.__pending, timeout=self.timeout)
+            self.__expire(time.monotonic_ns() + int(self.timeout * 1e9))
+            return CommandReport(time.monotonic() - started, self.sent, self.received, self.timeouts,
+                                 self.unmatched, self.throttled, self.histogram, self.actuators)
+
+
+def parse_actuators(spec: str) -> dict:
+    """
+    Function for parsing 'led-bulb:10,thermostat:5' into actuator names and classes.
+    """
+    targets = {}
+    for entry in spec.split(","):
+        kind, _, count = entry.partition(":")
+        for index in range(1, int(count or 1) + 1):
+            targets[f"{kind}{index}"] = ACTUATORS[kind]
+    return targets
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level="INFO")
+    parser = argparse.ArgumentParser(description="Round-trip benchmark of the actuator toggle commands.")
+    parser.add_argument("--broker-host", default=mqttClient.host, help="address of the MQTT broker")
+    parser.add_argument("--broker-port", type=int, default=mqttClient.port, help="port of the MQTT broker")
+    parser.add_argument("--local-broker", action="store_true",
+                        help="run an embedded broker on localhost instead of connecting to --broker-host")
+    parser.add_argument("--actuators", default="led-bulb:5",
+                        help=f"comma separated <type>:<count>, types: {', '.join(ACTUATORS)}")
+    parser.add_argument("--rate", type=float, default=50, help="commands per second across all actuators")
+    parser.add_argument("--concurrency", type=int, default=100, help="maximum number of outstanding commands")
+    parser.add_argument("--timeout", type=float, default=5, help="seconds until a command counts as timed out")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to send commands")
+    parser.add_argument("--spawn", action="store_true", help="simulate the actuators within this process")
+    args = parser.parse_args()
+    mqttClient.host, mqttClient.port = args.broker_host, args.broker_port
+    local_broker = None
+    if args.local_broker:
+        local_broker = BrokerThread("127.0.0.1", 0)
+        local_broker.start()
+        mqttClient.host, mqttClient.port = local_broker.host, local_broker.port
+
+    targets = parse_actuators(args.actuators)
+    spawned = []
+    if args.spawn:
+        for actuator_name, actuator_class in targets.items():
+            actuator = actuator_class(actuator_name, start=False)
+            actuator.connect()
+            actuator.client.loop_start()
+            spawned.append(actuator)
+    driver = CommandDriver(targets, args.rate, args.concurrency, args.timeout)
+    driver.connect()
+    # wait for the subscriptions of driver and actuators
+    time.sleep(1)
+    driver.run(args.duration).log()
+    driver.disconnect()
+    for actuator in spawned:
+        actuator.client.disconnect()
+        actuator.client.loop_stop()
+    if local_broker:
+        local_broker.stop()
@@ -0,0 +1,243 @@
+"""
+Module for driving a large number of simulated MQTT clients from a single asyncio event loop.
+Instead of one paho network thread plus one simulation thread per device, every client socket
+is registered with the event loop and the sensor ticks are issued by one scheduler task.
+The existing sensor and actuator classes of run.py and mqttClient.py serve as device definitions,
+they only have to be constructed with start=False.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from scheduler import RateReport, RateScheduler
+
+logger = logging.getLogger('Evaluation')
+
+
+def network_client(device) -> mqtt.Client:
+    """
+    Function returning the paho client doing the network I/O for 'device',
+    devices sharing a pooled connection (see pool.py) share its client.
+    """
+    connection = getattr(device.client, "connection", None)
+    return connection.client if connection else device.client
+
+
+def network_clients(devices: list) -> list:
+    """
+    Function returning the unique paho clients doing the network I/O for 'devices'.
+    """
+    clients = {}
+    for device in devices:
+        client = network_client(device)
+        clients[id(client)] = client
+    return list(clients.values())
+
+
+def connected(devices: list) -> int:
+    """
+    Function returning the number of connected network clients of 'devices'.
+    """
+    return sum(client.is_connected() for client in network_clients(devices))
+
+
+def connect_threaded(devices: list, connect_rate: float = None, timeout: float = 30) -> bool:
+    """
+    Function to connect 'devices' one after another at 'connect_rate' connections per second
+    (None: as fast as possible) and start a paho network thread per connection.
+    Waits up to 'timeout' seconds for all connections to be acknowledged by the broker,
+    returns whether the whole fleet is connected.
+    """
+    started = time.monotonic()
+    looping = set()
+    for index, device in enumerate(devices):
+        if connect_rate:
+            time.sleep(max(0.0, started + index / connect_rate - time.monotonic()))
+        try:
+            device.connect()
+        except OSError as err:
+            logger.warning("%s failed to connect: %s", device.name, err)
+            continue
+        client = network_client(device)
+        if id(client) not in looping:
+            looping.add(id(client))
+            client.loop_start()
+    total = len(network_clients(devices))
+    deadline = time.monotonic() + timeout
+    while connected(devices) < total and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return _log_ramp_up(devices, total, started)
+
+
+def _log_ramp_up(devices: list, total: int, started: float) -> bool:
+    count = connected(devices)
+    if count < total:
+        logger.warning("Only %s of %s connections established after %.1fs", count, total, time.monotonic() - started)
+        return False
+    logger.info("%s connections established in %.1fs", total, time.monotonic() - started)
+    return True
+
+
+def reset_counters(devices: list):
+    """
+    Function to reset the publish, in-flight window and report-by-exception counters of 'devices',
+    e.g. at the end of the warm-up.
+    """
+    for device in devices:
+        device.published = 0
+        device.errors = 0
+        device.wire_bytes = 0
+        if getattr(device, "window", None):
+            device.window.reset()
+        if getattr(device, "reporter", None):
+            device.reporter.reset()
+
+
+class AsyncioHelper():
+    """
+    Bridges the socket callbacks of paho.mqtt.client to an asyncio event loop.
+    Replaces the network thread started by loop_start() with reader/writer registrations.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self.loop = loop
+        self.client = client
+        self.thread_id = threading.get_ident()
+        client.on_socket_open = self.__on_socket_open
+        client.on_socket_close = self.__on_socket_close
+        client.on_socket_register_write = self.__on_socket_register_write
+        client.on_socket_unregister_write = self.__on_socket_unregister_write
+
+    def __call(self, func, *args):
+        # connect() runs in an executor thread, the event loop must only be touched from its own thread
+        if threading.get_ident() == self.thread_id:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def __on_socket_open(self, client, userdata, sock):
+        self.__call(self.loop.add_reader, sock, client.loop_read)
+
+    def __on_socket_close(self, client, userdata, sock):
+        self.__call(self.loop.remove_reader, sock)
+
+    def __on_socket_register_write(self, client, userdata, sock):
+        self.__call(self.loop.add_writer, sock, client.loop_write)
+
+    def __on_socket_unregister_write(self, client, userdata, sock):
+        self.__call(self.loop.remove_writer, sock)
+
+
+class DeviceEngine():
+    """
+    Runs a fleet of simulated devices within one event loop.
+    Devices providing tick() and next_interval() are treated as sensors and ticked periodically,
+    all other devices (i.e. actuators) only react to incoming messages.
+    The sensor ticks are issued by one shared RateScheduler.
+    Connections are opened at 'connect_rate' connections per second at most (None: unlimited).
+    """
+    def __init__(self, devices: list, connect_concurrency: int = 64, connect_rate: float = None,
+                 connect_timeout: float = 30):
+        self.devices = list(devices)
+        self.connect_concurrency = connect_concurrency
+        self.connect_rate = connect_rate
+        self.connect_timeout = connect_timeout
+        self.alive = False
+        self.scheduler = RateScheduler()
+        self.__clients = []
+        self.__tasks = []
+
+    async def connect(self):
+        """
+        Function to attach all devices to the running event loop and connect them to the broker.
+        The blocking TCP handshake of paho is offloaded to the default executor,
+        bounded by 'connect_concurrency' and paced by 'connect_rate'.
+        Returns once all connections are acknowledged by the broker or after 'connect_timeout' seconds,
+        with whether the whole fleet is connected.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.connect_concurrency)
+        self.__clients = network_clients(self.devices)
+        for client in self.__clients:
+            AsyncioHelper(loop, client)
+        started = time.monotonic()
+
+        async def connect_one(index, device):
+            if self.connect_rate:
+                await asyncio.sleep(max(0.0, started + index / self.connect_rate - time.monotonic()))
+            async with semaphore:
+                try:
+                    await loop.run_in_executor(None, device.connect)
+                except OSError as err:
+                    logger.warning("%s failed to connect: %s", device.name, err)
+
+        await asyncio.gather(*(connect_one(index, device) for index, device in enumerate(self.devices)))
+        deadline = time.monotonic() + self.connect_timeout
+        while connected(self.devices) < len(self.__clients) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return _log_ramp_up(self.devices, len(self.__clients), started)
+
+    async def __misc_loop(self):
+        # one shared task handles keepalive and retries for all clients
+        while self.alive:
+            for client in self.__clients:
+                client.loop_misc()
+            await asyncio.sleep(1)
+
+    def start(self):
+        """
+        Function to start the keepalive handling and the simulation of all sensors.
+        """
+        self.alive = True
+        self.__tasks.append(asyncio.create_task(self.__misc_loop()))
+        for device in self.devices:
+            if hasattr(device, "tick"):
+                self.scheduler.add(device)
+        self.__tasks.append(asyncio.create_task(self.scheduler.run_async()))
+
+    def reset(self):
+        """
+        Function to restart the measurement of a running engine, e.g. at the end of the warm-up.
+        """
+        self.scheduler.reset()
+        reset_counters(self.devices)
+
+    async def stop(self) -> RateReport:
+        """
+        Function to stop all simulations and disconnect the clients.
+        Returns the requested vs. achieved tick rate of the sensors.
+        """
+        self.alive = False
+        self.scheduler.stop()
+        report = self.scheduler.report()
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+        for client in self.__clients:
+            client.disconnect()
+        # give the event loop a chance to flush the DISCONNECT packets
+        await asyncio.sleep(0.1)
+        return report
+
+    async def run(self, duration: float, warmup: float = 0, on_measure=None) -> RateReport:
+        """
+        Function to connect all devices, simulate them for 'warmup' plus 'duration' seconds and
+        disconnect them again. Only the last 'duration' seconds are measured, 'on_measure' is called
+        when the measurement starts.
+        """
+        await self.connect()
+        self.start()
+        try:
+            if warmup:
+                await asyncio.sleep(warmup)
+                self.reset()
+            if on_measure:
+                on_measure()
+            await asyncio.sleep(duration)
+        finally:
+            report = await self.stop()
+        return report
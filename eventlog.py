@@ -0,0 +1,134 @@
+"""
+Module for logging without slowing down the message hot path.
+Log records can be handed to a queue that a background thread writes to the console or a file,
+optionally as JSON lines. Per-message events (publish, ack, received message) are disabled by
+default. When enabled, they are sampled per event type and rate limited. A disabled event costs
+one attribute lookup at the call site:
+
+    if EVENTS.publish:
+        EVENTS.publish("%s published %s", name, correlation_data, device=name)
+"""
+
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import time
+
+logger = logging.getLogger('Evaluation')
+
+EVENT_TYPES = ("publish", "ack", "message")
+
+
+class EventSampler():
+    """
+    Logs every 'every'-th occurrence of event 'event' at INFO level, at most 'rate' records per second
+    (None: unlimited). The number of occurrences skipped since the last record is attached to every record.
+    Counting is not synchronized, under contention a few occurrences may be counted twice or not at all.
+    """
+    __slots__ = ("event", "every", "rate", "seen", "skipped", "tokens", "updated")
+
+    def __init__(self, event: str, every: int = 1, rate: float = None):
+        self.event = event
+        self.every = max(1, every)
+        self.rate = rate
+        self.seen = 0
+        self.skipped = 0
+        self.tokens = rate or 0.0
+        self.updated = time.monotonic()
+
+    def __call__(self, message: str, *args, device: str = None):
+        self.seen += 1
+        if self.seen % self.every:
+            self.skipped += 1
+            return
+        if self.rate:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.skipped += 1
+                return
+            self.tokens -= 1
+        skipped, self.skipped = self.skipped, 0
+        logger.info(message, *args, extra={"event": self.event, "device": device, "skipped": skipped})
+
+
+class HotPathEvents():
+    """
+    One attribute per event type of EVENT_TYPES, None while the event is disabled.
+    """
+    def __init__(self):
+        self.publish = None
+        self.ack = None
+        self.message = None
+
+    def configure(self, sampling: dict, rate: float = None):
+        """
+        Function to enable the events in 'sampling' (event type -> fraction of occurrences to log),
+        each limited to 'rate' records per second. All other events are disabled.
+        """
+        for event in EVENT_TYPES:
+            fraction = sampling.get(event, 0)
+            setattr(self, event, EventSampler(event, round(1 / fraction), rate) if fraction > 0 else None)
+
+
+# hot-path events of this process
+EVENTS = HotPathEvents()
+
+
+def parse_sampling(spec: str) -> dict:
+    """
+    Function for parsing 'publish=0.01,message=1' into event types and sampled fractions,
+    an event without fraction is logged completely.
+    """
+    sampling = {}
+    for entry in filter(None, spec.split(",")):
+        event, _, fraction = entry.partition("=")
+        if event not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type '{event}', choose from {', '.join(EVENT_TYPES)}")
+        sampling[event] = float(fraction or 1)
+    return sampling
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as JSON lines with time, level, process, message and the event fields, if any.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage()}
+        for field in ("event", "device", "skipped"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(log: logging.Logger, file: str = None, structured: bool = False,
+                      queued: bool = False) -> logging.handlers.QueueListener:
+    """
+    Function to replace the handlers of 'log' by a handler writing to 'file' (default: the console),
+    formatted as JSON lines if 'structured'. With 'queued', records are put on a queue and written
+    by a background thread, the returned listener has to be stopped to flush it.
+    The queue is a multiprocessing queue, so forked worker processes can log through it as well.
+    """
+    handler = logging.FileHandler(file, encoding="utf-8") if file else logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if structured else
+                         logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    for existing in list(log.handlers):
+        log.removeHandler(existing)
+    if not queued:
+        log.addHandler(handler)
+        return None
+    queue = multiprocessing.Queue(-1)
+    log.addHandler(logging.handlers.QueueHandler(queue))
+    listener = logging.handlers.QueueListener(queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,306 @@
+"""
+Module for splitting a simulated fleet across several worker processes, one per core.
+Every worker owns a slice of the device names and drives it with the asyncio DeviceEngine.
+The parent starts and stops every evaluation step in all workers at once and merges
+the per-worker counters into a single report.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from engine import DeviceEngine
+from metrics import start_http_server
+from pool import ConnectionPool
+from profiler import SamplingProfiler
+from readings import attach_readings
+from reporting import log_reporting
+from scheduler import RateReport
+from tracefile import TRACE
+
+logger = logging.getLogger('Evaluation')
+
+
+def split_names(names: list, shards: int) -> list:
+    """
+    Function for splitting 'names' into 'shards' slices of (almost) equal size.
+    """
+    return [names[index::shards] for index in range(shards)]
+
+
+def device_counters(devices: list) -> dict:
+    """
+    Function returning the counters (published, errors, dropped, throttled seconds, bytes on the wire)
+    of 'devices' by name. Messages are dropped and time is throttled by a full in-flight window
+    (see backpressure.py), the bytes are the size of the PUBLISH packets (see wire.py).
+    """
+    counters = {}
+    for device in devices:
+        window = getattr(device, "window", None)
+        counters[device.name] = (device.published, device.errors,
+                                 window.dropped if window else 0, window.throttled if window else 0.0,
+                                 getattr(device, "wire_bytes", 0))
+    return counters
+
+
+async def _run_worker_step(device_class, names, interval, options, start_barrier, measure_event, stop_event,
+                           profiler=None):
+    pool = ConnectionPool(options["devices_per_connection"]) if options["devices_per_connection"] else None
+    devices = []
+    for name in names:
+        device = device_class(name, interval, start=False)
+        if pool:
+            # frees the replaced paho client before the next device is constructed
+            pool.attach(device)
+        devices.append(device)
+    if options["readings"]:
+        attach_readings(devices, **options["readings"])
+    engine = DeviceEngine(devices, connect_rate=options["connect_rate"], connect_timeout=options["connect_timeout"])
+    await engine.connect()
+    loop = asyncio.get_running_loop()
+    try:
+        # all workers are connected before any of them starts publishing
+        await loop.run_in_executor(None, start_barrier.wait)
+        engine.start()
+        await loop.run_in_executor(None, measure_event.wait)
+        engine.reset()
+        if profiler:
+            profiler.start()
+        await loop.run_in_executor(None, stop_event.wait)
+    finally:
+        if profiler:
+            profiler.stop()
+        report = await engine.stop()
+    log_reporting(devices)
+    return device_counters(devices), report
+
+
+def _worker(index, device_class, names, options, commands, results, start_barrier, measure_event, stop_event):
+    if options["metrics_port"] is not None:
+        start_http_server(options["metrics_port"] + index)
+    if options["trace"]:
+        TRACE.start(f"{options['trace']}.{index}")
+    readings = options["readings"]
+    if readings and readings.get("seed") is not None:
+        # every worker gets its own reproducible stream
+        options = dict(options, readings=dict(readings, seed=readings["seed"] + index))
+    step = 0
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        interval, profile = command
+        step += 1
+        if readings:
+            options = dict(options, readings=dict(options["readings"], step=step))
+        profiler = SamplingProfiler(profile["interval"], profile["mode"]) if profile else None
+        try:
+            counters, report = asyncio.run(
+                _run_worker_step(device_class, names, interval, options, start_barrier, measure_event, stop_event,
+                                 profiler))
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Worker %s failed: %s", index, err)
+            start_barrier.abort()
+            counters, report = {}, RateReport(0.0, 0, 0, 0.0, 0.0)
+        if profiler:
+            profiler.save(f"{profile['path']}.{index}")
+        results.put((index, counters, report))
+    TRACE.stop()
+
+
+class StepReport():
+    """
+    Merged counters of all workers for a single evaluation step.
+    Runs within a single process are reported as worker 0.
+    """
+    def __init__(self, interval: int, duration: float, workers: dict, rates: dict):
+        self.interval = interval
+        self.duration = duration
+        self.workers = workers
+        self.rates = rates
+
+    @property
+    def devices(self) -> dict:
+        """
+        Counters (published, errors, dropped, throttled seconds, bytes on the wire) per device across all workers.
+        """
+        merged = {}
+        for counters in self.workers.values():
+            merged.update(counters)
+        return merged
+
+    @property
+    def published(self) -> int:
+        """
+        Number of messages published by all devices.
+        """
+        return sum(counters[0] for counters in self.devices.values())
+
+    @property
+    def errors(self) -> int:
+        """
+        Number of failed publish calls of all devices.
+        """
+        return sum(counters[1] for counters in self.devices.values())
+
+    @property
+    def dropped(self) -> int:
+        """
+        Number of messages dropped by full in-flight windows of all devices.
+        """
+        return sum(counters[2] for counters in self.devices.values())
+
+    @property
+    def throttled(self) -> float:
+        """
+        Seconds the in-flight windows of all devices were full, summed over the devices.
+        """
+        return sum(counters[3] for counters in self.devices.values())
+
+    @property
+    def wire_bytes(self) -> int:
+        """
+        Size of the PUBLISH packets of all devices in bytes.
+        """
+        return sum(counters[4] for counters in self.devices.values())
+
+    @property
+    def bytes_per_message(self) -> float:
+        """
+        Average size of a PUBLISH packet in bytes.
+        """
+        return self.wire_bytes / self.published if self.published else 0.0
+
+    @property
+    def rate(self) -> float:
+        """
+        Achieved publish rate of the whole fleet in messages per second.
+        """
+        return self.published / self.duration if self.duration else 0.0
+
+    @property
+    def rate_report(self) -> RateReport:
+        """
+        Requested vs. achieved tick rate of all workers combined.
+        """
+        merged = RateReport(0.0, 0, 0, 0.0, 0.0)
+        for report in self.rates.values():
+            merged = merged.merge(report)
+        return merged
+
+    def log(self):
+        """
+        Function to log the report including a per-worker breakdown.
+        """
+        logger.info("Step with interval %s: %s devices published %s messages (%s errors) in %.1fs, %.1f msg/s",
+                    self.interval, len(self.devices), self.published, self.errors, self.duration, self.rate)
+        if self.published:
+            logger.info("PUBLISH packets: %s bytes on the wire, %.1f bytes per message", self.wire_bytes,
+                        self.bytes_per_message)
+        if self.dropped or self.throttled:
+            logger.info("In-flight windows dropped %s messages, devices were throttled for %.1fs in total",
+                        self.dropped, self.throttled)
+        self.rate_report.log()
+        if len(self.workers) == 1:
+            return
+        for index, counters in sorted(self.workers.items()):
+            logger.info("  worker %s: %s devices, %s messages, %s errors, %.1f of %.1f ticks/s", index, len(counters),
+                        sum(device[0] for device in counters.values()),
+                        sum(device[1] for device in counters.values()),
+                        self.rates[index].achieved_rate, self.rates[index].requested_rate)
+
+
+class ShardedFleet():
+    """
+    Fleet of simulated devices sharded across 'processes' worker processes, 'device_class' is
+    called as device_class(name, interval, start=False) to construct them (e.g. Scenario.create).
+    With 'readings' (keyword arguments of attach_readings()), every worker generates the readings
+    of its devices in batches. With 'devices_per_connection', the devices of every worker share
+    a pool of connections. The workers share the 'connect_rate' and wait up to 'connect_timeout'
+    seconds for their connections before a step starts. With 'metrics_port', worker 'index'
+    serves its live metrics on port 'metrics_port' + 'index'. With 'trace', worker 'index' records
+    the messages of its devices to the trace file 'trace'.'index' (see tracefile.py).
+    """
+    def __init__(self, device_class, names: list, processes: int = None, readings: dict = None,
+                 devices_per_connection: int = 0, connect_rate: float = None, connect_timeout: float = 30,
+                 metrics_port: int = None, trace: str = None):
+        self.device_class = device_class
+        self.processes = min(processes or os.cpu_count() or 1, len(names))
+        self.shards = split_names(names, self.processes)
+        self.options = {
+            "readings": readings,
+            "devices_per_connection": devices_per_connection,
+            "connect_rate": connect_rate / self.processes if connect_rate else None,
+            "connect_timeout": connect_timeout,
+            "metrics_port": metrics_port,
+            "trace": trace}
+        self.__workers = []
+        self.__commands = []
+        self.__results = multiprocessing.Queue()
+        self.__start_barrier = multiprocessing.Barrier(self.processes + 1)
+        self.__measure_event = multiprocessing.Event()
+        self.__stop_event = multiprocessing.Event()
+
+    def start(self):
+        """
+        Function to spawn one worker process per shard.
+        """
+        for index, names in enumerate(self.shards):
+            commands = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                name=f"fleet-worker{index}", target=_worker, daemon=True,
+                args=(index, self.device_class, names, self.options, commands, self.__results,
+                      self.__start_barrier, self.__measure_event, self.__stop_event))
+            worker.start()
+            self.__commands.append(commands)
+            self.__workers.append(worker)
+        logger.info("Started %s fleet workers for %s devices", self.processes, sum(len(s) for s in self.shards))
+
+    def run_step(self, interval: int, duration: float, warmup: float = 0, on_measure=None,
+                 profile: dict = None) -> StepReport:
+        """
+        Function to run one evaluation step in all workers simultaneously. Once all workers are
+        connected, the devices run for 'warmup' seconds before the 'duration' seconds of measurement,
+        'on_measure' is called when the measurement starts. With 'profile' ('path', 'interval' and
+        'mode', see profiler.py), worker 'index' profiles the measurement and writes 'path'.'index'.*.
+        """
+        self.__measure_event.clear()
+        self.__stop_event.clear()
+        for commands in self.__commands:
+            commands.put((interval, profile))
+        started = time.monotonic()
+        try:
+            self.__start_barrier.wait()
+            time.sleep(warmup)
+            self.__measure_event.set()
+            started = time.monotonic()
+            if on_measure:
+                on_measure()
+            time.sleep(duration)
+        except threading.BrokenBarrierError:
+            logger.error("Step with interval %s aborted, at least one worker failed", interval)
+        self.__measure_event.set()
+        self.__stop_event.set()
+        stopped = time.monotonic()
+        workers = {}
+        rates = {}
+        for _ in self.__workers:
+            index, counters, report = self.__results.get()
+            workers[index] = counters
+            rates[index] = report
+        self.__start_barrier.reset()
+        return StepReport(interval, stopped - started, workers, rates)
+
+    def close(self):
+        """
+        Function to shut down all worker processes.
+        """
+        for commands in self.__commands:
+            commands.put(None)
+        for worker in self.__workers:
+            worker.join()
+        self.__workers = []
+        self.__commands = []
@@ -0,0 +1,519 @@
+"""
+Module for benchmarking the consumer side: an ingest sink draining the device topics into a columnar store.
+paho's network thread only timestamps and queues every message. A writer thread takes the queued
+messages in batches, every 'flush_interval' seconds or once 'batch_size' messages are waiting, decodes
+them and appends them to the current segment of the store:
+- one column each for reception time, device, topic, transport latency (publish to reception, if the
+  CorrelationData holds a latency stamp) and sequence number (if any)
+- one column per payload field, JSON payloads of a batch are parsed by a single json.loads() call,
+  missing fields (e.g. of delta payloads, see reporting.py) are null
+- the raw payload of messages that are not JSON objects (e.g. the struct encoding)
+Segments are rolled every 'roll' seconds. With pyarrow, they are Parquet files with one row group per
+batch, a new field also starts a new segment. Without it, they are files of the append-only format below:
+
+    header   "MQTTCOLS", version (uint16)
+    batch    rows (uint32), columns (uint16), per column:
+             name length (uint16), UTF-8 name, kind (uint8), data length (uint32), data
+
+Integers are int64 (null: -2**63), floats float64 (null: NaN), booleans uint8 (null: 255), strings and
+binaries a uint32 length per row (null: 2**32 - 1) followed by the values. All integers are little endian.
+Per evaluation step, the sink reports how many of the published messages it received and stored, how
+busy the writer was and how long messages took from reception (and from publishing) until they were stored.
+"""
+
+from array import array
+from datetime import datetime
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from latency import Histogram, decode_latency
+from sequence import read_sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger('Evaluation')
+
+FORMATS = ("parquet", "columns")
+MAGIC = b"MQTTCOLS"
+VERSION = 1
+KIND_INT, KIND_FLOAT, KIND_BOOL, KIND_STRING, KIND_BINARY = range(1, 6)
+# columns of every message, payload fields with the same name are stored as 'payload.<field>'
+MESSAGE_COLUMNS = ("received_ns", "device", "topic", "latency_ns", "sequence", "payload")
+
+_HEADER = struct.Struct("<8sH")
+_BATCH = struct.Struct("<IH")
+_NAME = struct.Struct("<H")
+_COLUMN = struct.Struct("<BI")
+_NULL_INT = -2**63
+_NULL_BOOL = 255
+_NULL_LENGTH = 2**32 - 1
+
+
+def column_kind(values: list) -> int:
+    """
+    Function returning the kind of a payload field column: bool if all values are booleans,
+    float if all are numbers, otherwise string (values other than strings as JSON), None if all are null.
+    """
+    kind = None
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            kind = kind or KIND_BOOL
+        elif isinstance(value, (int, float)):
+            kind = KIND_FLOAT if kind in (None, KIND_BOOL, KIND_FLOAT) else KIND_STRING
+        else:
+            return KIND_STRING
+    return kind
+
+
+def decode_batch(messages: list) -> dict:
+    """
+    Function decoding the (reception time in monotonic nanoseconds, paho MQTTMessage) tuples 'messages'
+    into columns, a dict of column name to (kind, values). Columns without any value are left out.
+    """
+    count = len(messages)
+    topics = [message.topic for _, message in messages]
+    received = [received_ns for received_ns, _ in messages]
+    columns = {"received_ns": (KIND_INT, received),
+               "device": (KIND_STRING, [topic.split("/", 2)[1] if "/" in topic else topic for topic in topics]),
+               "topic": (KIND_STRING, topics)}
+    latencies = []
+    sequences = []
+    # wall clock of the monotonic clock's zero, for the legacy datetime stamps
+    offset = time.time_ns() - time.monotonic_ns()
+    for received_ns, message in messages:
+        properties = message.properties
+        stamp = getattr(properties, "CorrelationData", None)
+        latency = None
+        if stamp:
+            latency = decode_latency(stamp, received_ns,
+                                     None if len(stamp) == 8 else datetime.fromtimestamp((received_ns + offset) / 1e9))
+        latencies.append(latency)
+        sequences.append(read_sequence(properties))
+    if any(latency is not None for latency in latencies):
+        columns["latency_ns"] = (KIND_INT, latencies)
+    if any(sequence is not None for sequence in sequences):
+        columns["sequence"] = (KIND_INT, sequences)
+    payloads = [message.payload for _, message in messages]
+    indexes = [index for index, payload in enumerate(payloads) if payload[:1] == b"{"]
+    try:
+        records = json.loads(b"[" + b",".join([payloads[index] for index in indexes]) + b"]")
+    except ValueError:
+        # a broken payload spoils the batch, decode one by one
+        records = []
+        for index in list(indexes):
+            try:
+                records.append(json.loads(payloads[index]))
+            except ValueError:
+                indexes.remove(index)
+    fields = {}
+    raw = list(payloads)
+    for index, record in zip(indexes, records):
+        if not isinstance(record, dict):
+            continue
+        raw[index] = None
+        for field, value in record.items():
+            values = fields.get(field)
+            if values is None:
+                values = fields[field] = [None] * count
+            values[index] = value
+    if any(payload is not None for payload in raw):
+        columns["payload"] = (KIND_BINARY, raw)
+    for field, values in fields.items():
+        kind = column_kind(values)
+        if kind is None:
+            # null in every row
+            continue
+        if kind == KIND_STRING:
+            values = [value if value is None or isinstance(value, str) else json.dumps(value) for value in values]
+        columns[f"payload.{field}" if field in MESSAGE_COLUMNS else field] = (kind, values)
+    return columns
+
+
+def encode_column(kind: int, values: list) -> bytes:
+    """
+    Function encoding the 'values' of a column of 'kind' in the format of ColumnSegment.
+    """
+    if kind in (KIND_INT, KIND_FLOAT):
+        if kind == KIND_INT:
+            numbers = array('q', [_NULL_INT if value is None else value for value in values])
+        else:
+            numbers = array('d', [math.nan if value is None else value for value in values])
+        if sys.byteorder == "big":
+            numbers.byteswap()
+        return numbers.tobytes()
+    if kind == KIND_BOOL:
+        return bytes([_NULL_BOOL if value is None else value for value in values])
+    encoded = [value.encode('utf-8') if isinstance(value, str) else value for value in values]
+    lengths = array('I', [_NULL_LENGTH if value is None else len(value) for value in encoded])
+    if sys.byteorder == "big":
+        lengths.byteswap()
+    return lengths.tobytes() + b"".join([value for value in encoded if value is not None])
+
+
+def decode_column(kind: int, rows: int, data: bytes) -> list:
+    """
+    Function decoding a column encoded by encode_column() back into its values.
+    """
+    if kind in (KIND_INT, KIND_FLOAT):
+        values = array('q' if kind == KIND_INT else 'd', data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        if kind == KIND_INT:
+            return [None if value == _NULL_INT else value for value in values]
+        return [None if math.isnan(value) else value for value in values]
+    if kind == KIND_BOOL:
+        return [None if value == _NULL_BOOL else bool(value) for value in data]
+    lengths = array('I', data[:rows * 4])
+    if sys.byteorder == "big":
+        lengths.byteswap()
+    values = []
+    offset = rows * 4
+    for length in lengths:
+        if length == _NULL_LENGTH:
+            values.append(None)
+            continue
+        value = data[offset:offset + length]
+        values.append(value.decode('utf-8') if kind == KIND_STRING else value)
+        offset += length
+    return values
+
+
+class ColumnSegment():
+    """
+    Segment file 'path' of the built-in append-only columnar format, every write appends one batch.
+    """
+    suffix = ".cols"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self.__file = open(path, "wb")
+        self.__file.write(_HEADER.pack(MAGIC, VERSION))
+
+    def accepts(self, columns: dict) -> bool:
+        """
+        Function returning whether 'columns' can be appended, batches may have different columns.
+        """
+        return True
+
+    def write(self, columns: dict, rows: int):
+        """
+        Function to append a batch of 'rows' rows in 'columns' (see decode_batch()) and flush it to the file.
+        """
+        parts = [_BATCH.pack(rows, len(columns))]
+        for name, (kind, values) in columns.items():
+            encoded = name.encode('utf-8')
+            data = encode_column(kind, values)
+            parts += [_NAME.pack(len(encoded)), encoded, _COLUMN.pack(kind, len(data)), data]
+        self.__file.write(b"".join(parts))
+        self.__file.flush()
+        self.rows += rows
+
+    def close(self) -> int:
+        """
+        Function to close the segment and return its size in bytes.
+        """
+        self.__file.close()
+        return os.path.getsize(self.path)
+
+
+class ParquetSegment():
+    """
+    Parquet file 'path' written with pyarrow, every write adds one row group.
+    The schema is fixed by the first write, batches with other columns need a new segment.
+    """
+    suffix = ".parquet"
+
+    def __init__(self, path: str):
+        if pa is None:
+            raise ImportError("Writing Parquet segments requires pyarrow")
+        self.path = path
+        self.rows = 0
+        self.__schema = None
+        self.__writer = None
+
+    @staticmethod
+    def __type(kind: int):
+        return {KIND_INT: pa.int64(), KIND_FLOAT: pa.float64(), KIND_BOOL: pa.bool_(),
+                KIND_STRING: pa.string(), KIND_BINARY: pa.binary()}[kind]
+
+    def accepts(self, columns: dict) -> bool:
+        """
+        Function returning whether 'columns' fit the schema of the segment, missing columns are written as nulls.
+        """
+        if self.__schema is None:
+            return True
+        names = self.__schema.names
+        return all(name in names and self.__schema.field(name).type == self.__type(kind)
+                   for name, (kind, _) in columns.items())
+
+    def write(self, columns: dict, rows: int):
+        """
+        Function to write a batch of 'rows' rows in 'columns' (see decode_batch()) as row group.
+        """
+        if self.__writer is None:
+            self.__schema = pa.schema([(name, self.__type(kind)) for name, (kind, _) in columns.items()])
+            self.__writer = pq.ParquetWriter(self.path, self.__schema)
+        nulls = [None] * rows
+        arrays = [pa.array(columns[field.name][1] if field.name in columns else nulls, type=field.type)
+                  for field in self.__schema]
+        self.__writer.write_table(pa.Table.from_arrays(arrays, schema=self.__schema))
+        self.rows += rows
+
+    def close(self) -> int:
+        """
+        Function to close the segment and return its size in bytes.
+        """
+        if self.__writer is None:
+            return 0
+        self.__writer.close()
+        return os.path.getsize(self.path)
+
+
+def read_segment(path: str) -> dict:
+    """
+    Function returning the columns of segment file 'path' as dict of column name to values.
+    Columns missing in some batches are padded with None.
+    """
+    if path.endswith(ParquetSegment.suffix):
+        if pq is None:
+            raise ImportError("Reading Parquet segments requires pyarrow")
+        return pq.read_table(path).to_pydict()
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < _HEADER.size or _HEADER.unpack_from(data, 0)[0] != MAGIC:
+        raise ValueError(f"{path} is not a column segment")
+    version = _HEADER.unpack_from(data, 0)[1]
+    if version != VERSION:
+        raise ValueError(f"Unsupported column segment version {version} of {path}")
+    columns = {}
+    total = 0
+    offset = _HEADER.size
+    while offset < len(data):
+        rows, count = _BATCH.unpack_from(data, offset)
+        offset += _BATCH.size
+        for _ in range(count):
+            length, = _NAME.unpack_from(data, offset)
+            offset += _NAME.size
+            name = data[offset:offset + length].decode('utf-8')
+            offset += length
+            kind, size = _COLUMN.unpack_from(data, offset)
+            offset += _COLUMN.size
+            values = columns.get(name)
+            if values is None:
+                values = columns[name] = [None] * total
+            values += decode_column(kind, rows, data[offset:offset + size])
+            offset += size
+        total += rows
+        for values in columns.values():
+            values += [None] * (total - len(values))
+    return columns
+
+
+class IngestSink():
+    """
+    MQTT subscriber storing all messages below 'topics' in segments below 'directory'
+    ('format' parquet or columns, default: parquet if pyarrow is installed).
+    """
+    def __init__(self, broker_url: str, broker_port: int, directory: str, topics: tuple = ("evaluation/#", "mind2/#"),
+                 batch_size: int = 5000, flush_interval: float = 1.0, roll: float = 60.0, format: str = None,
+                 client_id: str = "ingest-sink"):
+        # pylint: disable=redefined-builtin
+        format = format or ("parquet" if pa is not None else "columns")
+        if format not in FORMATS:
+            raise ValueError(f"Unknown ingest format '{format}', choose from {', '.join(FORMATS)}")
+        self.broker_url = broker_url
+        self.broker_port = broker_port
+        self.directory = directory
+        self.topics = topics
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.roll = roll
+        self.segment_type = ParquetSegment if format == "parquet" else ColumnSegment
+        self.step = None
+        self.segments = 0
+        self.bytes = 0
+        self.__segment = None
+        self.__opened = None
+        self.__pending = []
+        self.__writing = 0
+        self.__lock = threading.Lock()
+        self.__ready = threading.Event()
+        self.__idle = threading.Condition(self.__lock)
+        self.__stop = False
+        self.__thread = None
+        self.__reset()
+        os.makedirs(directory, exist_ok=True)
+        self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        self.client.on_connect = self.__on_connect
+        self.client.on_message = self.__on_message
+
+    def __reset(self):
+        # step counters, called with the lock held or before the writer runs
+        self.__started = time.monotonic_ns()
+        self.received = 0
+        self.written = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.__store_lag = Histogram()
+        self.__end_to_end = Histogram()
+
+    def start(self):
+        """
+        Function to start the writer thread, connect to the broker and start receiving in paho's network thread.
+        """
+        self.__thread = threading.Thread(name="ingest-writer", target=self.__run, daemon=True)
+        self.__thread.start()
+        self.client.connect(self.broker_url, self.broker_port, keepalive=60)
+        self.client.loop_start()
+        logger.info("Ingesting %s into %s segments below %s", ", ".join(self.topics),
+                    self.segment_type.suffix[1:], self.directory)
+
+    def stop(self):
+        """
+        Function to disconnect, store the messages still waiting and close the current segment.
+        """
+        self.client.disconnect()
+        self.client.loop_stop()
+        with self.__lock:
+            self.__stop = True
+        self.__ready.set()
+        self.__thread.join()
+        self.__close_segment()
+        logger.info("Ingested %s segments (%.1f MiB) into %s", self.segments, self.bytes / 2**20, self.directory)
+
+    def __on_connect(self, client, userdata, flags, response_code, properties):
+        if response_code == 0:
+            client.subscribe([(topic, 2) for topic in self.topics])
+        else:
+            logger.warning("Ingest sink failed to connect, return code %d", response_code)
+
+    def __on_message(self, client, userdata, message):
+        received_ns = time.monotonic_ns()
+        with self.__lock:
+            self.__pending.append((received_ns, message))
+            self.received += 1
+            full = len(self.__pending) >= self.batch_size
+        if full:
+            self.__ready.set()
+
+    def __run(self):
+        while True:
+            self.__ready.wait(self.flush_interval)
+            self.__ready.clear()
+            with self.__lock:
+                batch, self.__pending = self.__pending, []
+                self.__writing = len(batch)
+                stop = self.__stop
+            if batch:
+                try:
+                    self.__write(batch)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Ingest sink failed to store a batch of %s messages", len(batch))
+            with self.__lock:
+                self.__writing = 0
+                self.__idle.notify_all()
+            if stop:
+                return
+
+    def __write(self, batch: list):
+        started = time.perf_counter()
+        columns = decode_batch(batch)
+        now = time.monotonic()
+        if self.__segment is None or now - self.__opened >= self.roll or not self.__segment.accepts(columns):
+            self.__close_segment()
+            self.__opened = now
+            self.__segment = self.segment_type(os.path.join(
+                self.directory, f"ingest-{time.strftime('%Y%m%d-%H%M%S')}-{self.segments:04d}"
+                f"{self.segment_type.suffix}"))
+        self.__segment.write(columns, len(batch))
+        stored_ns = time.monotonic_ns()
+        busy = time.perf_counter() - started
+        received = columns["received_ns"][1]
+        latencies = columns["latency_ns"][1] if "latency_ns" in columns else [None] * len(batch)
+        with self.__lock:
+            # messages published (without a latency stamp: received) before the step started are stored,
+            # but not counted
+            started = self.__started
+            self.batches += 1
+            self.busy += busy
+            for received_ns, latency in zip(received, latencies):
+                if (received_ns if latency is None else received_ns - latency) >= started:
+                    self.written += 1
+                    self.__store_lag.record(stored_ns - received_ns)
+                    if latency is not None:
+                        self.__end_to_end.record(latency + stored_ns - received_ns)
+
+    def __close_segment(self):
+        if self.__segment is not None:
+            self.bytes += self.__segment.close()
+            self.segments += 1
+            self.__segment = None
+
+    def start_step(self, step):
+        """
+        Function to reset the counters and start measuring evaluation step 'step'.
+        """
+        with self.__lock:
+            self.step = step
+            self.__reset()
+
+    def finish_step(self, timeout: float = 10.0) -> dict:
+        """
+        Function to store the messages received so far, waiting at most 'timeout' seconds, and return the
+        summary of the current step: messages received since the step started, messages of the step
+        stored (published since it started, if the CorrelationData holds a latency stamp), the backlog
+        left after 'timeout', the time it took to catch up, batches, writer busy time and the lag from
+        reception and from publishing until stored (see latency.Histogram.summary()).
+        """
+        requested = time.monotonic()
+        self.__ready.set()
+        with self.__lock:
+            self.__idle.wait_for(lambda: not self.__pending and not self.__writing, timeout)
+            return {
+                "step": self.step,
+                "elapsed": requested - self.__started / 1e9,
+                "received": self.received,
+                "stored": self.written,
+                "backlog": len(self.__pending) + self.__writing,
+                "drain": time.monotonic() - requested,
+                "batches": self.batches,
+                "busy": self.busy,
+                "store_lag": self.__store_lag.summary(),
+                "end_to_end": self.__end_to_end.summary()}
+
+
+def log_ingest(summary: dict, report=None):
+    """
+    Function to log a summary as returned by IngestSink.finish_step(), compared to the producers of
+    'report' (fleet.StepReport) if given.
+    """
+    elapsed = report.duration if report else summary["elapsed"]
+    stored = summary["stored"]
+    produced = f" of {report.published} published" if report else ""
+    logger.info("Step %s ingest: %s messages received, %s%s stored in %s batches (%.1f msg/s%s), "
+                "backlog %s after %.3fs to catch up", summary["step"], summary["received"], stored, produced,
+                summary["batches"], stored / elapsed if elapsed else 0.0,
+                f" vs. {report.rate:.1f} msg/s produced" if report else "", summary["backlog"], summary["drain"])
+    if summary["busy"]:
+        logger.info("Step %s ingest writer busy %.3fs, %.0f msg/s when saturated", summary["step"],
+                    summary["busy"], stored / summary["busy"])
+    for name, label in (("store_lag", "reception"), ("end_to_end", "publishing")):
+        lag = summary[name]
+        if lag["count"]:
+            logger.info("Step %s ingest lag from %s to store: p50 %.3fms p99 %.3fms p99.9 %.3fms max %.3fms",
+                        summary["step"], label, lag["p50"], lag["p99"], lag["p99.9"], lag["max"])
@@ -0,0 +1,243 @@
+"""
+Module for measuring the end-to-end latency of the simulated messages.
+Publishers stamp the CorrelationData property of every message, a collector subscribed to the
+evaluation topics decodes the stamp on arrival and records the publish-to-receive latency in
+fixed-memory log-linear histograms (in the style of HdrHistogram), per device and per evaluation step.
+"""
+
+from array import array
+from datetime import datetime
+import logging
+import struct
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from sequence import SequenceAnalyzer, read_sequence
+
+logger = logging.getLogger('Evaluation')
+
+STAMP = struct.Struct(">q")
+
+
+def encode_stamp() -> bytes:
+    """
+    Function returning a compact 8 byte stamp of the current monotonic clock in nanoseconds.
+    The monotonic clock is shared by all processes of one host, so publisher and collector
+    have to run on the same machine.
+    """
+    return STAMP.pack(time.monotonic_ns())
+
+
+def decode_latency(stamp: bytes, received_ns: int, received_wall: datetime = None) -> int:
+    """
+    Function returning the latency in nanoseconds encoded by a correlation stamp.
+    Accepts the binary monotonic stamp as well as the legacy str(datetime.now()) stamp,
+    the latter is compared against 'received_wall' (default: now).
+    Returns None if the stamp cannot be decoded.
+    """
+    if len(stamp) == STAMP.size:
+        return received_ns - STAMP.unpack(stamp)[0]
+    try:
+        sent = datetime.fromisoformat(stamp.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    delta = (received_wall or datetime.now()) - sent
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+class Histogram():
+    """
+    Log-linear histogram with a fixed number of buckets.
+    Values below 2**'significant_bits' are recorded exactly, larger values with a relative
+    error of at most 2**(1 - 'significant_bits'). Values above 2**'max_bits' end up in the last bucket,
+    the exact maximum is tracked separately.
+    """
+    def __init__(self, significant_bits: int = 7, max_bits: int = 36):
+        self.significant_bits = significant_bits
+        self.max_bits = max_bits
+        self.__sub_count = 1 << significant_bits
+        self.__half = self.__sub_count >> 1
+        self.counts = array('L', bytes(array('L').itemsize * (self.__index(1 << max_bits) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __index(self, value: int) -> int:
+        if value < self.__sub_count:
+            return value
+        shift = value.bit_length() - self.significant_bits
+        return self.__sub_count + (shift - 1) * self.__half + (value >> shift) - self.__half
+
+    def __upper_value(self, index: int) -> int:
+        if index < self.__sub_count:
+            return index
+        shift = (index - self.__sub_count) // self.__half + 1
+        sub = (index - self.__sub_count) % self.__half + self.__half
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value: int):
+        """
+        Function to record a single (non-negative integer) value.
+        """
+        value = max(0, value)
+        self.counts[min(self.__index(value), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        """
+        Function to add the values of a histogram with the same layout.
+        """
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> int:
+        """
+        Function returning the value below which 'percentile' percent of the recorded values lie.
+        """
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.__upper_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        """
+        Mean of all recorded values.
+        """
+        return self.total / self.count if self.count else None
+
+    def summary(self) -> dict:
+        """
+        Function returning count, p50, p99, p99.9 and max, latencies converted from nanoseconds to milliseconds.
+        """
+        def to_ms(value):
+            return None if value is None else value / 1e6
+        return {
+            "count": self.count,
+            "p50": to_ms(self.percentile(50)),
+            "p99": to_ms(self.percentile(99)),
+            "p99.9": to_ms(self.percentile(99.9)),
+            "max": to_ms(self.max)}
+
+
+class LatencyCollector():
+    """
+    MQTT subscriber recording the latency of all messages below 'topic' per device and evaluation step.
+    Device histograms use fewer significant bits than the step histogram to keep the memory per device small.
+    With 'sequences', the sequence numbers of the messages are analyzed for loss, duplicates and
+    reordering (see sequence.py). The collector then subscribes with QoS 2, so every message is
+    delivered with the QoS it was published with.
+    """
+    def __init__(self, broker_url: str, broker_port: int, topic: str = "evaluation/#",
+                 client_id: str = "latency-collector", device_significant_bits: int = 5, sequences: bool = False):
+        self.broker_url = broker_url
+        self.broker_port = broker_port
+        self.topic = topic
+        self.device_significant_bits = device_significant_bits
+        self.step = None
+        self.undecodable = 0
+        self.sequences = SequenceAnalyzer() if sequences else None
+        self.__lock = threading.Lock()
+        self.__step_histogram = Histogram()
+        self.__device_histograms = {}
+        self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        self.client.on_connect = self.__on_connect
+        self.client.on_message = self.__on_message
+
+    def start(self):
+        """
+        Function to connect to the broker and start receiving messages in paho's network thread.
+        """
+        self.client.connect(self.broker_url, self.broker_port, keepalive=60)
+        self.client.loop_start()
+
+    def stop(self):
+        """
+        Function to disconnect from the broker.
+        """
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def __on_connect(self, client, userdata, flags, response_code, properties):
+        if response_code == 0:
+            client.subscribe(self.topic, qos=2 if self.sequences else 0)
+        else:
+            logger.warning("Latency collector failed to connect, return code %d", response_code)
+
+    def __on_message(self, client, userdata, message):
+        received_ns = time.monotonic_ns()
+        stamp = getattr(message.properties, "CorrelationData", None)
+        latency = decode_latency(stamp, received_ns) if stamp else None
+        device = message.topic.rsplit("/", 1)[-1]
+        if self.sequences:
+            self.sequences.record(device, read_sequence(message.properties))
+        with self.__lock:
+            if latency is None:
+                self.undecodable += 1
+                return
+            histogram = self.__device_histograms.get(device)
+            if histogram is None:
+                histogram = self.__device_histograms[device] = Histogram(self.device_significant_bits)
+            histogram.record(latency)
+            self.__step_histogram.record(latency)
+
+    def start_step(self, step):
+        """
+        Function to discard everything recorded so far and start recording for evaluation step 'step'.
+        """
+        with self.__lock:
+            self.step = step
+            self.undecodable = 0
+            self.__step_histogram = Histogram()
+            self.__device_histograms = {}
+        if self.sequences:
+            self.sequences.reset()
+
+    def finish_step(self) -> dict:
+        """
+        Function returning the latency summary of the current step, overall and per device,
+        and the sequence analysis (see SequenceAnalyzer.summary()) if enabled.
+        """
+        with self.__lock:
+            return {
+                "step": self.step,
+                "undecodable": self.undecodable,
+                "overall": self.__step_histogram.summary(),
+                "devices": {device: histogram.summary()
+                            for device, histogram in sorted(self.__device_histograms.items())},
+                "sequences": self.sequences.summary() if self.sequences else None}
+
+
+def log_summary(summary: dict):
+    """
+    Function to log a summary as returned by LatencyCollector.finish_step().
+    """
+    sequences = summary.get("sequences")
+    if sequences:
+        counts = sequences["overall"]
+        logger.info("Step %s sequences: %s received, %s lost (%.3f%%), %s duplicates, %s reordered, %s unnumbered",
+                    summary["step"], counts["received"], counts["lost"], counts["loss_rate"] * 100,
+                    counts["duplicates"], counts["reordered"], counts["unnumbered"])
+    overall = summary["overall"]
+    if not overall["count"]:
+        logger.info("Step %s: no latency samples (%s undecodable)", summary["step"], summary["undecodable"])
+        return
+    logger.info("Step %s latency over %s messages: p50 %.3fms p99 %.3fms p99.9 %.3fms max %.3fms",
+                summary["step"], overall["count"], overall["p50"], overall["p99"], overall["p99.9"], overall["max"])
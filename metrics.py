@@ -0,0 +1,209 @@
+"""
+Module for live metrics of the simulated devices, exposed in the Prometheus text format.
+Every device records its publish calls, the acknowledgements delivered by paho's on_publish
+(for QoS 0 the moment the packet left paho's outgoing queue, for QoS 1/2 the PUBACK/PUBCOMP)
+and its connects and disconnects. Matching publish and acknowledgement by mid yields the number
+of messages in flight and the publish-to-ack latency.
+Metrics are disabled unless enabled on the REGISTRY, e.g. by start_http_server().
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from latency import Histogram
+
+logger = logging.getLogger('Evaluation')
+
+PREFIX = "mqtt_sim"
+
+
+class DeviceMetrics():
+    """
+    Counters and in-flight messages of a single device.
+    An acknowledgement may be delivered before publish() returned the mid, such acks are
+    parked until the publish is recorded.
+    """
+    __slots__ = ("name", "registry", "attempted", "acked", "errors", "unacked", "connects", "disconnects",
+                 "reconnects", "connected", "dropped", "in_flight", "early", "lock")
+
+    def __init__(self, name: str, registry: "MetricsRegistry"):
+        self.name = name
+        self.registry = registry
+        self.attempted = 0
+        self.acked = 0
+        self.errors = 0
+        self.unacked = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.reconnects = 0
+        self.connected = False
+        self.dropped = False
+        self.in_flight = {}
+        self.early = set()
+        self.lock = threading.Lock()
+
+    def published(self, info: mqtt.MQTTMessageInfo):
+        """
+        Function to record a publish call given its result.
+        """
+        now = time.monotonic_ns()
+        with self.lock:
+            self.attempted += 1
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.errors += 1
+            elif info.mid in self.early:
+                self.early.discard(info.mid)
+                self.acked += 1
+                self.registry.record_ack(0)
+            else:
+                self.in_flight[info.mid] = now
+
+    def acknowledged(self, mid: int):
+        """
+        Function to record the on_publish callback of 'mid'.
+        """
+        now = time.monotonic_ns()
+        with self.lock:
+            sent = self.in_flight.pop(mid, None)
+            if sent is None:
+                self.early.add(mid)
+                return
+            self.acked += 1
+            self.registry.record_ack(now - sent)
+
+    def connect(self, response_code: int):
+        """
+        Function to record the on_connect callback.
+        """
+        with self.lock:
+            if response_code == 0:
+                self.connects += 1
+                self.reconnects += self.dropped
+                self.connected = True
+                self.dropped = False
+
+    def disconnect(self, response_code: int):
+        """
+        Function to record the on_disconnect callback, messages still in flight will never be acknowledged.
+        A connect following an unexpected disconnect (non-zero 'response_code') counts as reconnect.
+        """
+        with self.lock:
+            self.disconnects += 1
+            self.connected = False
+            self.dropped = response_code != 0
+            self.unacked += len(self.in_flight)
+            self.in_flight.clear()
+            self.early.clear()
+
+
+class MetricsRegistry():
+    """
+    Metrics of all devices of this process. With 'per_device', counters are exported per device
+    (prefixed 'device_', labelled with the device name) as well as in total.
+    """
+    def __init__(self, per_device: bool = True):
+        self.enabled = False
+        self.per_device = per_device
+        self.devices = {}
+        self.ack_latency = Histogram()
+        self.__lock = threading.Lock()
+        self.__latency_lock = threading.Lock()
+
+    def device(self, name: str) -> DeviceMetrics:
+        """
+        Function returning the metrics of device 'name', devices recreated under the same name
+        (e.g. in the next evaluation step) continue the same counters.
+        """
+        with self.__lock:
+            metrics = self.devices.get(name)
+            if metrics is None:
+                metrics = self.devices[name] = DeviceMetrics(name, self)
+            return metrics
+
+    def record_ack(self, latency: int):
+        """
+        Function to record the publish-to-ack latency of a message in nanoseconds.
+        """
+        with self.__latency_lock:
+            self.ack_latency.record(latency)
+
+    def render(self) -> str:
+        """
+        Function rendering all metrics in the Prometheus text exposition format.
+        """
+        with self.__lock:
+            devices = list(self.devices.values())
+        lines = []
+
+        def metric(name, kind, description, attribute):
+            lines.append(f"# HELP {PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            values = [(device.name, attribute(device)) for device in devices]
+            lines.append(f"{PREFIX}_{name} {sum(value for _, value in values)}")
+            if self.per_device:
+                lines.append(f"# HELP {PREFIX}_device_{name} {description}")
+                lines.append(f"# TYPE {PREFIX}_device_{name} {kind}")
+                lines.extend(f'{PREFIX}_device_{name}{{device="{device}"}} {value}' for device, value in values)
+
+        metric("publish_attempted_total", "counter", "Publish calls.", lambda device: device.attempted)
+        metric("publish_acked_total", "counter", "Publishes acknowledged by on_publish.", lambda device: device.acked)
+        metric("publish_errors_total", "counter", "Publish calls failing immediately.", lambda device: device.errors)
+        metric("publish_unacked_total", "counter", "Publishes still in flight when the device disconnected.",
+               lambda device: device.unacked)
+        metric("in_flight", "gauge", "Publishes waiting for on_publish.", lambda device: len(device.in_flight))
+        metric("connects_total", "counter", "Successful connects.", lambda device: device.connects)
+        metric("reconnects_total", "counter", "Successful connects after an unexpected disconnect.",
+               lambda device: device.reconnects)
+        metric("disconnects_total", "counter", "Disconnects.", lambda device: device.disconnects)
+        lines.append(f"# HELP {PREFIX}_connected Devices currently connected.")
+        lines.append(f"# TYPE {PREFIX}_connected gauge")
+        lines.append(f"{PREFIX}_connected {sum(device.connected for device in devices)}")
+        lines.append(f"# HELP {PREFIX}_ack_latency_seconds Publish-to-ack latency.")
+        lines.append(f"# TYPE {PREFIX}_ack_latency_seconds summary")
+        with self.__latency_lock:
+            histogram = self.ack_latency
+            for quantile in (0.5, 0.9, 0.99, 0.999):
+                lines.append(f'{PREFIX}_ack_latency_seconds{{quantile="{quantile}"}} '
+                             f'{histogram.percentile(quantile * 100) / 1e9 if histogram.count else "NaN"}')
+            lines.append(f"{PREFIX}_ack_latency_seconds_count {histogram.count}")
+            lines.append(f"{PREFIX}_ack_latency_seconds_sum {histogram.total / 1e9}")
+        return "\n".join(lines) + "\n"
+
+
+# metrics of this process
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Function answering every GET request with the metrics.
+        """
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Function to enable 'registry' and serve it on http://'host':'port'/metrics from a daemon thread.
+    """
+    registry.enabled = True
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(name="metrics-http", target=server.serve_forever, daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, server.server_address[1])
+    return server
@@ -3,13 +3,36 @@ from paho.mqtt.packettypes import PacketTypes
 import paho.mqtt.client as mqtt
 import random
 import json 
+import logging
+import os
 import time
 import threading
 import uuid
-
-host = "192.168.21.105"
-port = 1883
+from backpressure import InFlightWindow
+from eventlog import EVENTS
+from latency import encode_stamp
+from metrics import REGISTRY
+from payload import get_template
+from sequence import SEQUENCE_PROPERTY, stamp_sequence
+from statestore import STATES
+from tracefile import TRACE
+from wire import PublishProperties, TopicAliases, properties_size, publish_size
+
+logger = logging.getLogger('Evaluation')
+
+host = os.environ.get("MQTT_BROKER_HOST", "192.168.21.105")
+port = int(os.environ.get("MQTT_BROKER_PORT", 1883))
 main_topic = 'mind2/'
+# maximum number of unacknowledged publishes per client (0: unbounded) and the policy
+# applied when they are reached, see backpressure.py
+max_in_flight = 0
+backpressure = "drop"
+# stamp every message with a per-device sequence number (see sequence.py)
+sequence_numbers = False
+# CorrelationData of status updates: "uuid" (uuid1 string), "monotonic" (8 byte stamp, see latency.py) or "none"
+correlation_stamp = "uuid"
+# publish with topic aliases and lightweight properties (see wire.py)
+lean_publish = False
 threads=[]
 UID = uuid.uuid1()
 counter = 0
@@ -20,87 +43,187 @@ def getNextInt():
 
 class MQTTClient:
 
-    def __init__(self,name):
+    message = '{}'
+
+    def __init__(self,name,start=True):
         self.name = name
+        self.template = get_template(self.message)
+        self.state = STATES.view(self.template, name)
+        self.published = 0
+        self.errors = 0
+        self.wire_bytes = 0
+        self.sequence = 0
+        # publishes only the changed fields of the state if set (see reporting.py)
+        self.reporter = None
+        self.metrics = REGISTRY.device(name) if REGISTRY.enabled else None
+        self.window = None
+        if max_in_flight:
+            self.window = InFlightWindow(max_in_flight, backpressure)
+            self.window.attach(self)
         self.client = mqtt.Client(name,protocol=mqtt.MQTTv5)
-        self.client.on_connect = self.on_connect
-        #self.client.on_disconnect = self.on_disconnect
+        self.aliases = TopicAliases(self.client) if lean_publish else None
+        self.client.on_connect = self.__on_connect
+        self.client.on_disconnect = self.__on_disconnect
         self.client.on_message = self.on_message
         self.client.on_publish = self.on_publish
         self.client.on_subscribe = self.on_subscribe
 
-        t = threading.Thread(target=self.looping)
-        t.start()
+        if start:
+            t = threading.Thread(target=self.looping)
+            t.start()
+
+    def connect(self):
+        self.client.connect(host, port, keepalive=60)
 
     def publish(self,topic,payload,correlationData=None):
         topic = main_topic + topic
-        properties = Properties(PacketTypes.PUBLISH)
-        
-        properties.CorrelationData=bytes(str(uuid.uuid1()), "utf-8") if not correlationData else correlationData
+        response = bool(correlationData)
+        if not correlationData and correlation_stamp != "none":
+            correlationData = encode_stamp() if correlation_stamp == "monotonic" else bytes(str(uuid.uuid1()), "utf-8")
 
-        print(properties.CorrelationData)
         counter=+1
-        self.client.publish(topic, qos=2, payload=payload, properties=properties)
+        # responses are published from paho's network thread, which must not block on its own acks
+        if self.window and not self.window.acquire(block=not response):
+            return False
+        published_topic = topic
+        if self.aliases:
+            published_topic, alias = self.aliases.resolve(topic)
+            properties = PublishProperties(correlationData or None, alias)
+        else:
+            properties = Properties(PacketTypes.PUBLISH)
+            if correlationData:
+                properties.CorrelationData = correlationData
+        if sequence_numbers:
+            sequence = self.sequence + 1
+            stamp_sequence(properties, sequence)
+        info = self.client.publish(published_topic, qos=2, payload=payload, properties=properties)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.published += 1
+            if self.aliases:
+                self.aliases.sent(published_topic, alias)
+                properties_length = len(properties.pack())
+            else:
+                properties_length = properties_size(
+                    correlationData or None, None, (SEQUENCE_PROPERTY, str(sequence)) if sequence_numbers else None)
+            self.wire_bytes += publish_size(len(published_topic), len(payload), 2, properties_length)
+            if sequence_numbers:
+                self.sequence = sequence
+            if EVENTS.publish:
+                EVENTS.publish("%s published %s", self.name, payload, device=self.name)
+            if TRACE.record:
+                TRACE.record(self.name, topic, payload, correlationData, 2)
+        else:
+            self.errors += 1
+            if self.window:
+                self.window.release()
+        if self.metrics:
+            self.metrics.published(info)
+        return info.rc == mqtt.MQTT_ERR_SUCCESS
+
+    def publish_state(self):
+        if not self.reporter:
+            self.publish(self.name, payload=self.template.render(self.state))
+            return
+        fields = self.reporter.changed(self.state)
+        if fields is None:
+            return
+        payload = self.reporter.render(self.state, fields)
+        if self.publish(self.name, payload=payload):
+            self.reporter.commit(self.state, fields, payload)
 
     def subscribe(self,topic):
         topic = main_topic + topic
         self.client.subscribe(topic, qos=2, options=None, properties=None)
 
+    def __on_connect(self, client, userdata, flags, rc, properties):
+        if self.metrics:
+            self.metrics.connect(rc)
+        if self.aliases:
+            self.aliases.connected(client, properties)
+        self.on_connect(client, userdata, flags, rc, properties)
+
+    def __on_disconnect(self, client, userdata, rc, properties=None):
+        if self.window:
+            self.window.clear()
+        if self.metrics:
+            self.metrics.disconnect(rc)
+
     def on_publish(self, client, obj, mid):
-        print(self.name + " published  (mid=" + str(mid) + ")")
+        if self.window:
+            self.window.release()
+        if self.metrics:
+            self.metrics.acknowledged(mid)
+        if EVENTS.ack:
+            EVENTS.ack("%s published (mid=%s)", self.name, mid, device=self.name)
 
     def on_connect(self, client, userdata, flags, rc, properties):
         if rc == 0:
-            print(self.name + " successfully connected to " + host + ":" + str(port))
+            logger.info("%s successfully connected to %s:%s", self.name, host, port)
         else:
-            print("Failed to connect, return code %d\n", rc)
+            logger.warning("%s failed to connect, return code %d", self.name, rc)
 
     def on_subscribe(self, client, userdata, mid, granted_qos, properties):
-        print(self.name + " subscribed topic with " + str(granted_qos[0]) + " S(mid=" +  str(mid) + ")")
+        logger.info("%s subscribed topic with %s (mid=%s)", self.name, granted_qos[0], mid)
 
     def on_message(self, client, userdata, message):
-        print(self.name + " received message: " ,str(message.payload.decode("utf-8")))
+        if EVENTS.message:
+            EVENTS.message("%s received message: %s", self.name, message.payload.decode("utf-8"), device=self.name)
 
 class TemperatureSensor(MQTTClient):
 
     message = '{ "temperature": 0, "humidity": 0, "battery": 0, "linkquality": 0 }'
 
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
-            message_tmp = json.loads(self.message)
-            message_tmp["temperature"] = random.uniform(18,26)
-            message_tmp["humidity"] = random.uniform(40,90)
-            message_tmp["battery"] = random.uniform(89,92)
-            message_tmp["linkquality"] = random.uniform(50,255)
-            self.publish(self.name, payload=json.dumps(message_tmp))
+            self.tick()
             #self.client.loop()
-            time.sleep(random.randint(10,15))
+            time.sleep(self.next_interval())
+
+    def tick(self):
+        state = self.state
+        state["temperature"] = random.uniform(18,26)
+        state["humidity"] = random.uniform(40,90)
+        state["battery"] = random.uniform(89,92)
+        state["linkquality"] = random.uniform(50,255)
+        self.publish_state()
+
+    def next_interval(self):
+        return random.randint(10,15)
 
 
 class MotionSensor(MQTTClient):
     
     message = '{ "on": true, "alert": true, "battery": 0, "linkquality": 0}'
 
-    def __init__(self,name):
-        self.message = '{ "on": true, "alert": true, "battery": 0, "linkquality": 0}'
-        MQTTClient.__init__(self,name)
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
-            decision = [True,False,False,False,False,False,False,False]
-            message_tmp = json.loads(self.message)
-            if(message_tmp["on"]):
-                message_tmp["alert"] = decision[random.randint(0,7)]
-                self.publish(self.name, payload=json.dumps(message_tmp))
-                #self.publish(self.name + "/toggleState", payload=self.message)
-                time.sleep(random.randint(30,60))
+            if self.tick():
+                time.sleep(self.next_interval())
+
+    def tick(self):
+        decision = [True,False,False,False,False,False,False,False]
+        state = self.state
+        if(state["on"]):
+            state["alert"] = decision[random.randint(0,7)]
+            self.publish_state()
+            #self.publish(self.name + "/toggleState", payload=self.message)
+            return True
+        return False
+
+    def next_interval(self):
+        return random.randint(30,60)
 
 
 class WindowSensor(MQTTClient):
@@ -108,40 +231,54 @@ class WindowSensor(MQTTClient):
     message = '{ "open": true, "battery": 0, "linkquality": 0}'
     toggle = '{"open": false}'
     topic = ''
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)            
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)            
         self.topic = self.name + "/toggleState"
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
-            decision = [True,False,False,False,False,False,False,False]
-            message_tmp = json.loads(self.message)
-            message_tmp["open"] = decision[random.randint(0,7)]
-            self.publish(self.name, payload=json.dumps(message_tmp))
-            #self.publish(self.name + "/toggleState", payload=self.message)
-            time.sleep(random.randint(100,200))
+            self.tick()
+            time.sleep(self.next_interval())
+
+    def tick(self):
+        decision = [True,False,False,False,False,False,False,False]
+        state = self.state
+        state["open"] = decision[random.randint(0,7)]
+        self.publish_state()
+        #self.publish(self.name + "/toggleState", payload=self.message)
+
+    def next_interval(self):
+        return random.randint(100,200)
 
 class DoorSensor(MQTTClient):
 
     message = '{ "open": true, "battery": 0, "linkquality": 0}'
     toggle = '{"open": false}'
     topic = ''
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)            
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)            
         self.topic = self.name + "/toggleState"
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
-            decision = [True,False,False,False,False,False,False,False]
-            message_tmp = json.loads(self.message)
-            message_tmp["open"] = decision[random.randint(0,7)]
-            self.publish(self.name, payload=json.dumps(message_tmp))
-            #self.publish(self.name + "/toggleState", payload=self.message)
-            time.sleep(random.randint(100,200))
+            self.tick()
+            time.sleep(self.next_interval())
+
+    def tick(self):
+        decision = [True,False,False,False,False,False,False,False]
+        state = self.state
+        state["open"] = decision[random.randint(0,7)]
+        self.publish_state()
+        #self.publish(self.name + "/toggleState", payload=self.message)
+
+    def next_interval(self):
+        return random.randint(100,200)
 
 
 class DoorActuator(MQTTClient):
@@ -149,11 +286,12 @@ class DoorActuator(MQTTClient):
     message = '{ "open": true, "battery": 0, "linkquality": 0}'
     toggle = '{"open": false}'
     topic = ''
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)            
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)            
         self.topic = self.name + "/toggleState"
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
@@ -161,18 +299,18 @@ class DoorActuator(MQTTClient):
 
     def on_connect(self, client, userdata, flags, rc, properties):
         if rc == 0:
-            print(self.name + " successfully connected to " + host + ":" + str(port))
+            logger.info("%s successfully connected to %s:%s", self.name, host, port)
             self.subscribe(self.topic)
         else:
-            print("Failed to connect, return code %d\n", rc)
+            logger.warning("%s failed to connect, return code %d", self.name, rc)
 
     def on_message(self, client, userdata, message):
-        message_tmp = json.loads(self.message)
-        message_tmp2 = json.loads(message.payload.decode("utf-8"))
-        message_tmp["open"] = message_tmp2["open"]
-        self.message = json.dumps(message_tmp)
-        self.publish(self.name, self.message, message.properties.CorrelationData)
-        print(self.name + " received message: " ,str(message.payload.decode("utf-8")))
+        state = self.state
+        command = json.loads(message.payload)
+        state["open"] = command["open"]
+        self.publish(self.name, self.template.render(state), message.properties.CorrelationData)
+        if EVENTS.message:
+            EVENTS.message("%s received message: %s", self.name, message.payload.decode("utf-8"), device=self.name)
 
 
 class FireAlarm(MQTTClient):
@@ -180,11 +318,12 @@ class FireAlarm(MQTTClient):
     message = '{ "alert": true, "battery": 0, "linkquality": 0}'
     toggle = '{"alert": false}'
     topic = ''
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)            
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)            
         self.topic = self.name + "/toggleState"
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
@@ -192,30 +331,31 @@ class FireAlarm(MQTTClient):
 
     def on_connect(self, client, userdata, flags, rc, properties):
         if rc == 0:
-            print(self.name + " successfully connected to " + host + ":" + str(port))
+            logger.info("%s successfully connected to %s:%s", self.name, host, port)
             self.subscribe(self.topic)
         else:
-            print("Failed to connect, return code %d\n", rc)
+            logger.warning("%s failed to connect, return code %d", self.name, rc)
 
     def on_message(self, client, userdata, message):
         time.sleep(random.randint(1,10)/1000)
-        message_tmp = json.loads(self.message)
-        message_tmp2 = json.loads(message.payload.decode("utf-8"))
-        message_tmp["alert"] = message_tmp2["alert"]
-        self.message = json.dumps(message_tmp)
-        self.publish(self.name, self.message, message.properties.CorrelationData)
-        print(self.name + " received message: " ,str(message.payload.decode("utf-8")))
+        state = self.state
+        command = json.loads(message.payload)
+        state["alert"] = command["alert"]
+        self.publish(self.name, self.template.render(state), message.properties.CorrelationData)
+        if EVENTS.message:
+            EVENTS.message("%s received message: %s", self.name, message.payload.decode("utf-8"), device=self.name)
 
 class Thermostat(MQTTClient):
 
     message = '{ "active": true, "state": 0, "battery": 0, "linkquality": 0}'
     toggle = '{"active": false}'
     topic = ''
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)            
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)            
         self.topic = self.name + "/toggleState"
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
@@ -223,31 +363,32 @@ class Thermostat(MQTTClient):
 
     def on_connect(self, client, userdata, flags, rc, properties):
         if rc == 0:
-            print(self.name + " successfully connected to " + host + ":" + str(port))
+            logger.info("%s successfully connected to %s:%s", self.name, host, port)
             self.subscribe(self.topic)
         else:
-            print("Failed to connect, return code %d\n", rc)
+            logger.warning("%s failed to connect, return code %d", self.name, rc)
 
     def on_message(self, client, userdata, message):
-        message_tmp = json.loads(self.message)
-        message_tmp2 = json.loads(message.payload.decode("utf-8"))
-        message_tmp["active"] = message_tmp2["active"]
-        if(message_tmp2["active"]):
-            message_tmp["state"] = message_tmp2["state"]
-        self.message = json.dumps(message_tmp)
-        self.publish(self.name, self.message, message.properties.CorrelationData)
-        print(self.name + " received message: " ,str(message.payload.decode("utf-8")))
+        state = self.state
+        command = json.loads(message.payload)
+        state["active"] = command["active"]
+        if(command["active"]):
+            state["state"] = command["state"]
+        self.publish(self.name, self.template.render(state), message.properties.CorrelationData)
+        if EVENTS.message:
+            EVENTS.message("%s received message: %s", self.name, message.payload.decode("utf-8"), device=self.name)
 
 class Shutter(MQTTClient):
 
     message = '{ "active": true, "percentage": 0, "battery": 0, "linkquality": 0}'
     toggle = '{"active": false}'
     topic = ''
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)            
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)            
         self.topic = self.name + "/toggleState"
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
@@ -255,32 +396,33 @@ class Shutter(MQTTClient):
 
     def on_connect(self, client, userdata, flags, rc, properties):
         if rc == 0:
-            print(self.name + " successfully connected to " + host + ":" + str(port))
+            logger.info("%s successfully connected to %s:%s", self.name, host, port)
             self.subscribe(self.topic)
         else:
-            print("Failed to connect, return code %d\n", rc)
+            logger.warning("%s failed to connect, return code %d", self.name, rc)
 
     def on_message(self, client, userdata, message):
         time.sleep(random.randint(1,10)/1000)
-        message_tmp = json.loads(self.message)
-        message_tmp2 = json.loads(message.payload.decode("utf-8"))
-        message_tmp["active"] = message_tmp2["active"]
-        if(message_tmp2["active"]):
-            message_tmp["percentage"] = message_tmp2["percentage"]
-        self.message = json.dumps(message_tmp)
-        self.publish(self.name, self.message, message.properties.CorrelationData)
-        print(self.name + " received message: " ,str(message.payload.decode("utf-8")))
+        state = self.state
+        command = json.loads(message.payload)
+        state["active"] = command["active"]
+        if(command["active"]):
+            state["percentage"] = command["percentage"]
+        self.publish(self.name, self.template.render(state), message.properties.CorrelationData)
+        if EVENTS.message:
+            EVENTS.message("%s received message: %s", self.name, message.payload.decode("utf-8"), device=self.name)
 
 class LEDBulb(MQTTClient):
 
     message = '{ "on": true, "battery": 0, "linkquality": 0}'
     toggle = '{"on": false}'
     topic = ''
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)            
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)            
         self.topic = self.name + "/toggleState"
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
@@ -288,36 +430,45 @@ class LEDBulb(MQTTClient):
 
     def on_connect(self, client, userdata, flags, rc, properties):
         if rc == 0:
-            print(self.name + " successfully connected to " + host + ":" + str(port))
+            logger.info("%s successfully connected to %s:%s", self.name, host, port)
             self.subscribe(self.topic)
         else:
-            print("Failed to connect, return code %d\n", rc)
+            logger.warning("%s failed to connect, return code %d", self.name, rc)
 
     def on_message(self, client, userdata, message):
-        message_tmp = json.loads(self.message)
-        message_tmp2 = json.loads(message.payload.decode("utf-8"))
-        message_tmp["on"] = message_tmp2["on"]
-        self.message = json.dumps(message_tmp)
-        self.publish(self.name, self.message, message.properties.CorrelationData)
-        print(self.name + " received message: " ,str(message.payload.decode("utf-8")))
+        state = self.state
+        command = json.loads(message.payload)
+        state["on"] = command["on"]
+        self.publish(self.name, self.template.render(state), message.properties.CorrelationData)
+        if EVENTS.message:
+            EVENTS.message("%s received message: %s", self.name, message.payload.decode("utf-8"), device=self.name)
 
 
 class SmokeDetector(MQTTClient):
     
     message = '{ "on": true, "alert": true, "battery": 0, "linkquality": 0}'
 
-    def __init__(self,name):
-        MQTTClient.__init__(self,name)
-        self.client.connect(host, port, keepalive=60)
-        self.client.loop_start()
+    def __init__(self,name,start=True):
+        MQTTClient.__init__(self,name,start)
+        if start:
+            self.connect()
+            self.client.loop_start()
 
     def looping(self):
         while True:
-            decision = [True,True,True,True,True,False,False,False]
-            message_tmp = json.loads(self.message)
-            if(message_tmp["on"]):
-                message_tmp["alert"] = decision[random.randint(0,7)]
-                if(message_tmp["alert"]):
-                    self.publish(self.name, payload=json.dumps(message_tmp))
-                #self.publish(self.name + "/toggleState", payload=self.message)
-                time.sleep(random.randint(10,20))
\ No newline at end of file
+            if self.tick():
+                time.sleep(self.next_interval())
+
+    def tick(self):
+        decision = [True,True,True,True,True,False,False,False]
+        state = self.state
+        if(state["on"]):
+            state["alert"] = decision[random.randint(0,7)]
+            if(state["alert"]):
+                self.publish_state()
+            #self.publish(self.name + "/toggleState", payload=self.message)
+            return True
+        return False
+
+    def next_interval(self):
+        return random.randint(10,20)
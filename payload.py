@@ -0,0 +1,110 @@
+"""
+Module for rendering device payloads from pre-compiled templates.
+Each device schema (the JSON objects listed in the readme table) is compiled once into a byte
+format string, so a status update is rendered by a single formatting call instead of a
+json.loads/json.dumps round trip per tick.
+Besides JSON, a compact binary struct encoding is available behind the same API.
+Devices reporting by exception (see reporting.py) publish delta payloads holding only some fields,
+as JSON object or, in the struct encoding, as bitmask of the fields present followed by their values.
+"""
+
+from functools import lru_cache
+import json
+import struct
+
+# encoding used by get_template(), "json" or "struct"
+ENCODING = "json"
+
+_JSON_BOOL = (b"false", b"true")
+
+
+class PayloadTemplate():
+    """
+    Pre-compiled payload of a device schema, e.g. '{ "open": true, "battery": 0, "linkquality": 0 }'.
+    Field order and types (bool or number) are taken from the schema.
+    JSON numbers are rendered with 'digits' significant digits, the struct encoding packs
+    booleans into one byte and numbers into 4 byte floats (little endian, in field order).
+    """
+    def __init__(self, schema: str, encoding: str = "json", digits: int = 6):
+        defaults = json.loads(schema)
+        for field, value in defaults.items():
+            if not isinstance(value, (bool, int, float)):
+                raise ValueError(f"Unsupported type of field '{field}' in payload schema: {type(value).__name__}")
+        self.schema = schema
+        self.encoding = encoding
+        self.fields = tuple(defaults)
+        self.__defaults = defaults
+        self.__bools = tuple(field for field, value in defaults.items() if isinstance(value, bool))
+        if encoding == "json":
+            self.__fields = {field: (f'"{field}": %s' if isinstance(value, bool) else f'"{field}": %.{digits}g')
+                             .encode('utf-8') for field, value in defaults.items()}
+            self.__format = b"{" + b", ".join(self.__fields.values()) + b"}"
+        elif encoding == "struct":
+            self.__codes = {field: "?" if isinstance(value, bool) else "f" for field, value in defaults.items()}
+            self.__struct = struct.Struct("<" + "".join(self.__codes.values()))
+            self.__mask_size = (len(defaults) + 7) // 8
+        else:
+            raise ValueError(f"Unknown payload encoding '{encoding}'")
+
+    def defaults(self) -> dict:
+        """
+        Function returning a fresh state dictionary initialized with the values of the schema.
+        """
+        return dict(self.__defaults)
+
+    def render(self, state: dict) -> bytes:
+        """
+        Function rendering the payload for 'state', which has to contain all fields of the schema.
+        """
+        if self.encoding == "struct":
+            return self.__struct.pack(*[state[field] for field in self.fields])
+        bools = self.__bools
+        return self.__format % tuple([_JSON_BOOL[state[field]] if field in bools else state[field]
+                                      for field in self.fields])
+
+    def decode(self, payload: bytes) -> dict:
+        """
+        Function decoding a payload rendered by this template back into a state dictionary.
+        """
+        if self.encoding == "struct":
+            return dict(zip(self.fields, self.__struct.unpack(payload)))
+        return json.loads(payload)
+
+    def render_delta(self, state: dict, fields: list) -> bytes:
+        """
+        Function rendering a payload with only the 'fields' (in schema order) of 'state'.
+        """
+        if self.encoding == "struct":
+            mask = sum(1 << index for index, field in enumerate(self.fields) if field in fields)
+            return mask.to_bytes(self.__mask_size, "little") + struct.pack(
+                "<" + "".join(self.__codes[field] for field in fields), *[state[field] for field in fields])
+        formats = self.__fields
+        bools = self.__bools
+        return b"{" + b", ".join([formats[field] % (_JSON_BOOL[state[field]] if field in bools else state[field])
+                                  for field in fields]) + b"}"
+
+    def decode_delta(self, payload: bytes) -> dict:
+        """
+        Function decoding a payload rendered by render_delta() into a dictionary of the fields it holds.
+        """
+        if self.encoding == "struct":
+            mask = int.from_bytes(payload[:self.__mask_size], "little")
+            fields = [field for index, field in enumerate(self.fields) if mask >> index & 1]
+            values = struct.unpack("<" + "".join(self.__codes[field] for field in fields), payload[self.__mask_size:])
+            return dict(zip(fields, values))
+        return json.loads(payload)
+
+
+@lru_cache(maxsize=None)
+def compile_template(schema: str, encoding: str = "json") -> PayloadTemplate:
+    """
+    Function returning the (cached) template of 'schema' in 'encoding'.
+    """
+    return PayloadTemplate(schema, encoding)
+
+
+def get_template(schema: str) -> PayloadTemplate:
+    """
+    Function returning the template of 'schema' in the currently configured ENCODING.
+    """
+    return compile_template(schema, ENCODING)
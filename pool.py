@@ -0,0 +1,292 @@
+"""
+Module for multiplexing many logical devices over a bounded pool of shared MQTT connections.
+Every device keeps its own topic and callbacks, but its paho client is replaced by a lightweight
+PooledClient that publishes and subscribes through one of the shared connections.
+Statistics are kept per connection and per device.
+"""
+
+# pylint: disable=unused-argument
+
+import functools
+import logging
+import os
+import threading
+
+import paho.mqtt.client as mqtt
+
+from wire import TopicAliases
+
+logger = logging.getLogger('Evaluation')
+
+
+class PooledClient():
+    """
+    Stand-in for paho.mqtt.client.Client of a single logical device.
+    Implements the part of the client API used by the simulated devices, network handling
+    (connect, loops, disconnect) is left to the shared connection.
+    """
+    __slots__ = ("connection", "on_connect", "on_disconnect", "on_publish", "on_subscribe",
+                 "on_unsubscribe", "on_message", "published", "errors", "received")
+
+    def __init__(self, connection: "PooledConnection"):
+        self.connection = connection
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_publish = None
+        self.on_subscribe = None
+        self.on_unsubscribe = None
+        self.on_message = None
+        self.published = 0
+        self.errors = 0
+        self.received = 0
+
+    def connect(self, host: str, port: int = 1883, keepalive: int = 60, **kwargs):
+        """
+        Function connecting the shared connection, if it is not connected yet.
+        """
+        return self.connection.connect(host, port, keepalive)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None):
+        """
+        Function publishing through the shared connection.
+        """
+        info = self.connection.publish(self, topic, payload, qos, retain, properties)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.published += 1
+        else:
+            self.errors += 1
+        return info
+
+    def subscribe(self, topic, qos: int = 0, options=None, properties=None):
+        """
+        Function subscribing through the shared connection, matching messages are passed to on_message.
+        """
+        return self.connection.subscribe(self, topic, qos, options, properties)
+
+    def is_connected(self) -> bool:
+        """
+        Function returning whether the shared connection is established.
+        """
+        return self.connection.client.is_connected()
+
+    def disconnect(self, *args, **kwargs):
+        """
+        Logical devices do not own a connection, the pool disconnects the shared connections.
+        """
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        """
+        The shared connection runs the network loop.
+        """
+
+    def loop_stop(self, *args, **kwargs):
+        """
+        The shared connection runs the network loop.
+        """
+
+    def loop_misc(self):
+        """
+        The shared connection handles keepalives.
+        """
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def enable_logger(self, logger=None):
+        """
+        Logging is configured on the shared connection.
+        """
+
+
+class PooledConnection():
+    """
+    One shared paho client carrying the traffic of several logical devices.
+    """
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        self.client.on_connect = self.__on_connect
+        self.client.on_disconnect = self.__on_disconnect
+        self.client.on_publish = self.__on_publish
+        self.client.on_subscribe = self.__on_subscribe
+        # topic aliases of the devices publishing with them (see wire.py), shared by all devices of the connection
+        self.aliases = TopicAliases(self.client)
+        self.devices = []
+        self.published = 0
+        self.errors = 0
+        self.connects = 0
+        self.__connected = False
+        self.__lock = threading.Lock()
+        # mid -> device for routing on_publish/on_subscribe, acks arriving before the mid is known
+        # (the ack callback may run before publish() returns) are parked until it is tracked
+        self.__mids = {}
+        self.__early = {}
+        # topic filter -> devices subscribed to it, every matching message is dispatched to all of them
+        self.__subscribers = {}
+
+    def add(self, device: PooledClient):
+        """
+        Function to let 'device' use this connection.
+        """
+        self.devices.append(device)
+
+    def connect(self, host: str, port: int, keepalive: int = 60):
+        """
+        Function connecting the shared client once, further calls are ignored.
+        """
+        with self.__lock:
+            if self.__connected:
+                return mqtt.MQTT_ERR_SUCCESS
+            self.__connected = True
+        try:
+            return self.client.connect(host, port, keepalive=keepalive)
+        except OSError:
+            # the next device of the connection tries again
+            with self.__lock:
+                self.__connected = False
+            raise
+
+    def disconnect(self):
+        """
+        Function disconnecting the shared client.
+        """
+        self.client.disconnect()
+
+    def __track(self, device: PooledClient, mid: int):
+        with self.__lock:
+            early = self.__early.pop(mid, None)
+            if early is None:
+                self.__mids[mid] = device
+                return
+        self.__call(device, *early)
+
+    def __dispatch(self, callback: str, mid: int, args: tuple):
+        with self.__lock:
+            device = self.__mids.pop(mid, None)
+            if device is None:
+                self.__early[mid] = (callback, args)
+                return
+        self.__call(device, callback, args)
+
+    @staticmethod
+    def __call(device: PooledClient, callback: str, args: tuple):
+        function = getattr(device, callback)
+        if function:
+            function(device, None, *args)
+
+    def publish(self, device: PooledClient, topic: str, payload, qos: int, retain: bool, properties):
+        """
+        Function publishing on behalf of 'device'.
+        """
+        info = self.client.publish(topic, payload=payload, qos=qos, retain=retain, properties=properties)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.published += 1
+            self.__track(device, info.mid)
+        else:
+            self.errors += 1
+        return info
+
+    def subscribe(self, device: PooledClient, topic, qos: int, options, properties):
+        """
+        Function subscribing 'topic' for 'device', matching messages are dispatched to its on_message.
+        """
+        with self.__lock:
+            subscribers = self.__subscribers.get(topic)
+            if subscribers is None:
+                self.client.message_callback_add(topic, functools.partial(self.__on_message, topic))
+                subscribers = ()
+            if device not in subscribers:
+                # replaced instead of appended, paho's network thread may be iterating the previous tuple
+                self.__subscribers[topic] = subscribers + (device,)
+        result, mid = self.client.subscribe(topic, qos=qos, options=options, properties=properties)
+        if result == mqtt.MQTT_ERR_SUCCESS:
+            self.__track(device, mid)
+        return result, mid
+
+    def __on_connect(self, client, userdata, flags, response_code, properties):
+        if response_code == 0:
+            self.connects += 1
+        self.aliases.connected(client, properties)
+        for device in self.devices:
+            if device.on_connect:
+                device.on_connect(device, userdata, flags, response_code, properties)
+
+    def __on_disconnect(self, client, userdata, response_code, properties=None):
+        with self.__lock:
+            self.__connected = False
+            # acks of messages in flight may never arrive, or arrive for mids that were never tracked
+            self.__mids.clear()
+            self.__early.clear()
+        for device in self.devices:
+            if device.on_disconnect:
+                device.on_disconnect(device, userdata, response_code, properties)
+
+    def __on_message(self, topic, client, userdata, message):
+        for device in self.__subscribers.get(topic, ()):
+            device.received += 1
+            if device.on_message:
+                device.on_message(device, userdata, message)
+
+    def __on_publish(self, client, userdata, mid):
+        self.__dispatch("on_publish", mid, (mid,))
+
+    def __on_subscribe(self, client, userdata, mid, granted_qos, properties):
+        self.__dispatch("on_subscribe", mid, (mid, granted_qos, properties))
+
+
+class ConnectionPool():
+    """
+    Bounded pool of shared connections, every connection carries up to 'devices_per_connection' devices.
+    """
+    def __init__(self, devices_per_connection: int, prefix: str = None):
+        self.devices_per_connection = devices_per_connection
+        # client ids have to be unique across processes, otherwise the broker takes the session over
+        self.prefix = prefix or f"pool-{os.getpid()}"
+        self.connections = []
+
+    def attach(self, device):
+        """
+        Function to replace the paho client of 'device' with a PooledClient on the next free connection.
+        The device must not be connected yet (i.e. constructed with start=False).
+        """
+        if not self.connections or len(self.connections[-1].devices) >= self.devices_per_connection:
+            self.connections.append(PooledConnection(f"{self.prefix}-{len(self.connections)}"))
+        connection = self.connections[-1]
+        pooled = PooledClient(connection)
+        for callback in ("on_connect", "on_disconnect", "on_publish", "on_subscribe", "on_unsubscribe", "on_message"):
+            setattr(pooled, callback, getattr(device.client, callback))
+        connection.add(pooled)
+        device.client = pooled
+        if getattr(device, "aliases", None):
+            device.aliases = connection.aliases
+
+    def attach_all(self, devices: list):
+        """
+        Function to attach all 'devices'.
+        """
+        for device in devices:
+            self.attach(device)
+
+    def start(self, host: str, port: int):
+        """
+        Function to connect all shared connections and start their paho network threads.
+        """
+        for connection in self.connections:
+            connection.connect(host, port)
+            connection.client.loop_start()
+
+    def stop(self):
+        """
+        Function to disconnect all shared connections and stop their network threads.
+        """
+        for connection in self.connections:
+            connection.disconnect()
+            connection.client.loop_stop()
+
+    def log(self):
+        """
+        Function to log the statistics per connection.
+        """
+        for connection in self.connections:
+            logger.info("Connection %s: %s devices, %s published, %s errors, %s received, %s connects",
+                        connection.client_id, len(connection.devices), connection.published, connection.errors,
+                        sum(device.received for device in connection.devices), connection.connects)
@@ -0,0 +1,193 @@
+"""
+Module for profiling an evaluation step from within the simulation.
+A background thread samples the Python stacks of all threads of the process (paho network threads,
+scheduler or event loop, collector, ...) every 'interval' seconds with sys._current_frames().
+In 'cpu' mode, samples of idle threads are skipped: threads that did not consume CPU time since
+the previous sample (Linux only) and threads waiting in a known blocking call (select(), waiting for
+a condition, paho's network loop waiting for its socket, ...). What remains shows where the CPU time
+goes. In 'wall' mode every thread counts in every sample, which shows where threads wait as well.
+The result is written as collapsed stacks, one 'thread;outer;...;inner count' line per stack,
+the input of flamegraph.pl, speedscope or inferno, and as CSV summary with the self and total
+number of samples of every function. Frames are labelled 'module:qualified name', threads by their
+name with numbers replaced by '#', so the paho threads of all devices fall together.
+"""
+
+from collections import Counter
+import csv
+import logging
+import re
+import sys
+import threading
+import time
+
+logger = logging.getLogger('Evaluation')
+
+MODES = ("cpu", "wall")
+# per-thread CPU clocks are addressed by the kernel thread id on Linux
+CPU_CLOCKS = sys.platform.startswith("linux")
+THREAD_NUMBER = re.compile(r"\d+")
+# innermost Python frames of threads blocked in C calls, e.g. select() or acquiring a lock
+IDLE_FUNCTIONS = re.compile(r"selectors:\w+\.select|threading:(Condition\.wait|Thread\._wait_for_tstate_lock)"
+                            r"|multiprocessing\.synchronize:\w+\.wait|concurrent\.futures\.thread:_worker"
+                            r"|paho\.mqtt\.client:Client\._loop")
+SUMMARY_FIELDS = ("function", "self", "total", "self_pct", "total_pct")
+
+
+def thread_cpu_clock(native_id: int) -> int:
+    """
+    Function returning the clock id measuring the CPU time of the thread with kernel id 'native_id'.
+    """
+    # MAKE_THREAD_CPUCLOCK(tid, CPUCLOCK_SCHED) of the Linux kernel
+    return (~native_id << 3) | 6
+
+
+class SamplingProfiler():
+    """
+    Samples the stacks of all other threads of this process every 'interval' seconds while started.
+    """
+    def __init__(self, interval: float = 0.01, mode: str = "cpu"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}', choose from {', '.join(MODES)}")
+        self.interval = interval
+        self.mode = mode
+        self.stacks = Counter()
+        self.samples = 0
+        # samples of threads considered idle in 'cpu' mode
+        self.idle = 0
+        self.elapsed = 0.0
+        # time spent taking samples, i.e. the overhead of profiling
+        self.sampling = 0.0
+        self.__labels = {}
+        self.__idle = set()
+        self.__cpu = {}
+        self.__started = None
+        self.__thread = None
+        self.__stop = threading.Event()
+
+    def start(self):
+        """
+        Function to start sampling in a background thread.
+        """
+        self.__stop.clear()
+        self.__started = time.monotonic()
+        self.__thread = threading.Thread(name="profiler", target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Function to stop sampling, the collected stacks are kept.
+        """
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+        self.elapsed += time.monotonic() - self.__started
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            started = time.perf_counter()
+            self.sample()
+            self.sampling += time.perf_counter() - started
+
+    def sample(self):
+        """
+        Function to record the current stack of every other thread once.
+        """
+        own = threading.get_ident()
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        labels = self.__labels
+        for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident == own:
+                continue
+            thread = threads.get(ident)
+            if self.mode == "cpu" and (self.__waiting(thread) or self.__label(frame) in self.__idle):
+                self.idle += 1
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(labels.get(frame.f_code) or self.__label(frame))
+                frame = frame.f_back
+            stack.append(THREAD_NUMBER.sub("#", thread.name if thread else "unknown").replace(";", ","))
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def __label(self, frame) -> str:
+        code = frame.f_code
+        label = self.__labels.get(code)
+        if label is None:
+            label = self.__labels[code] = (f"{frame.f_globals.get('__name__', '?')}:"
+                                           f"{getattr(code, 'co_qualname', code.co_name)}")
+            if IDLE_FUNCTIONS.fullmatch(label):
+                self.__idle.add(label)
+        return label
+
+    def __waiting(self, thread: threading.Thread) -> bool:
+        # a thread that did not get any CPU time since the previous sample is waiting
+        if not CPU_CLOCKS or thread is None or thread.native_id is None:
+            return False
+        try:
+            cpu = time.clock_gettime(thread_cpu_clock(thread.native_id))
+        except OSError:
+            # the thread has finished in the meantime
+            return True
+        previous = self.__cpu.get(thread.native_id)
+        self.__cpu[thread.native_id] = cpu
+        return previous is not None and cpu == previous
+
+    @property
+    def total(self) -> int:
+        """
+        Number of thread stacks sampled, without the idle ones in 'cpu' mode.
+        """
+        return sum(self.stacks.values())
+
+    def summary(self) -> list:
+        """
+        Function returning the summary rows of all functions, ordered by descending self samples.
+        The self samples of a function are the ones it was running in, the total samples also
+        the ones it was calling other functions in.
+        """
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            # recursive functions count once per sample, the thread name is not a function
+            for label in set(stack[1:]):
+                total[label] += count
+        overall = self.total or 1
+        return [{"function": label, "self": own[label], "total": count,
+                 "self_pct": round(own[label] / overall * 100, 2), "total_pct": round(count / overall * 100, 2)}
+                for label, count in sorted(total.items(), key=lambda item: (-own[item[0]], -item[1]))]
+
+    def packages(self) -> dict:
+        """
+        Function returning the share (percent) of the self samples per top-level package, e.g. 'paho' or 'json'.
+        """
+        counts = Counter()
+        for stack, count in self.stacks.items():
+            counts[stack[-1].partition(":")[0].partition(".")[0]] += count
+        overall = self.total or 1
+        return {package: round(count / overall * 100, 2) for package, count in counts.most_common()}
+
+    def save(self, path: str, top: int = 10):
+        """
+        Function to write the collapsed stacks to 'path'.collapsed and the summary to 'path'.csv
+        and to log the functions with the most self samples.
+        """
+        with open(f"{path}.collapsed", "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{';'.join(stack)} {count}\n")
+        summary = self.summary()
+        with open(f"{path}.csv", "w", newline="", encoding="utf-8") as file:
+            writer = csv.DictWriter(file, SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(summary)
+        logger.info("Profiled %s samples in %.1fs (%s mode, %s busy and %s idle thread stacks), "
+                    "sampling took %.2f%% of the time, written to %s.*", self.samples, self.elapsed, self.mode,
+                    self.total, self.idle, self.sampling / self.elapsed * 100 if self.elapsed else 0.0, path)
+        logger.info("Self time by package: %s",
+                    ", ".join(f"{package} {share}%" for package, share in self.packages().items()))
+        for row in summary[:top]:
+            logger.info("  %6.2f%% self %6.2f%% total  %s", row["self_pct"], row["total_pct"], row["function"])
@@ -0,0 +1,118 @@
+"""
+Module for generating the simulated sensor readings of a whole fleet in batches.
+Instead of calling random.uniform for every field of every message, the readings of all
+devices of one type are generated for the next 'batch' ticks with a few NumPy calls,
+every device then takes its own row on each tick.
+Besides i.i.d. uniform noise, a mean-reverting random walk and a diurnal curve are available.
+With a seed, the generated readings are reproducible.
+"""
+
+import functools
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MODELS = ("uniform", "walk", "diurnal")
+
+
+class ReadingGenerator():
+    """
+    Batched readings for 'devices' devices, 'ranges' maps every field to its (lower, upper) bound.
+    Models:
+    - uniform: independent uniformly distributed readings within the bounds
+    - walk: mean-reverting random walk around the middle of the bounds
+    - diurnal: daily sine curve between the bounds with a per-device phase and some noise,
+      'interval' is the time in seconds between two ticks and 'period' the length of a day
+    Readings are rounded to two digits. 'seed' is an integer or a tuple of integers (see numpy.random.default_rng()).
+    """
+    def __init__(self, ranges: dict, devices: int, model: str = "uniform", seed=None,
+                 batch: int = 64, interval: float = 1.0, period: float = 86400.0):
+        if np is None:
+            raise ImportError("Batched reading generation requires numpy")
+        if model not in MODELS:
+            raise ValueError(f"Unknown reading model '{model}'")
+        self.fields = tuple(ranges)
+        self.devices = devices
+        self.model = model
+        self.batch = batch
+        self.interval = interval
+        self.period = period
+        self.__rng = np.random.default_rng(seed)
+        self.__lower = np.array([ranges[field][0] for field in self.fields], dtype=float)
+        self.__upper = np.array([ranges[field][1] for field in self.fields], dtype=float)
+        self.__span = self.__upper - self.__lower
+        self.__phase = self.__rng.uniform(0, 2 * math.pi, size=(devices, 1))
+        self.__last = self.__rng.uniform(self.__lower, self.__upper, size=(devices, len(self.fields)))
+        self.__tick = 0
+        self.__cursors = [batch] * devices
+        self.__buffer = None
+        self.__rows = None
+
+    def __generate(self):
+        shape = (self.devices, self.batch, len(self.fields))
+        if self.model == "uniform":
+            buffer = self.__rng.uniform(self.__lower, self.__upper, size=shape)
+        elif self.model == "walk":
+            # x' = x + theta * (mu - x) + sigma * N(0, 1), vectorized across devices
+            theta, sigma = 0.05, 0.02 * self.__span
+            middle = (self.__lower + self.__upper) / 2
+            noise = self.__rng.standard_normal(shape) * sigma
+            buffer = np.empty(shape)
+            value = self.__last
+            for step in range(self.batch):
+                value = np.clip(value + theta * (middle - value) + noise[:, step], self.__lower, self.__upper)
+                buffer[:, step] = value
+        else:
+            ticks = self.__tick + np.arange(self.batch)
+            angle = 2 * math.pi * ticks * self.interval / self.period + self.__phase
+            curve = (np.sin(angle)[:, :, None] + 1) / 2
+            noise = self.__rng.standard_normal(shape) * 0.01 * self.__span
+            buffer = np.clip(self.__lower + curve * self.__span + noise, self.__lower, self.__upper)
+        self.__buffer = np.round(buffer, 2)
+        # handing out plain python lists keeps NumPy scalar overhead off the per-tick path
+        self.__rows = self.__buffer.tolist()
+        self.__cursors = [0] * self.devices
+        self.__tick += self.batch
+
+    def next(self, index: int) -> list:
+        """
+        Function returning the next readings of device 'index' in field order.
+        A new batch is generated for all devices as soon as one device has used up its rows,
+        the random walk continues from the last readings every device actually used.
+        """
+        cursor = self.__cursors[index]
+        if cursor >= self.batch:
+            if self.__buffer is not None:
+                used = np.maximum(np.array(self.__cursors) - 1, 0)
+                self.__last = self.__buffer[np.arange(self.devices), used]
+            self.__generate()
+            cursor = 0
+        self.__cursors[index] = cursor + 1
+        return self.__rows[index][cursor]
+
+
+def attach_readings(devices: list, model: str = "uniform", seed: int = None, step: int = 1, **options) -> list:
+    """
+    Function to let all 'devices' with a 'ranges' attribute take their readings from one shared
+    ReadingGenerator per device type, other devices are left untouched. Unless given in 'options',
+    the tick interval of the diurnal model is taken from the first device of every type.
+    With a seed, the generator of every type is seeded with 'seed', the evaluation 'step' and its
+    position, so every step draws other readings, reproducibly.
+    """
+    types = {}
+    for device in devices:
+        if hasattr(device, "ranges"):
+            types.setdefault(type(device), []).append(device)
+    generators = []
+    for position, group in enumerate(types.values()):
+        group_options = dict(options)
+        group_options.setdefault("interval", group[0].next_interval())
+        generator = ReadingGenerator(group[0].ranges, len(group), model,
+                                     seed if seed is None else (seed, step, position), **group_options)
+        for index, device in enumerate(group):
+            device.readings = functools.partial(generator.next, index)
+        generators.append(generator)
+    return generators
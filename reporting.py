@@ -0,0 +1,162 @@
+"""
+Module for devices reporting by exception instead of publishing their full state every tick.
+Like a Zigbee bridge, such a device still samples every tick, but only publishes if a numeric field
+moved more than its deadband away from the value last reported, or a boolean field changed.
+The payload then holds only the changed fields (see PayloadTemplate.render_delta()). The first
+report and one report per 'heartbeat' seconds hold all fields, so subscribers that joined late or
+missed a message get back in sync. A device group reports by exception if its scenario entry has
+a 'report' key, e.g.
+
+    {"type": "mqttClient.DoorSensor", "count": 50, "report": {"deadband": 0, "heartbeat": 300}}
+    {"type": "run.TemperatureSensor", "count": 50, "report": {"deadband": {"temperature": 0.5, "*": 2}}}
+
+A deadband given as dict applies per field, '*' to all other numeric fields. Subscribers rebuild
+the full state of every device from the deltas with a StateRebuilder.
+"""
+
+import logging
+import time
+
+from statestore import StateStores
+
+logger = logging.getLogger('Evaluation')
+
+# values last reported by the devices of this process
+REPORTED = StateStores()
+
+
+def report_config(config) -> dict:
+    """
+    Function to normalize the report-by-exception configuration of a device group, either
+    'exception' for the defaults or a dict with the 'deadband' and the 'heartbeat' in seconds.
+    """
+    config = {} if config == "exception" else dict(config)
+    unknown = set(config) - {"deadband", "heartbeat"}
+    if unknown:
+        raise ValueError(f"Unknown report options {', '.join(sorted(unknown))}, choose from deadband, heartbeat")
+    config.setdefault("deadband", 0)
+    config.setdefault("heartbeat", 300)
+    if config["heartbeat"] <= 0:
+        raise ValueError("Report heartbeat has to be positive")
+    return config
+
+
+class ExceptionReporter():
+    """
+    Decides which fields of the state of device 'name' with payload 'template' (see payload.py)
+    are reported and renders their payload. 'deadband' is a number or a dict by field (see report_config()).
+    """
+    __slots__ = ("template", "reported", "deadbands", "heartbeat", "last_full", "full_size",
+                 "ticks", "reports", "bytes")
+
+    def __init__(self, template, name: str, deadband=0, heartbeat: float = 300):
+        deadbands = deadband if isinstance(deadband, dict) else {"*": deadband}
+        defaults = template.defaults()
+        self.template = template
+        self.reported = REPORTED.view(template, name)
+        # booleans are reported on every change
+        self.deadbands = tuple((field, 0 if isinstance(defaults[field], bool)
+                                else deadbands.get(field, deadbands.get("*", 0))) for field in template.fields)
+        self.heartbeat = heartbeat
+        self.last_full = None
+        # size of the last report holding all fields
+        self.full_size = 0
+        self.ticks = 0
+        self.reports = 0
+        self.bytes = 0
+
+    def changed(self, state) -> tuple:
+        """
+        Function returning the fields of 'state' to report, all of them for a full report,
+        None if no field changed beyond its deadband.
+        """
+        self.ticks += 1
+        reported = self.reported
+        if self.last_full is None or time.monotonic() - self.last_full >= self.heartbeat:
+            return self.template.fields
+        fields = [field for field, deadband in self.deadbands if abs(state[field] - reported[field]) > deadband]
+        return fields or None
+
+    def render(self, state, fields) -> bytes:
+        """
+        Function returning the payload reporting the 'fields' of 'state' (see changed()).
+        """
+        return self.template.render_delta(state, fields)
+
+    def commit(self, state, fields, payload: bytes):
+        """
+        Function to record the 'fields' of 'state' as reported by 'payload', to be called once the
+        message was accepted for sending. Fields of a message that was not sent are reported again.
+        """
+        reported = self.reported
+        for field in fields:
+            reported[field] = state[field]
+        if fields is self.template.fields:
+            self.last_full = time.monotonic()
+            self.full_size = len(payload)
+        self.reports += 1
+        self.bytes += len(payload)
+
+    def reset(self):
+        """
+        Function to reset the counters, e.g. at the end of the warm-up.
+        """
+        self.ticks = 0
+        self.reports = 0
+        self.bytes = 0
+
+
+def attach_reporting(device, config: dict) -> ExceptionReporter:
+    """
+    Function to let 'device' report by exception according to 'config' (see report_config()).
+    """
+    device.reporter = ExceptionReporter(device.template, device.name, config["deadband"], config["heartbeat"])
+    return device.reporter
+
+
+def log_reporting(devices: list):
+    """
+    Function to log the messages and bytes saved by the devices reporting by exception,
+    compared to publishing the full state every tick.
+    """
+    reporters = [device.reporter for device in devices if getattr(device, "reporter", None)]
+    if not reporters:
+        return
+    ticks = sum(reporter.ticks for reporter in reporters)
+    reports = sum(reporter.reports for reporter in reporters)
+    sent = sum(reporter.bytes for reporter in reporters)
+    full = sum(reporter.ticks * reporter.full_size for reporter in reporters)
+    logger.info("Report by exception: %s devices published %s of %s ticks (%.1f%% suppressed), "
+                "%s payload bytes instead of %s (%.1f%% saved)", len(reporters), reports, ticks,
+                (1 - reports / ticks) * 100 if ticks else 0.0, sent, full, (1 - sent / full) * 100 if full else 0.0)
+
+
+class StateRebuilder():
+    """
+    Full state of devices reporting by exception, rebuilt from their delta payloads.
+    """
+    def __init__(self):
+        self.states = {}
+
+    def apply(self, device: str, changes: dict) -> dict:
+        """
+        Function to merge the 'changes' reported by 'device' into its state and return the state.
+        """
+        state = self.states.get(device)
+        if state is None:
+            state = self.states[device] = {}
+        state.update(changes)
+        return state
+
+    def update(self, device: str, payload: bytes, template) -> dict:
+        """
+        Function to merge the delta 'payload' rendered by 'template' (see payload.py) and return the state of 'device'.
+        """
+        return self.apply(device, template.decode_delta(payload))
+
+    def complete(self, device: str, template) -> bool:
+        """
+        Function returning whether all fields of 'template' are known for 'device', i.e. a full report was received.
+        """
+        state = self.states.get(device)
+        return state is not None and all(field in state for field in template.fields)
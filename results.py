@@ -0,0 +1,135 @@
+"""
+Module for storing the results of evaluation runs.
+Every run gets its own directory containing run.json (configuration, scenario and git revision),
+steps.csv with one row per evaluation step and devices.csv with one row per device and step.
+All rows carry the run id, so the CSV files of several runs can simply be concatenated.
+"""
+
+import csv
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+
+logger = logging.getLogger('Evaluation')
+
+STEP_FIELDS = ("run", "scenario", "step", "scale", "devices", "published", "errors", "dropped", "throttled_s",
+               "duration", "rate", "requested_ticks", "achieved_ticks", "missed", "lag_mean_ms", "lag_max_ms",
+               "latency_count", "p50_ms", "p99_ms", "p99.9_ms", "max_ms",
+               "received", "lost", "duplicates", "reordered", "loss_rate", "wire_bytes", "bytes_per_message",
+               "ingested", "ingest_rate", "ingest_backlog", "ingest_p99_ms", "ingest_e2e_p99_ms")
+DEVICE_FIELDS = ("run", "step", "device", "published", "errors", "dropped", "throttled_s", "rate",
+                 "latency_count", "p50_ms", "p99_ms", "max_ms", "received", "lost", "duplicates", "reordered",
+                 "wire_bytes")
+
+
+def git_revision(path: str = None) -> str:
+    """
+    Function returning the abbreviated git revision of the working tree at 'path' (default: this module's),
+    suffixed with '-dirty' if there are uncommitted changes, or 'unknown' outside of a git checkout.
+    """
+    path = path or os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=path, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=path,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if status else revision
+
+
+def step_row(run: str, scenario: str, step: int, scale: float, report, latency: dict = None,
+             ingest: dict = None) -> dict:
+    """
+    Function returning the steps.csv row of 'report' (fleet.StepReport), the latency summary of
+    LatencyCollector.finish_step() and the ingest summary of IngestSink.finish_step(), if any.
+    """
+    rates = report.rate_report
+    overall = latency["overall"] if latency else {}
+    sequences = latency["sequences"]["overall"] if latency and latency.get("sequences") else {}
+    return {
+        "run": run, "scenario": scenario, "step": step, "scale": scale,
+        "devices": len(report.devices), "published": report.published, "errors": report.errors,
+        "dropped": report.dropped, "throttled_s": round(report.throttled, 3),
+        "duration": round(report.duration, 3), "rate": round(report.rate, 2),
+        "requested_ticks": round(rates.requested_rate, 2), "achieved_ticks": round(rates.achieved_rate, 2),
+        "missed": rates.missed, "lag_mean_ms": round(rates.mean_lag * 1000, 3),
+        "lag_max_ms": round(rates.max_lag * 1000, 3),
+        "latency_count": overall.get("count", 0), "p50_ms": overall.get("p50"), "p99_ms": overall.get("p99"),
+        "p99.9_ms": overall.get("p99.9"), "max_ms": overall.get("max"),
+        "received": sequences.get("received"), "lost": sequences.get("lost"),
+        "duplicates": sequences.get("duplicates"), "reordered": sequences.get("reordered"),
+        "loss_rate": round(sequences["loss_rate"], 6) if sequences else None,
+        "wire_bytes": report.wire_bytes, "bytes_per_message": round(report.bytes_per_message, 2),
+        "ingested": ingest["stored"] if ingest else None,
+        "ingest_rate": round(ingest["stored"] / report.duration, 2) if ingest and report.duration else None,
+        "ingest_backlog": ingest["backlog"] if ingest else None,
+        "ingest_p99_ms": ingest["store_lag"]["p99"] if ingest else None,
+        "ingest_e2e_p99_ms": ingest["end_to_end"]["p99"] if ingest else None}
+
+
+def device_rows(run: str, step: int, report, latency: dict = None) -> list:
+    """
+    Function returning the devices.csv rows of 'report' and the per-device latency summaries.
+    """
+    latencies = latency["devices"] if latency else {}
+    sequences = latency["sequences"]["devices"] if latency and latency.get("sequences") else {}
+    rows = []
+    for device, (published, errors, dropped, throttled, wire_bytes) in sorted(report.devices.items()):
+        summary = latencies.get(device, {})
+        counts = sequences.get(device, {})
+        rows.append({
+            "run": run, "step": step, "device": device, "published": published, "errors": errors,
+            "dropped": dropped, "throttled_s": round(throttled, 3),
+            "rate": round(published / report.duration, 3) if report.duration else 0.0,
+            "latency_count": summary.get("count", 0), "p50_ms": summary.get("p50"),
+            "p99_ms": summary.get("p99"), "max_ms": summary.get("max"),
+            "received": counts.get("received"), "lost": counts.get("lost"),
+            "duplicates": counts.get("duplicates"), "reordered": counts.get("reordered"), "wire_bytes": wire_bytes})
+    return rows
+
+
+class ResultsRecorder():
+    """
+    Writes the results of one run below 'directory', 'config' (e.g. the command line options and
+    the scenario) is stored in run.json together with the git revision.
+    """
+    def __init__(self, directory: str, scenario: str, config: dict):
+        self.scenario = scenario
+        self.run = f"{time.strftime('%Y%m%d-%H%M%S')}-{scenario}"
+        self.path = os.path.join(directory, self.run)
+        os.makedirs(self.path, exist_ok=True)
+        self.revision = git_revision()
+        with open(os.path.join(self.path, "run.json"), "w", encoding="utf-8") as file:
+            json.dump({"run": self.run, "scenario": scenario, "revision": self.revision,
+                       "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "host": platform.node(),
+                       "python": platform.python_version(), "config": config}, file, indent=2)
+        self.__steps_file = open(os.path.join(self.path, "steps.csv"), "w", newline="", encoding="utf-8")
+        self.__devices_file = open(os.path.join(self.path, "devices.csv"), "w", newline="", encoding="utf-8")
+        self.__steps = csv.DictWriter(self.__steps_file, STEP_FIELDS)
+        self.__devices = csv.DictWriter(self.__devices_file, DEVICE_FIELDS)
+        self.__steps.writeheader()
+        self.__devices.writeheader()
+        logger.info("Recording results of run %s (revision %s) to %s", self.run, self.revision, self.path)
+
+    def record_step(self, step: int, scale: float, report, latency: dict = None, ingest: dict = None) -> dict:
+        """
+        Function to append the results of evaluation step 'step' and return its steps.csv row.
+        The files are flushed, so the results of finished steps survive an aborted run.
+        """
+        row = step_row(self.run, self.scenario, step, scale, report, latency, ingest)
+        self.__steps.writerow(row)
+        self.__devices.writerows(device_rows(self.run, step, report, latency))
+        self.__steps_file.flush()
+        self.__devices_file.flush()
+        return row
+
+    def close(self):
+        """
+        Function to close the result files.
+        """
+        self.__steps_file.close()
+        self.__devices_file.close()
@@ -1,14 +1,19 @@
 """
 Module for simulating a dynamic number of different MQTT clients, i.e. sensors and actuators.
-Each client is run in its own thread.
+Each client runs its own paho network thread while the ticks of all clients are issued by a
+shared scheduler (see scheduler.py), or all clients share one asyncio event loop (see engine.py).
+The fleet mix and the evaluation steps are described by a scenario (see scenario.py).
 """
 
 # pylint: disable=too-many-arguments, unused-argument
 
 from abc import abstractmethod
+import argparse
+import asyncio
 from datetime import datetime
-import json
+import functools
 import logging
+import os
 import random
 import threading
 import time
@@ -17,6 +22,28 @@ from paho.mqtt.properties import Properties
 from paho.mqtt.packettypes import PacketTypes
 import paho.mqtt.client as mqtt
 import time
+from broker import BrokerThread
+from eventlog import EVENTS, configure_logging, parse_sampling
+from engine import DeviceEngine, connect_threaded, network_clients, reset_counters
+from fleet import ShardedFleet, StepReport, device_counters
+from ingest import FORMATS as INGEST_FORMATS, IngestSink, log_ingest
+from latency import LatencyCollector, encode_stamp, log_summary
+from metrics import REGISTRY, start_http_server
+import mqttClient
+from backpressure import POLICIES, InFlightWindow
+import payload
+from payload import get_template
+from pool import ConnectionPool
+from profiler import MODES as PROFILE_MODES, SamplingProfiler
+from readings import MODELS, attach_readings
+from reporting import log_reporting
+from results import ResultsRecorder, step_row
+from scenario import Scenario, load_scenario, register_devices
+from statestore import STATES
+from scheduler import RateReport, RateScheduler
+from sequence import SEQUENCE_PROPERTY, stamp_sequence
+from tracefile import TRACE, TraceReader, read_traces
+from wire import PublishProperties, TopicAliases, properties_size, publish_size
 
 logger = logging.getLogger('Evaluation')
 ch = logging.StreamHandler()
@@ -40,9 +67,21 @@ class MQTTClient():
     Abstract class for MQTT-based clients.
     Handles basic callbacks, logging, and instantiation of paho.mqtt.client
     """
-    broker_url = "192.168.2.171"
-    broker_port = 1883
+    broker_url = os.environ.get("MQTT_BROKER_HOST", "192.168.2.171")
+    broker_port = int(os.environ.get("MQTT_BROKER_PORT", 1883))
     main_topic = "evaluation"
+    qos = 0
+    # maximum number of unacknowledged publishes per client (0: unbounded) and the policy
+    # applied when they are reached, see backpressure.py
+    max_in_flight = 0
+    backpressure = "drop"
+    # "datetime" stamps str(datetime.now()), "monotonic" a compact binary nanosecond stamp (see latency.py),
+    # "none" sends no CorrelationData
+    correlation_stamp = "datetime"
+    # publish with topic aliases and lightweight properties (see wire.py)
+    lean_publish = False
+    # stamp every message with a per-device sequence number (see sequence.py)
+    sequence_numbers = False
 
     @abstractmethod
     def __init__(self, topic: str, interval: int, enable_detailed_logger=False):
@@ -56,6 +95,19 @@ class MQTTClient():
         self.client.on_subscribe = self.__on_subscribe
         self.client.on_unsubscribe = self.__on_unsubscribe
         self.client.on_message = self.__on_message
+        self.published = 0
+        self.errors = 0
+        # size of the published PUBLISH packets on the wire
+        self.wire_bytes = 0
+        self.sequence = 0
+        self.aliases = TopicAliases(self.client) if self.lean_publish else None
+        # publishes only the changed fields of the state if set (see reporting.py)
+        self.reporter = None
+        self.metrics = REGISTRY.device(self.name) if REGISTRY.enabled else None
+        self.window = None
+        if self.max_in_flight:
+            self.window = InFlightWindow(self.max_in_flight, self.backpressure)
+            self.window.attach(self)
 
         if enable_detailed_logger:
             self.client.enable_logger(logger)
@@ -66,13 +118,67 @@ class MQTTClient():
         """
         self.client.connect(self.broker_url, self.broker_port, keepalive=60)
 
-    def publish(self, payload: str, correlation_data: str = None):
+    def publish(self, payload: str, correlation_data: bytes = None):
         """
-        Helper function to publish a message to a topic of the MQTT-broker using paho.mqtt.client
+        Helper function to publish a message to a topic of the MQTT-broker using paho.mqtt.client,
+        stamped with 'correlation_data' if given, else with the current time.
+        Returns whether paho accepted the message.
         """
-        properties = Properties(PacketTypes.PUBLISH)
-        properties.CorrelationData = str(datetime.now()).encode('utf-8')
-        self.client.publish(self.topic, qos=0, payload=payload, properties=properties, retain=False)
+        if correlation_data is None and self.correlation_stamp != "none":
+            correlation_data = (encode_stamp() if self.correlation_stamp == "monotonic"
+                                else str(datetime.now()).encode('utf-8'))
+        window = self.window
+        if window and not window.acquire():
+            return False
+        topic = self.topic
+        if self.aliases:
+            topic, alias = self.aliases.resolve(topic)
+            properties = PublishProperties(correlation_data, alias)
+        else:
+            properties = Properties(PacketTypes.PUBLISH)
+            if correlation_data is not None:
+                properties.CorrelationData = correlation_data
+        if self.sequence_numbers:
+            # numbers are only used up by messages paho accepted, gaps at the subscriber are lost messages
+            sequence = self.sequence + 1
+            stamp_sequence(properties, sequence)
+        info = self.client.publish(topic, qos=self.qos, payload=payload, properties=properties, retain=False)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.published += 1
+            if self.aliases:
+                self.aliases.sent(topic, alias)
+                properties_length = len(properties.pack())
+            else:
+                properties_length = properties_size(
+                    correlation_data, None, (SEQUENCE_PROPERTY, str(sequence)) if self.sequence_numbers else None)
+            self.wire_bytes += publish_size(len(topic), len(payload), self.qos, properties_length)
+            if self.sequence_numbers:
+                self.sequence = sequence
+            if EVENTS.publish:
+                EVENTS.publish("%s published %s", self.name, payload, device=self.name)
+            if TRACE.record:
+                TRACE.record(self.name, self.topic, payload, correlation_data, self.qos)
+        else:
+            self.errors += 1
+            if window:
+                window.release()
+        if self.metrics:
+            self.metrics.published(info)
+        return info.rc == mqtt.MQTT_ERR_SUCCESS
+
+    def publish_state(self):
+        """
+        Helper function to publish the state of the client, only its changed fields if it reports by exception.
+        """
+        if not self.reporter:
+            self.publish(self.template.render(self.state))
+            return
+        fields = self.reporter.changed(self.state)
+        if fields is None:
+            return
+        payload = self.reporter.render(self.state, fields)
+        if self.publish(payload):
+            self.reporter.commit(self.state, fields, payload)
 
     def subscribe(self, topic):
         """
@@ -81,16 +187,28 @@ class MQTTClient():
         self.client.subscribe(topic, qos=2, options=None, properties=None)
 
     def __on_publish(self, client, userdata, mid):
-        #logger.info("%s published (Mid: %s)", self.name, mid)
-        pass
+        if EVENTS.ack:
+            EVENTS.ack("%s published (mid: %s)", self.name, mid, device=self.name)
+        if self.window:
+            self.window.release()
+        if self.metrics:
+            self.metrics.acknowledged(mid)
 
     def __on_connect(self, client, userdata, flags, response_code, properties):
+        if self.metrics:
+            self.metrics.connect(response_code)
+        if self.aliases:
+            self.aliases.connected(client, properties)
         if response_code == 0:
             logger.info("\033[0;36m %s connected to %s:%s \033[0m", self.name, self.broker_url, self.broker_port)
         else:
             logger.warning("Failed to connect, return code %d\n", response_code)
 
-    def __on_disconnect(self, client, userdata, flags, response_code):
+    def __on_disconnect(self, client, userdata, response_code, properties=None):
+        if self.window:
+            self.window.clear()
+        if self.metrics:
+            self.metrics.disconnect(response_code)
         logger.info("\033[0;36m %s disconnected from %s:%s \033[0m", self.name, self.broker_url, self.broker_port)
         
 
@@ -103,8 +221,8 @@ class MQTTClient():
         pass
 
     def __on_message(self, client, userdata, message):
-        #logger.info("%s received message: %s", self.name, message.payload.decode('utf-8'))
-        pass
+        if EVENTS.message:
+            EVENTS.message("%s received message: %s", self.name, message.payload.decode('utf-8'), device=self.name)
 
 
 class MQTTSensor(MQTTClient):
@@ -113,19 +231,33 @@ class MQTTSensor(MQTTClient):
     The sensor publishes simulated status updates to a topic named after the sensor itself.
     """
     @abstractmethod
-    def __init__(self, client_name: str, interval: int, simulation):
+    def __init__(self, client_name: str, interval: int, simulation, start: bool = True):
         super().__init__(client_name, interval)
-        self.connect()
-        self.client.loop_start()
+        if start:
+            self.connect()
+            self.client.loop_start()
         self.__tick = simulation
         self.interval = interval
 
+    def tick(self):
+        """
+        Function to run a single simulation step, i.e. publish one status update.
+        """
+        self.__tick()
+
+    def next_interval(self) -> float:
+        """
+        Function returning the delay in seconds until the next simulation step.
+        """
+        return 1/self.interval
+
     def loop(self):
         """
         Function to keep the sensor alive within its independent thread.
         """
         while SIMULATION_ALIVE and SIMULATION_ALIVE2:
             self.__tick()
+            time.sleep(self.next_interval())
         self.client.disconnect()
 
 class MQTTDivider(MQTTClient):
@@ -151,23 +283,42 @@ class TemperatureSensor(MQTTSensor):
     """
     Object simulating an MQTT-based temperature sensor.
     """
-    def __init__(self, sensor_name: str, interval: int):
-        super().__init__(sensor_name, interval, self.__simulation)
+    message = '{ "temperature": 0, "humidity": 0, "battery": 0, "linkquality": 0 }'
+    ranges = {"temperature": (10, 30), "humidity": (40, 90), "battery": (89, 92), "linkquality": (50, 255)}
+
+    def __init__(self, sensor_name: str, interval: int, start: bool = True):
+        self.template = get_template(self.message)
+        self.state = STATES.view(self.template, sensor_name)
+        # optional callable returning the next readings in field order (see readings.py)
+        self.readings = None
+        super().__init__(sensor_name, interval, self.__simulation, start)
 
     def __simulation(self):
-        message = {
-            "temperature": get_next_random(10, 30),
-            "humidity": get_next_random(40, 90),
-            "battery": get_next_random(89, 92),
-            "linkquality": get_next_random(50, 255)}
-        self.publish(payload=json.dumps(message))
-        time.sleep(1/self.interval)
+        state = self.state
+        if self.readings:
+            for field, value in zip(self.ranges, self.readings()):
+                state[field] = value
+        else:
+            for field, (lower, upper) in self.ranges.items():
+                state[field] = get_next_random(lower, upper)
+        self.publish_state()
+
+class ReplayDevice(MQTTClient):
+    """
+    Object publishing the recorded messages of a device, see replay_trace().
+    """
+    def __init__(self, client_name: str):
+        super().__init__(client_name, 0)
+
 
 class Divider(MQTTDivider):
     """
     Object simulating an MQTT-based temperature sensor.
     """
+    message = '{ "temperature": 0, "humidity": 0, "battery": 0, "linkquality": 0 }'
+
     def __init__(self, sensor_name: str, interval: int):
+        self.template = get_template(self.message)
         super().__init__(sensor_name, interval, self.__simulation)
 
     def __simulation(self):
@@ -176,11 +327,300 @@ class Divider(MQTTDivider):
             "humidity": get_next_random(40, 90),
             "battery": get_next_random(89, 92),
             "linkquality": get_next_random(50, 255)}
-        self.publish(payload=json.dumps(message))
+        self.publish(payload=self.template.render(message))
 
 
+def chain(*callbacks):
+    """
+    Function returning a callable calling all 'callbacks' that are not None in order.
+    """
+    callbacks = [callback for callback in callbacks if callback is not None]
+
+    def call_all():
+        for callback in callbacks:
+            callback()
+    return call_all
+
+
+def run_scenario(scenario: Scenario, engine: str = "threads", processes: int = 1, devices_per_connection: int = 0,
+                 readings: str = None, seed: int = None, collector: LatencyCollector = None,
+                 recorder: ResultsRecorder = None, metrics_port: int = None, trace: str = None,
+                 profile: dict = None, sink: IngestSink = None) -> list:
+    """
+    Function to run all steps of 'scenario' against the configured broker.
+    With a 'collector' the end-to-end latency is measured, with a 'recorder' the results are stored.
+    With a 'metrics_port' live metrics are served (see metrics.py), by every worker process on its own port.
+    With a 'trace' all published messages are recorded to this file (see tracefile.py),
+    by every worker process to 'trace'.<index>.
+    With a 'profile' ('step', 'path', 'interval' and 'mode', see profiler.py) the measurement of this
+    step is profiled and written to 'path'.*, by every worker process to 'path'.<index>.*.
+    With a 'sink' the consumer throughput and lag of storing all messages are measured (see ingest.py).
+    Returns the steps.csv rows (see results.py) of all steps.
+    """
+    register_devices("run", TemperatureSensor)
+    scenario.log()
+    fleet = None
+    if processes != 1:
+        fleet_readings = {"model": readings, "seed": seed} if readings else None
+        fleet = ShardedFleet(scenario.create, scenario.names, processes or None, fleet_readings,
+                             devices_per_connection, scenario.connect_rate, scenario.connect_timeout, metrics_port,
+                             trace)
+        fleet.start()
+    else:
+        if metrics_port is not None:
+            start_http_server(metrics_port)
+        if trace:
+            TRACE.start(trace)
+    rows = []
+    for step, scale in enumerate(scenario.steps, 1):
+        logger.info(f"Evaluation step {step}/{len(scenario.steps)} of scenario '{scenario.name}' "
+                    f"using {len(scenario.names)} clients at {scale}x rate.")
+        # include one client to seperate
+        threading.Thread(name="DIVIDER", target=Divider("DIVIDER", scale).loop).start()
+
+        on_measure = chain(functools.partial(collector.start_step, step) if collector else None,
+                           functools.partial(sink.start_step, step) if sink else None)
+        step_profile = None
+        if profile and profile["step"] == step:
+            step_profile = {key: profile[key] for key in ("path", "interval", "mode")}
+        if fleet:
+            report = fleet.run_step(scale, scenario.measure, scenario.warmup, on_measure, step_profile)
+        else:
+            profiler = SamplingProfiler(step_profile["interval"], step_profile["mode"]) if step_profile else None
+            if profiler:
+                on_measure = chain(on_measure, profiler.start)
+            pool = ConnectionPool(devices_per_connection) if devices_per_connection else None
+            devices = scenario.create_all(scale, pool.attach if pool else None)
+            if readings:
+                attach_readings(devices, readings, seed, step)
+            if engine == "asyncio":
+                device_engine = DeviceEngine(devices, connect_rate=scenario.connect_rate,
+                                             connect_timeout=scenario.connect_timeout)
+                rates = asyncio.run(device_engine.run(scenario.measure, scenario.warmup, on_measure))
+                if profiler:
+                    profiler.stop()
+            else:
+                connect_threaded(devices, scenario.connect_rate, scenario.connect_timeout)
+                scheduler = RateScheduler()
+                for device in devices:
+                    if hasattr(device, "tick"):
+                        scheduler.add(device)
+                scheduler.run(scenario.warmup)
+                reset_counters(devices)
+                if on_measure:
+                    on_measure()
+                scheduler.run(scenario.measure)
+                if profiler:
+                    profiler.stop()
+                rates = scheduler.report()
+                for client in network_clients(devices):
+                    client.disconnect()
+                    client.loop_stop()
+            report = StepReport(scale, rates.elapsed, {0: device_counters(devices)}, {0: rates})
+            if pool:
+                pool.log()
+            log_reporting(devices)
+            if profiler:
+                profiler.save(step_profile["path"])
+        report.log()
+        latency = None
+        if collector:
+            latency = collector.finish_step()
+            log_summary(latency)
+        ingest = None
+        if sink:
+            ingest = sink.finish_step()
+            log_ingest(ingest, report)
+        if recorder:
+            rows.append(recorder.record_step(step, scale, report, latency, ingest))
+        else:
+            rows.append(step_row(None, scenario.name, step, scale, report, latency, ingest))
+
+        time.sleep(scenario.cooldown)
+
+    if fleet:
+        fleet.close()
+    TRACE.stop()
+    return rows
+
+
+def replay_trace(paths: list, speed: float = 1.0, keep_correlation: bool = False, connect_rate: float = 100,
+                 connect_timeout: float = 30, collector: LatencyCollector = None,
+                 recorder: ResultsRecorder = None, profile: dict = None, sink: IngestSink = None) -> dict:
+    """
+    Function to publish the messages of the traces 'paths' (see tracefile.py) again through MQTTClient.publish,
+    'speed' times as fast as recorded (0: as fast as possible). Every recorded device is replayed by its
+    own client, the messages are sent from a single thread. The recorded correlation data is replaced
+    by a fresh stamp, so the end-to-end latency can be measured, unless 'keep_correlation'. Every message is
+    published with the QoS it was recorded with.
+    With a 'profile' for step 1 (see run_scenario()), the replay is profiled, with a 'sink' stored.
+    Returns the steps.csv row (see results.py) of the replay.
+    """
+    readers = [TraceReader(path) for path in paths]
+    devices = {}
+    for reader in readers:
+        for name in reader.names()[0]:
+            if name not in devices:
+                devices[name] = ReplayDevice(name)
+    logger.info("Replaying %s devices of %s at %s", len(devices), ", ".join(paths),
+                f"{speed}x speed" if speed else "maximum speed")
+    connect_threaded(list(devices.values()), connect_rate, connect_timeout)
+    if collector:
+        collector.start_step(1)
+    if sink:
+        sink.start_step(1)
+    profiler = None
+    if profile and profile["step"] == 1:
+        profiler = SamplingProfiler(profile["interval"], profile["mode"])
+        profiler.start()
+    ticks = 0
+    max_lag = total_lag = 0.0
+    first = None
+    started = time.monotonic()
+    for message in read_traces(readers):
+        if speed:
+            if first is None:
+                first = message.time
+            delay = started + (message.time - first) / 1e9 / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+                total_lag -= delay
+        device = devices[message.device]
+        if device.topic != message.topic:
+            device.topic = message.topic
+        if device.qos != message.qos:
+            device.qos = message.qos
+        device.publish(message.payload, message.correlation_data if keep_correlation else None)
+        ticks += 1
+    elapsed = time.monotonic() - started
+    if profiler:
+        profiler.stop()
+        profiler.save(profile["path"])
+    for client in network_clients(list(devices.values())):
+        client.disconnect()
+        client.loop_stop()
+    for reader in readers:
+        reader.close()
+    report = StepReport(speed, elapsed, {0: device_counters(devices.values())},
+                        {0: RateReport(elapsed, ticks, 0, max_lag, total_lag)})
+    report.log()
+    latency = None
+    if collector:
+        # the last messages are still on their way from the broker to the collector
+        time.sleep(1)
+        latency = collector.finish_step()
+        log_summary(latency)
+    ingest = None
+    if sink:
+        ingest = sink.finish_step()
+        log_ingest(ingest, report)
+    if recorder:
+        return recorder.record_step(1, speed, report, latency, ingest)
+    return step_row(None, "replay", 1, speed, report, latency, ingest)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluation run of simulated MQTT sensors.")
+    parser.add_argument("--broker-host", default=MQTTClient.broker_url, help="address of the MQTT broker")
+    parser.add_argument("--broker-port", type=int, default=MQTTClient.broker_port, help="port of the MQTT broker")
+    parser.add_argument("--local-broker", action="store_true",
+                        help="run an embedded broker on localhost instead of connecting to --broker-host")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads",
+                        help="run every client in its own threads or all clients in one asyncio event loop")
+    parser.add_argument("--scenario",
+                        help="scenario file (JSON or YAML) with fleet mix, steps and timing, see scenarios/")
+    parser.add_argument("--clients", type=int, default=10,
+                        help="number of simulated temperature sensors of the default sweep (without --scenario)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="split the sensors across this many worker processes (0: one per core)")
+    parser.add_argument("--devices-per-connection", type=int, default=0,
+                        help="multiplex this many sensors over one shared MQTT connection (0: one connection each)")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0, help="QoS of the sensor status updates")
+    parser.add_argument("--max-in-flight", type=int, default=0,
+                        help="maximum number of unacknowledged publishes per client (0: unbounded)")
+    parser.add_argument("--backpressure", choices=POLICIES, default="drop",
+                        help="what a client does when its in-flight window is full: hold back its ticks (block), "
+                             "drop or adaptively slow down")
+    parser.add_argument("--stamp", choices=("datetime", "monotonic", "none"), default="datetime",
+                        help="format of the CorrelationData stamp used for latency measurements, none to omit it")
+    parser.add_argument("--lean-publish", action="store_true",
+                        help="publish with MQTT v5 topic aliases and lightweight properties (see wire.py)")
+    parser.add_argument("--encoding", choices=("json", "struct"), default="json",
+                        help="payload encoding of the sensors, JSON or compact binary struct")
+    parser.add_argument("--readings", choices=MODELS,
+                        help="generate the sensor readings of the whole fleet in batches using this model (needs numpy)")
+    parser.add_argument("--seed", type=int, help="seed for reproducible batched readings")
+    parser.add_argument("--latency", action="store_true",
+                        help="subscribe to the evaluation topics and report end-to-end latency per step")
+    parser.add_argument("--sequence", action="store_true",
+                        help="stamp per-device sequence numbers and report lost, duplicated and reordered messages per step")
+    parser.add_argument("--ingest", metavar="DIRECTORY",
+                        help="store all device messages in a columnar store in this directory and report "
+                             "consumer throughput and lag per step (see ingest.py)")
+    parser.add_argument("--ingest-format", choices=INGEST_FORMATS,
+                        help="segment format of the ingest store (default: parquet if pyarrow is installed)")
+    parser.add_argument("--ingest-batch", type=int, default=5000,
+                        help="store the received messages as soon as this many are waiting")
+    parser.add_argument("--ingest-flush", type=float, default=1.0,
+                        help="seconds between two batches of the ingest store at the latest")
+    parser.add_argument("--ingest-roll", type=float, default=60.0,
+                        help="seconds after which the ingest store starts a new segment")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve live metrics in Prometheus text format on this port (worker processes: port + index)")
+    parser.add_argument("--log-file", help="write the log to this file instead of the console")
+    parser.add_argument("--log-format", choices=("text", "json"), default="text",
+                        help="log format, json writes one structured record per line")
+    parser.add_argument("--log-queue", action="store_true",
+                        help="hand log records to a background writer thread instead of writing them synchronously")
+    parser.add_argument("--log-events", default="",
+                        help="per-message events to log with the sampled fraction, e.g. publish=0.001,ack=0.01,message=1")
+    parser.add_argument("--log-rate", type=float,
+                        help="maximum number of logged per-message events per second and event type")
+    parser.add_argument("--record-trace", metavar="PATH",
+                        help="record all published messages to this binary trace file (worker processes: PATH.<index>)")
+    parser.add_argument("--replay", nargs="+", metavar="PATH",
+                        help="publish the messages of recorded traces again instead of running a scenario")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="replay the traces this many times as fast as recorded (0: as fast as possible)")
+    parser.add_argument("--replay-correlation", action="store_true",
+                        help="replay the recorded correlation data instead of stamping the messages anew")
+    parser.add_argument("--profile", type=int, metavar="STEP",
+                        help="profile the measurement of this evaluation step (see profiler.py)")
+    parser.add_argument("--profile-output", default="profile", metavar="PATH",
+                        help="write the collapsed stacks to PATH.collapsed and the summary to PATH.csv, "
+                             "fleet workers to PATH.<index>.*")
+    parser.add_argument("--profile-interval", type=float, default=10,
+                        help="milliseconds between two samples of the profiler")
+    parser.add_argument("--profile-mode", choices=PROFILE_MODES, default="cpu",
+                        help="weight samples with the CPU time of the thread (cpu) or count them (wall)")
+    parser.add_argument("--results", help="directory to record per-step and per-device results in (see results.py)")
+    args = parser.parse_args()
+    log_listener = None
+    if args.log_file or args.log_format == "json" or args.log_queue:
+        log_listener = configure_logging(logger, args.log_file, args.log_format == "json", args.log_queue)
+    EVENTS.configure(parse_sampling(args.log_events), args.log_rate)
+    if args.seed is not None:
+        # once for the whole run, the remaining randomness (e.g. staggering) differs from step to step
+        random.seed(args.seed)
+    MQTTClient.broker_url, MQTTClient.broker_port = args.broker_host, args.broker_port
+    local_broker = None
+    if args.local_broker:
+        local_broker = BrokerThread("127.0.0.1", 0)
+        local_broker.start()
+        MQTTClient.broker_url, MQTTClient.broker_port = local_broker.host, local_broker.port
+    mqttClient.host, mqttClient.port = MQTTClient.broker_url, MQTTClient.broker_port
+    MQTTClient.correlation_stamp = args.stamp
+    # the devices of mqttClient.py keep their uuid stamps unless a compact stamp or none is requested
+    mqttClient.correlation_stamp = "uuid" if args.stamp == "datetime" else args.stamp
+    MQTTClient.lean_publish = mqttClient.lean_publish = args.lean_publish
+    MQTTClient.qos = args.qos
+    MQTTClient.sequence_numbers = mqttClient.sequence_numbers = args.sequence
+    MQTTClient.max_in_flight = mqttClient.max_in_flight = args.max_in_flight
+    MQTTClient.backpressure = mqttClient.backpressure = args.backpressure
+    payload.ENCODING = args.encoding
+
     SIMULATION_ALIVE2 = True
     SIMULATION_ALIVE = True
     logger.info(" =======================================================")
@@ -194,37 +634,46 @@ if __name__ == "__main__":
     logger.info("                                                        ")
     logger.info("                                                        ")
 
-    pointer = 40
-    msg_max = 10000
-    interval = 1
-    steps = 10
-    while pointer < msg_max:
-        logger.info(f"Evaluation run using 10 clients producing {pointer} messages.")
-        SIMULATION_ALIVE = True
-        # include one client to seperate
-        thread000= threading.Thread(name="DIVIDER", target=Divider("DIVIDER",interval).loop).start()
-        time.sleep(10)
-
-        measure = time.time() + 60
-        thread1 = threading.Thread(name="temperature-sensor1", target=TemperatureSensor("temperature-sensor1",interval).loop).start()
-        thread2 = threading.Thread(name="temperature-sensor2", target=TemperatureSensor("temperature-sensor2",interval).loop).start()
-        thread3 = threading.Thread(name="temperature-sensor3", target=TemperatureSensor("temperature-sensor3",interval).loop).start()
-        thread4 = threading.Thread(name="temperature-sensor4", target=TemperatureSensor("temperature-sensor4",interval).loop).start()
-        thread5 = threading.Thread(name="temperature-sensor5", target=TemperatureSensor("temperature-sensor5",interval).loop).start()
-        thread6 = threading.Thread(name="temperature-sensor6", target=TemperatureSensor("temperature-sensor6",interval).loop).start()
-        thread7 = threading.Thread(name="temperature-sensor7", target=TemperatureSensor("temperature-sensor7",interval).loop).start()
-        thread8 = threading.Thread(name="temperature-sensor8", target=TemperatureSensor("temperature-sensor8",interval).loop).start()
-        thread9 = threading.Thread(name="temperature-sensor9", target=TemperatureSensor("temperature-sensor9",interval).loop).start()
-        thread10 = threading.Thread(name="temperature-sensor10", target=TemperatureSensor("temperature-sensor10",interval).loop).start()
-
-        while time.time() < measure:
-            pass
-        SIMULATION_ALIVE = False
-
-        interval = interval + 1
-        pointer = pointer + steps
-        time.sleep(10)
-        
+    scenario = load_scenario(args.scenario) if args.scenario else Scenario.sweep(args.clients)
+    profile = None
+    if args.profile is not None:
+        profile = {"step": args.profile, "path": args.profile_output, "interval": args.profile_interval / 1000,
+                   "mode": args.profile_mode}
+    collector = None
+    if args.latency or args.sequence:
+        collector = LatencyCollector(MQTTClient.broker_url, MQTTClient.broker_port,
+                                     topic=f"{MQTTClient.main_topic}/#", sequences=args.sequence)
+        collector.start()
+    sink = None
+    if args.ingest:
+        sink = IngestSink(MQTTClient.broker_url, MQTTClient.broker_port, args.ingest,
+                          (f"{MQTTClient.main_topic}/#", f"{mqttClient.main_topic}#"), args.ingest_batch,
+                          args.ingest_flush, args.ingest_roll, args.ingest_format)
+        sink.start()
+    recorder = None
+    if args.results:
+        recorder = ResultsRecorder(args.results, "replay" if args.replay else scenario.name,
+                                   {"options": vars(args), "scenario": None if args.replay else scenario.to_dict()})
+    if args.replay:
+        if args.metrics_port is not None:
+            start_http_server(args.metrics_port)
+        if args.record_trace:
+            TRACE.start(args.record_trace)
+        replay_trace(args.replay, args.replay_speed, args.replay_correlation, scenario.connect_rate,
+                     scenario.connect_timeout, collector, recorder, profile, sink)
+        TRACE.stop()
+    else:
+        run_scenario(scenario, args.engine, args.processes, args.devices_per_connection, args.readings, args.seed,
+                     collector, recorder, args.metrics_port, args.record_trace, profile, sink)
+    if recorder:
+        recorder.close()
+    if collector:
+        collector.stop()
+    if sink:
+        sink.stop()
+    if local_broker:
+        local_broker.stop()
+
     while SIMULATION_ALIVE2:
         try:
             time.sleep(.1)
@@ -243,3 +692,5 @@ if __name__ == "__main__":
     logger.info("                                                        ")
     logger.info("                                                        ")
     logger.info("                                                        ")
+    if log_listener:
+        log_listener.stop()
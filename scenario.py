@@ -0,0 +1,240 @@
+"""
+Module for describing an evaluation run declaratively instead of hard-coding it in run.py.
+A scenario file (JSON, or YAML if PyYAML is installed) lists the fleet mix, i.e. any device type
+of run.py and mqttClient.py with its count and rate, the step schedule and the connect ramp-up,
+warm-up, measurement and cool-down windows of every step, e.g.
+
+    {
+        "name": "smart-home",
+        "devices": [
+            {"type": "run.TemperatureSensor", "count": 100, "rate": 1},
+            {"type": "mqttClient.LEDBulb", "count": 20},
+            {"type": "mqttClient.SmokeDetector", "count": 50, "arrival": {"process": "storm", "every": 120}}
+        ],
+        "steps": [1, 2, 4],
+        "ramp_up": {"rate": 100, "timeout": 30},
+        "warmup": 10,
+        "measure": 60,
+        "cooldown": 10
+    }
+
+Every step multiplies the rates of all device groups by its scale, a range of scales can be given
+as {"start": 1, "stop": 10, "step": 1} (including 'stop'). Instead of publishing at a fixed rate,
+a device group can follow a stochastic arrival process (see arrivals.py). Sensor groups can also
+report by exception, i.e. publish only the fields that changed (see reporting.py).
+"""
+
+import importlib
+import inspect
+import json
+import logging
+import os
+import re
+
+from arrivals import arrival_config, attach_arrivals
+from reporting import attach_reporting, report_config
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger('Evaluation')
+
+# device classes by type name, resolved by importing '<module>.<class>' if not registered
+DEVICE_TYPES = {}
+
+
+def register_devices(module: str, *classes):
+    """
+    Function to register device 'classes' as '<module>.<class>', e.g. the classes of a script
+    running as __main__ that must not be imported a second time.
+    """
+    for cls in classes:
+        DEVICE_TYPES[f"{module}.{cls.__name__}"] = cls
+
+
+def resolve_device_type(kind: str):
+    """
+    Function returning the device class of type 'kind', e.g. 'mqttClient.LEDBulb'.
+    """
+    if kind not in DEVICE_TYPES:
+        module, _, name = kind.rpartition(".")
+        if not module:
+            raise ValueError(f"Device type '{kind}' has to be given as <module>.<class>")
+        DEVICE_TYPES[kind] = getattr(importlib.import_module(module), name)
+    return DEVICE_TYPES[kind]
+
+
+class DeviceGroup():
+    """
+    'count' devices of type 'kind' named '<prefix><index>'.
+    Sensors publish 'rate' status updates per second (scaled by the step), without a rate
+    devices keep their own interval. The prefix defaults to the class name, e.g. 'led-bulb'.
+    With an 'arrival' process (see arrivals.arrival_config()), the devices publish at its
+    random times, with the group rate (or their own) on average. With a 'report' configuration
+    (see reporting.report_config()), sensors report by exception.
+    """
+    def __init__(self, kind: str, count: int, rate: float = None, prefix: str = None, arrival=None,
+                 report=None):
+        if count < 0:
+            raise ValueError(f"Negative count of device type '{kind}'")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"Rate of device type '{kind}' has to be positive")
+        self.kind = kind
+        self.count = count
+        self.rate = rate
+        self.prefix = prefix or re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", "-",
+                                       kind.rpartition(".")[2]).lower()
+        self.arrival = arrival_config(arrival) if arrival else None
+        self.report = report_config(report) if report else None
+
+    @property
+    def names(self) -> list:
+        """
+        Names of all devices of the group.
+        """
+        return [f"{self.prefix}{index}" for index in range(1, self.count + 1)]
+
+    def create(self, name: str, scale: float = 1, start: bool = False):
+        """
+        Function to construct device 'name' of this group running at 'scale' times the group rate.
+        """
+        cls = resolve_device_type(self.kind)
+        rate = self.rate * scale if self.rate is not None else scale
+        if "interval" in inspect.signature(cls).parameters:
+            # run.py devices take their rate in messages per second
+            device = cls(name, rate, start=start)
+        else:
+            device = cls(name, start=start)
+            if self.rate is not None and hasattr(device, "next_interval") and not self.arrival:
+                device.next_interval = lambda interval=1 / rate: interval
+                if getattr(device, "window", None):
+                    device.window.attach(device)
+        if self.arrival and hasattr(device, "next_interval"):
+            attach_arrivals(device, self.arrival, rate if self.rate is not None else None)
+        if self.report and hasattr(device, "reporter"):
+            attach_reporting(device, self.report)
+        return device
+
+
+class Scenario():
+    """
+    Fleet mix, step schedule and timing of an evaluation run.
+    'steps' are the rate scales of the evaluation steps. Devices connect at 'connect_rate'
+    connections per second at most (None: all at once), measurement starts once all of
+    them are connected (or after 'connect_timeout' seconds) and the 'warmup' is over.
+    """
+    def __init__(self, name: str, groups: list, steps: list, warmup: float = 10, measure: float = 60,
+                 cooldown: float = 10, connect_rate: float = 100, connect_timeout: float = 30):
+        names = [device for group in groups for device in group.names]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Device names of scenario '{name}' are not unique, set distinct prefixes")
+        if not steps:
+            raise ValueError(f"Scenario '{name}' has no steps")
+        self.name = name
+        self.groups = groups
+        self.steps = steps
+        self.warmup = warmup
+        self.measure = measure
+        self.cooldown = cooldown
+        self.connect_rate = connect_rate
+        self.connect_timeout = connect_timeout
+        self.__groups = {device: group for group in groups for device in group.names}
+
+    @classmethod
+    def from_dict(cls, config: dict, name: str = "scenario") -> "Scenario":
+        """
+        Function to create a scenario from the contents of a scenario file.
+        """
+        groups = [DeviceGroup(group["type"], group.get("count", 1), group.get("rate"), group.get("prefix"),
+                              group.get("arrival"), group.get("report"))
+                  for group in config["devices"]]
+        ramp_up = config.get("ramp_up", {})
+        steps = config.get("steps", [1])
+        if isinstance(steps, dict):
+            count = int(round((steps["stop"] - steps["start"]) / steps.get("step", 1))) + 1
+            steps = [steps["start"] + index * steps.get("step", 1) for index in range(count)]
+        return cls(config.get("name", name), groups, list(steps),
+                   config.get("warmup", 10), config.get("measure", 60), config.get("cooldown", 10),
+                   ramp_up.get("rate", 100), ramp_up.get("timeout", 30))
+
+    @classmethod
+    def sweep(cls, clients: int, steps: int = 996) -> "Scenario":
+        """
+        Function returning the former hard-coded evaluation: 'clients' temperature sensors
+        publishing 1, 2, 3, ... messages per second.
+        """
+        return cls("sweep", [DeviceGroup("run.TemperatureSensor", clients, 1, "temperature-sensor")],
+                   list(range(1, steps + 1)))
+
+    def to_dict(self) -> dict:
+        """
+        Function returning the scenario in the format of a scenario file.
+        """
+        return {
+            "name": self.name,
+            "devices": [{"type": group.kind, "count": group.count, "rate": group.rate, "prefix": group.prefix,
+                         "arrival": group.arrival, "report": group.report} for group in self.groups],
+            "steps": self.steps,
+            "ramp_up": {"rate": self.connect_rate, "timeout": self.connect_timeout},
+            "warmup": self.warmup,
+            "measure": self.measure,
+            "cooldown": self.cooldown}
+
+    @property
+    def names(self) -> list:
+        """
+        Names of all devices of the scenario.
+        """
+        return list(self.__groups)
+
+    def create(self, name: str, scale: float = 1, start: bool = False):
+        """
+        Function to construct device 'name' for a step with rate 'scale'.
+        Has the signature of the device classes of run.py, so it can be used in their place (e.g. by fleet.py).
+        """
+        return self.__groups[name].create(name, scale, start)
+
+    def create_all(self, scale: float = 1, attach=None) -> list:
+        """
+        Function to construct all devices (not connected yet) for a step with rate 'scale'.
+        'attach' (e.g. ConnectionPool.attach) is called with every device right after its construction,
+        so the paho client it replaces can be freed before the next device is constructed.
+        """
+        devices = []
+        for name in self.__groups:
+            device = self.create(name, scale)
+            if attach:
+                attach(device)
+            devices.append(device)
+        return devices
+
+    def log(self):
+        """
+        Function to log the fleet mix and schedule.
+        """
+        logger.info("Scenario '%s': %s steps, ramp-up %s connects/s, warm-up %ss, measurement %ss, cool-down %ss",
+                    self.name, len(self.steps), self.connect_rate or "unlimited", self.warmup, self.measure,
+                    self.cooldown)
+        for group in self.groups:
+            logger.info("  %s x %s at %s%s%s", group.count, group.kind,
+                        f"{group.rate} msg/s" if group.rate is not None else "its own interval",
+                        f", {group.arrival['process']} arrivals" if group.arrival else "",
+                        f", reporting by exception (deadband {group.report['deadband']}, "
+                        f"heartbeat {group.report['heartbeat']}s)" if group.report else "")
+
+
+def load_scenario(path: str) -> Scenario:
+    """
+    Function to load the scenario file 'path' (.json, .yaml or .yml).
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8") as file:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ImportError("YAML scenario files require PyYAML")
+            config = yaml.safe_load(file)
+        else:
+            config = json.load(file)
+    return Scenario.from_dict(config, name)
@@ -0,0 +1,201 @@
+"""
+Module for issuing the simulation ticks of many devices at their target rates from one place.
+Deadlines are kept in a heap and derived from the previous deadline instead of the time the
+previous tick finished, so the time spent publishing does not make the achieved rate drift.
+Devices falling too far behind skip the missed ticks instead of bursting them all at once.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('Evaluation')
+
+
+class RateReport():
+    """
+    Requested vs. achieved tick rate of a scheduler run.
+    """
+    def __init__(self, elapsed: float, ticks: int, missed: int, max_lag: float, total_lag: float):
+        self.elapsed = elapsed
+        self.ticks = ticks
+        self.missed = missed
+        self.max_lag = max_lag
+        self.total_lag = total_lag
+
+    @property
+    def requested_rate(self) -> float:
+        """
+        Ticks per second the devices asked for, including the ones that were missed.
+        """
+        return (self.ticks + self.missed) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def achieved_rate(self) -> float:
+        """
+        Ticks per second that were actually issued.
+        """
+        return self.ticks / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mean_lag(self) -> float:
+        """
+        Average delay in seconds between a tick's deadline and its execution.
+        """
+        return self.total_lag / self.ticks if self.ticks else 0.0
+
+    def merge(self, other: "RateReport") -> "RateReport":
+        """
+        Function for combining the reports of schedulers running side by side (e.g. in several processes).
+        """
+        return RateReport(max(self.elapsed, other.elapsed), self.ticks + other.ticks, self.missed + other.missed,
+                          max(self.max_lag, other.max_lag), self.total_lag + other.total_lag)
+
+    def log(self):
+        """
+        Function to log requested and achieved rate.
+        """
+        logger.info("Requested %.1f ticks/s, achieved %.1f ticks/s (%s ticks, %s missed, lag mean %.2fms max %.2fms)",
+                    self.requested_rate, self.achieved_rate, self.ticks, self.missed,
+                    self.mean_lag * 1000, self.max_lag * 1000)
+
+
+class RateScheduler():
+    """
+    Heap of tick deadlines for all devices, driven by the monotonic clock.
+    A device needs a tick() method and a next_interval() method returning the delay
+    in seconds until its next tick.
+    A device whose deadline lies more than 'max_catchup' intervals in the past skips
+    the missed ticks, they are counted as missed in the report.
+    A device whose in-flight window is full under the block policy (see backpressure.py) is not
+    waited for, its tick is retried every 'defer' seconds while the other devices keep ticking.
+    """
+    def __init__(self, max_catchup: int = 10, stagger: bool = True, defer: float = 0.001):
+        self.max_catchup = max_catchup
+        self.stagger = stagger
+        self.defer = defer
+        self.alive = False
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__wakeup = threading.Event()
+        self.__started = None
+        self.__ticks = 0
+        self.__missed = 0
+        self.__max_lag = 0.0
+        self.__total_lag = 0.0
+
+    def add(self, device, now: float = None):
+        """
+        Function to schedule the first tick of 'device'.
+        With 'stagger' the first ticks are spread over one interval to avoid all devices firing at once.
+        Devices driven by an arrival process (see arrivals.py) are not staggered, their first
+        interval is the time of their first tick.
+        """
+        now = time.monotonic() if now is None else now
+        window = getattr(device, "window", None)
+        if window is not None:
+            window.deferrable = True
+        interval = device.next_interval()
+        if getattr(device, "arrivals", None) is not None:
+            deadline = now + interval
+            interval = device.next_interval()
+        else:
+            deadline = now + random.uniform(0, interval) if self.stagger else now
+        heapq.heappush(self.__heap, (deadline, next(self.__sequence), interval, device))
+
+    def __run_due(self, now: float, end: float) -> float:
+        # issue the due ticks, at most one round over all devices so that the caller gets
+        # a chance to check 'end' and to serve the network, and return the next deadline
+        heap = self.__heap
+        budget = len(heap)
+        while heap and heap[0][0] <= now < end and budget:
+            budget -= 1
+            deadline, _, interval, device = heap[0]
+            window = getattr(device, "window", None)
+            if window is not None and not window.ready():
+                heapq.heapreplace(heap, (now + self.defer, next(self.__sequence), interval, device))
+                continue
+            lag = now - deadline
+            self.__max_lag = max(self.__max_lag, lag)
+            self.__total_lag += lag
+            self.__ticks += 1
+            device.tick()
+            next_deadline = deadline + interval
+            if now - next_deadline > self.max_catchup * interval:
+                skipped = int((now - next_deadline) / interval)
+                self.__missed += skipped
+                next_deadline += skipped * interval
+            heapq.heapreplace(heap, (next_deadline, next(self.__sequence), device.next_interval(), device))
+            now = time.monotonic()
+        return heap[0][0] if heap else now + 1
+
+    def start(self):
+        """
+        Function to (re)set the statistics and mark the scheduler as running.
+        """
+        self.alive = True
+        self.__wakeup.clear()
+        self.reset()
+
+    def reset(self):
+        """
+        Function to reset the statistics, e.g. at the end of a warm-up, without touching the deadlines.
+        """
+        self.__started = time.monotonic()
+        self.__ticks = 0
+        self.__missed = 0
+        self.__max_lag = 0.0
+        self.__total_lag = 0.0
+
+    def stop(self):
+        """
+        Function to stop a running scheduler, the blocking run() wakes up immediately.
+        """
+        self.alive = False
+        self.__wakeup.set()
+
+    def run(self, duration: float = None):
+        """
+        Function to issue ticks for 'duration' seconds (or until stop()) from the calling thread.
+        Sleeps until the next deadline instead of busy waiting.
+        """
+        self.start()
+        end = self.__started + duration if duration is not None else float("inf")
+        while self.alive:
+            now = time.monotonic()
+            if now >= end:
+                break
+            next_deadline = self.__run_due(now, end)
+            self.__wakeup.wait(max(0.0, min(next_deadline, end) - time.monotonic()))
+        self.alive = False
+
+    async def run_async(self, duration: float = None):
+        """
+        Function to issue ticks for 'duration' seconds (or until stop()) within an asyncio event loop.
+        """
+        self.start()
+        end = self.__started + duration if duration is not None else float("inf")
+        while self.alive:
+            now = time.monotonic()
+            if now >= end:
+                break
+            next_deadline = self.__run_due(now, end)
+            await asyncio.sleep(max(0.0, min(next_deadline, end) - time.monotonic()))
+        self.alive = False
+
+    def report(self) -> RateReport:
+        """
+        Function returning requested vs. achieved rate since the last start().
+        Deadlines that are overdue at the time of the call are counted as missed.
+        """
+        now = time.monotonic()
+        missed = self.__missed
+        for deadline, _, interval, _ in self.__heap:
+            if deadline < now:
+                missed += int((now - deadline) / interval) + 1
+        elapsed = now - self.__started if self.__started is not None else 0.0
+        return RateReport(elapsed, self.__ticks, missed, self.__max_lag, self.__total_lag)
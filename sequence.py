@@ -0,0 +1,150 @@
+"""
+Module for detecting lost, duplicated and reordered messages.
+With sequence numbering enabled, every device stamps its messages with a per-device sequence
+number in the MQTT v5 user property 'seq'. A subscriber (see latency.LatencyCollector) feeds the
+received numbers into a SequenceAnalyzer, which tracks every device with a sliding window bitmap
+of the last 'window' sequence numbers below the highest one received:
+- a number above the highest one moves the window, the numbers skipped are missing for now
+- a number within the window that was received before is a duplicate, otherwise it arrived out of order
+- a number below the window arrived out of order (duplicates that old cannot be told apart)
+Messages still missing at the end of a step count as lost. Only the numbers from the first one
+received in a step onwards are considered, so a step starting mid-stream has no spurious loss.
+"""
+
+import threading
+
+SEQUENCE_PROPERTY = "seq"
+
+
+def stamp_sequence(properties, sequence: int):
+    """
+    Function to add the user property carrying 'sequence' to the PUBLISH 'properties'.
+    """
+    properties.UserProperty = (SEQUENCE_PROPERTY, str(sequence))
+
+
+def read_sequence(properties) -> int:
+    """
+    Function returning the sequence number of received message 'properties', None if there is none.
+    """
+    for key, value in getattr(properties, "UserProperty", ()):
+        if key == SEQUENCE_PROPERTY:
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class SequenceTracker():
+    """
+    Received sequence numbers of a single device.
+    Bit i of 'bitmap' is set if number 'highest' - i was received.
+    """
+    __slots__ = ("window", "mask", "first", "highest", "bitmap", "received", "unique", "duplicates", "reordered")
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.first = None
+        self.highest = None
+        self.bitmap = 0
+        self.received = 0
+        self.unique = 0
+        self.duplicates = 0
+        self.reordered = 0
+
+    def record(self, sequence: int):
+        """
+        Function to record the arrival of 'sequence'.
+        """
+        self.received += 1
+        if self.first is None:
+            self.first = self.highest = sequence
+            self.bitmap = 1
+            self.unique = 1
+            return
+        offset = self.highest - sequence
+        if offset < 0:
+            self.bitmap = ((self.bitmap << -offset) | 1) & self.mask if -offset < self.window else 1
+            self.highest = sequence
+            self.unique += 1
+        elif sequence < self.first:
+            # sent before the first number of the step, not part of the loss accounting
+            self.reordered += 1
+        elif offset >= self.window:
+            self.reordered += 1
+            self.unique += 1
+        elif self.bitmap >> offset & 1:
+            self.duplicates += 1
+        else:
+            self.bitmap |= 1 << offset
+            self.reordered += 1
+            self.unique += 1
+
+    @property
+    def lost(self) -> int:
+        """
+        Number of sequence numbers between the first and the highest one received that never arrived.
+        """
+        return max(0, self.highest - self.first + 1 - self.unique) if self.first is not None else 0
+
+    def summary(self) -> dict:
+        """
+        Function returning received, lost, duplicate and reordered messages and the loss rate.
+        """
+        return summarize(self.received, self.unique, self.lost, self.duplicates, self.reordered)
+
+
+def summarize(received: int, unique: int, lost: int, duplicates: int, reordered: int) -> dict:
+    """
+    Function returning the summary of the given counts, the loss rate relates the lost
+    messages to all messages that should have arrived.
+    """
+    expected = unique + lost
+    return {"received": received, "lost": lost, "duplicates": duplicates, "reordered": reordered,
+            "loss_rate": lost / expected if expected else 0.0}
+
+
+class SequenceAnalyzer():
+    """
+    Sequence trackers of all devices for the current evaluation step, thread-safe.
+    """
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.unnumbered = 0
+        self.__trackers = {}
+        self.__lock = threading.Lock()
+
+    def record(self, device: str, sequence: int):
+        """
+        Function to record the arrival of 'sequence' from 'device', None counts as unnumbered message.
+        """
+        with self.__lock:
+            if sequence is None:
+                self.unnumbered += 1
+                return
+            tracker = self.__trackers.get(device)
+            if tracker is None:
+                tracker = self.__trackers[device] = SequenceTracker(self.window)
+            tracker.record(sequence)
+
+    def reset(self):
+        """
+        Function to forget all devices, e.g. at the start of a step.
+        """
+        with self.__lock:
+            self.__trackers = {}
+            self.unnumbered = 0
+
+    def summary(self) -> dict:
+        """
+        Function returning the summary overall and per device.
+        """
+        with self.__lock:
+            trackers = dict(self.__trackers)
+        devices = {device: tracker.summary() for device, tracker in sorted(trackers.items())}
+        overall = summarize(*(sum(getattr(tracker, field) for tracker in trackers.values())
+                              for field in ("received", "unique", "lost", "duplicates", "reordered")))
+        overall["unnumbered"] = self.unnumbered
+        return {"overall": overall, "devices": devices}
@@ -0,0 +1,140 @@
+"""
+Module for keeping the state of large fleets in typed columns instead of one dictionary per device.
+All devices sharing a payload schema (see payload.py) share a StateStore with one array per field,
+booleans as bytes and numbers as doubles, and one row per device name. A device only holds a
+DeviceState, a two-slot view that reads and writes its row like a dictionary, so sensor ticks,
+actuator commands and PayloadTemplate.render() work on the columns directly.
+Devices recreated under the same name (e.g. in the next evaluation step) continue their state.
+"""
+
+from array import array
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class DeviceState():
+    """
+    Dictionary-like view of the row 'index' of 'store'.
+    """
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: "StateStore", index: int):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, field: str):
+        return self.store.types[field](self.store.columns[field][self.index])
+
+    def __setitem__(self, field: str, value):
+        self.store.columns[field][self.index] = value
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.store.columns
+
+    def __iter__(self):
+        return iter(self.store.fields)
+
+    def __len__(self) -> int:
+        return len(self.store.fields)
+
+    def keys(self) -> tuple:
+        """
+        Function returning the fields in schema order.
+        """
+        return self.store.fields
+
+    def items(self) -> list:
+        """
+        Function returning (field, value) pairs in schema order.
+        """
+        return [(field, self[field]) for field in self.store.fields]
+
+    def to_dict(self) -> dict:
+        """
+        Function returning a copy of the state as dictionary.
+        """
+        return dict(self.items())
+
+
+class StateStore():
+    """
+    Columns of all devices with the fields and defaults of 'defaults' (a schema's default state).
+    """
+    def __init__(self, defaults: dict):
+        self.fields = tuple(defaults)
+        self.defaults = dict(defaults)
+        self.types = {field: bool if isinstance(value, bool) else float for field, value in defaults.items()}
+        self.columns = {field: array("b" if self.types[field] is bool else "d") for field in self.fields}
+        self.rows = {}
+        self.__lock = threading.Lock()
+
+    def row(self, name: str) -> int:
+        """
+        Function returning the row of device 'name', appending one initialized with the defaults on first use.
+        """
+        index = self.rows.get(name)
+        if index is None:
+            with self.__lock:
+                index = self.rows.get(name)
+                if index is None:
+                    for field, column in self.columns.items():
+                        column.append(self.defaults[field])
+                    index = self.rows[name] = len(self.rows)
+        return index
+
+    def view(self, name: str) -> DeviceState:
+        """
+        Function returning the state of device 'name'.
+        """
+        return DeviceState(self, self.row(name))
+
+    def column(self, field: str):
+        """
+        Function returning the values of 'field' of all devices (in row order) as NumPy array without
+        copying them. The array is only valid until the next device is added.
+        """
+        if np is None:
+            raise ImportError("Column views require numpy")
+        column = self.columns[field]
+        return np.frombuffer(column, dtype=np.int8 if self.types[field] is bool else np.float64)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the columns in bytes.
+        """
+        return sum(column.itemsize * len(column) for column in self.columns.values())
+
+
+class StateStores():
+    """
+    State stores of this process by schema, i.e. field names and types.
+    """
+    def __init__(self):
+        self.stores = {}
+        self.__lock = threading.Lock()
+
+    def store(self, defaults: dict) -> StateStore:
+        """
+        Function returning the store of the schema with the default state 'defaults'.
+        """
+        key = tuple((field, isinstance(value, bool)) for field, value in defaults.items())
+        with self.__lock:
+            store = self.stores.get(key)
+            if store is None:
+                store = self.stores[key] = StateStore(defaults)
+            return store
+
+    def view(self, template, name: str) -> DeviceState:
+        """
+        Function returning the state of device 'name' rendered with 'template' (see payload.py).
+        """
+        return self.store(template.defaults()).view(name)
+
+
+# device states of this process
+STATES = StateStores()
@@ -0,0 +1,216 @@
+"""
+Module for recording the messages of a simulation run as a compact binary trace and reading it back.
+A trace is an append-only, memory-mapped file. Device names and topics are written once and
+referenced by id afterwards, every message record holds its monotonic timestamp (nanoseconds),
+device, topic, QoS, correlation data and payload:
+
+    header   "MQTTRACE", version (uint16)
+    name     kind (uint8), id (uint32), length (uint16), UTF-8 bytes      kind 1: device, 2: topic
+    message  kind (uint8) 3, time (uint64), device id, topic id (uint32), QoS (uint8),
+             correlation data length (uint16), payload length (uint32), correlation data, payload
+
+All integers are little endian. A trace that was not closed properly (e.g. killed run) ends with
+zero padding, which reads as the end of the trace.
+Recording is disabled unless started on TRACE, a disabled trace costs one attribute lookup per publish:
+
+    if TRACE.record:
+        TRACE.record(name, topic, payload, correlation_data, qos)
+"""
+
+from collections import namedtuple
+import heapq
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger('Evaluation')
+
+MAGIC = b"MQTTRACE"
+VERSION = 3
+KIND_END, KIND_DEVICE, KIND_TOPIC, KIND_MESSAGE = range(4)
+
+_HEADER = struct.Struct("<8sH")
+_NAME = struct.Struct("<BIH")
+_MESSAGE = struct.Struct("<BQIIBHI")
+
+TraceMessage = namedtuple("TraceMessage", ("time", "device", "topic", "payload", "correlation_data", "qos"))
+
+
+class TraceWriter():
+    """
+    Appends messages to the trace file 'path', growing the file and its mapping by 'chunk' bytes at a time.
+    Writing is thread-safe, so the paho and scheduler threads of all devices can share one writer.
+    """
+    def __init__(self, path: str, chunk: int = 16 * 1024 * 1024):
+        self.path = path
+        self.chunk = chunk
+        self.messages = 0
+        self.__closed = False
+        self.__lock = threading.Lock()
+        self.__ids = {KIND_DEVICE: {}, KIND_TOPIC: {}}
+        self.__file = open(path, "w+b")
+        self.__file.truncate(chunk)
+        self.__map = mmap.mmap(self.__file.fileno(), chunk)
+        _HEADER.pack_into(self.__map, 0, MAGIC, VERSION)
+        self.__size = _HEADER.size
+
+    def __reserve(self, size: int):
+        # called with the lock held
+        if self.__size + size > len(self.__map):
+            self.__map.resize(max(len(self.__map) + self.chunk, self.__size + size))
+
+    def __id(self, kind: int, name: str) -> int:
+        # called with the lock held, writes the name record on first use
+        ids = self.__ids[kind]
+        identifier = ids.get(name)
+        if identifier is None:
+            identifier = len(ids)
+            encoded = name.encode('utf-8')
+            self.__reserve(_NAME.size + len(encoded))
+            _NAME.pack_into(self.__map, self.__size, kind, identifier, len(encoded))
+            self.__size += _NAME.size
+            self.__map[self.__size:self.__size + len(encoded)] = encoded
+            self.__size += len(encoded)
+            # only known once its record is written, a failed record is written again on the next use
+            ids[name] = identifier
+        return identifier
+
+    def record(self, device: str, topic: str, payload, correlation_data: bytes = None, qos: int = 0):
+        """
+        Function to append a message of 'device' published to 'topic' with 'qos'.
+        """
+        now = time.monotonic_ns()
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        correlation_data = correlation_data or b""
+        with self.__lock:
+            if self.__closed:
+                # actuator responses may still be published by paho's network threads after recording stopped
+                return
+            device_id = self.__id(KIND_DEVICE, device)
+            topic_id = self.__id(KIND_TOPIC, topic)
+            size = _MESSAGE.size + len(correlation_data) + len(payload)
+            self.__reserve(size)
+            offset = self.__size
+            _MESSAGE.pack_into(self.__map, offset, KIND_MESSAGE, now, device_id, topic_id, qos,
+                               len(correlation_data), len(payload))
+            offset += _MESSAGE.size
+            self.__map[offset:offset + len(correlation_data)] = correlation_data
+            offset += len(correlation_data)
+            self.__map[offset:offset + len(payload)] = payload
+            self.__size += size
+            self.messages += 1
+
+    def close(self):
+        """
+        Function to flush the trace and cut the file down to the recorded size.
+        """
+        with self.__lock:
+            self.__closed = True
+            self.__map.flush()
+            self.__map.close()
+            self.__file.truncate(self.__size)
+            self.__file.close()
+        logger.info("Recorded %s messages (%.1f MiB) to trace %s", self.messages, self.__size / 2**20, self.path)
+
+
+class TraceReader():
+    """
+    Reads the trace file 'path' through a read-only memory mapping.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        if len(self.__map) < _HEADER.size:
+            raise ValueError(f"{path} is not a message trace")
+        magic, version = _HEADER.unpack_from(self.__map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a message trace")
+        if version != VERSION:
+            raise ValueError(f"Unsupported trace version {version} of {path}")
+
+    def __records(self, messages: bool = True):
+        names = {KIND_DEVICE: [], KIND_TOPIC: []}
+        devices, topics = names[KIND_DEVICE], names[KIND_TOPIC]
+        data = self.__map
+        end = len(data)
+        offset = _HEADER.size
+        while offset < end:
+            kind = data[offset]
+            if kind in (KIND_DEVICE, KIND_TOPIC):
+                _, _, length = _NAME.unpack_from(data, offset)
+                offset += _NAME.size
+                names[kind].append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+            elif kind == KIND_MESSAGE:
+                _, now, device, topic, qos, correlation_length, payload_length = _MESSAGE.unpack_from(data, offset)
+                offset += _MESSAGE.size
+                if messages:
+                    correlation_data = data[offset:offset + correlation_length]
+                    payload = data[offset + correlation_length:offset + correlation_length + payload_length]
+                    yield TraceMessage(now, devices[device], topics[topic], payload, correlation_data or None, qos)
+                offset += correlation_length + payload_length
+            else:
+                break
+        if not messages:
+            yield devices, topics
+
+    def __iter__(self):
+        return self.__records()
+
+    def names(self) -> tuple:
+        """
+        Function returning the device names and topics of the trace, skipping over the messages.
+        """
+        return next(self.__records(messages=False))
+
+    def close(self):
+        """
+        Function to release the mapping.
+        """
+        if isinstance(self.__map, mmap.mmap):
+            self.__map.close()
+
+
+def read_traces(readers: list):
+    """
+    Function yielding the messages of several traces (e.g. of the worker processes of one run) in time order.
+    """
+    if len(readers) == 1:
+        return iter(readers[0])
+    return heapq.merge(*readers, key=lambda message: message.time)
+
+
+class TraceHook():
+    """
+    Recording hook of the publish paths, 'record' is None while no trace is recorded.
+    """
+    def __init__(self):
+        self.record = None
+        self.writer = None
+
+    def start(self, path: str) -> TraceWriter:
+        """
+        Function to record all messages published by this process to the trace file 'path'.
+        """
+        self.writer = TraceWriter(path)
+        self.record = self.writer.record
+        logger.info("Recording message trace to %s", path)
+        return self.writer
+
+    def stop(self):
+        """
+        Function to stop recording and close the trace file.
+        """
+        if self.writer:
+            self.record = None
+            self.writer.close()
+            self.writer = None
+
+
+# trace recording of this process
+TRACE = TraceHook()
@@ -0,0 +1,164 @@
+"""
+Module for cutting and measuring the per-message overhead of MQTT v5 PUBLISH packets.
+For small sensor payloads, the topic and the properties make up a large part of every packet:
+- TopicAliases replaces the topic by a two byte alias after its first use on a connection,
+  up to the Topic Alias Maximum the broker announced in its CONNACK.
+- PublishProperties stands in for paho's Properties object, which costs tens of microseconds
+  per message to fill in and encode. It holds the few properties the simulated devices send
+  and is only encoded once, when paho calls pack().
+publish_size() returns the size of a PUBLISH packet on the wire, i.e. fixed header, topic,
+packet id, properties and payload, so the savings can be measured per message.
+"""
+
+import struct
+import threading
+
+PROPERTY_CORRELATION_DATA = 0x09
+PROPERTY_TOPIC_ALIAS = 0x23
+PROPERTY_USER_PROPERTY = 0x26
+
+UINT16 = struct.Struct(">H")
+
+
+def varint_size(value: int) -> int:
+    """
+    Function returning the number of bytes of 'value' as MQTT variable byte integer.
+    """
+    return 1 if value < 128 else 2 if value < 16384 else 3 if value < 2097152 else 4
+
+
+def properties_size(correlation_data: bytes = None, alias: int = None, user_property: tuple = None) -> int:
+    """
+    Function returning the encoded size of PUBLISH properties, including their length prefix.
+    """
+    size = 0
+    if correlation_data is not None:
+        size += 3 + len(correlation_data)
+    if alias is not None:
+        size += 3
+    if user_property is not None:
+        size += 5 + len(user_property[0].encode('utf-8')) + len(user_property[1].encode('utf-8'))
+    return varint_size(size) + size
+
+
+def publish_size(topic_length: int, payload_length: int, qos: int, properties_length: int) -> int:
+    """
+    Function returning the size of a PUBLISH packet on the wire in bytes, with 'properties_length'
+    the size of the encoded properties (see properties_size(), 0 for MQTT v3.1.1).
+    """
+    remaining = 2 + topic_length + (2 if qos else 0) + properties_length + payload_length
+    return 1 + varint_size(remaining) + remaining
+
+
+class PublishProperties():
+    """
+    Correlation data, topic alias and a single user property of a PUBLISH packet, can be passed to
+    paho.mqtt.client.Client.publish() in place of paho.mqtt.properties.Properties.
+    """
+    __slots__ = ("CorrelationData", "TopicAlias", "UserProperty", "__packed")
+
+    def __init__(self, correlation_data: bytes = None, alias: int = None):
+        self.CorrelationData = correlation_data
+        self.TopicAlias = alias
+        self.UserProperty = None
+        self.__packed = None
+
+    def pack(self) -> bytes:
+        """
+        Function returning the encoded properties including their length prefix.
+        """
+        if self.__packed is None:
+            encoded = bytearray()
+            if self.CorrelationData is not None:
+                encoded.append(PROPERTY_CORRELATION_DATA)
+                encoded += UINT16.pack(len(self.CorrelationData)) + self.CorrelationData
+            if self.TopicAlias is not None:
+                encoded.append(PROPERTY_TOPIC_ALIAS)
+                encoded += UINT16.pack(self.TopicAlias)
+            if self.UserProperty is not None:
+                encoded.append(PROPERTY_USER_PROPERTY)
+                for value in self.UserProperty:
+                    value = value.encode('utf-8')
+                    encoded += UINT16.pack(len(value)) + value
+            length = len(encoded)
+            prefix = bytearray()
+            while True:
+                byte = length & 0x7F
+                length >>= 7
+                prefix.append(byte | 0x80 if length else byte)
+                if not length:
+                    break
+            self.__packed = bytes(prefix + encoded)
+        return self.__packed
+
+    def __str__(self) -> str:
+        return (f"[CorrelationData: {self.CorrelationData}, TopicAlias: {self.TopicAlias}, "
+                f"UserProperty: {self.UserProperty}]")
+
+
+class TopicAliases():
+    """
+    Topic aliases of the connection of paho client 'client', at most 'maximum' of them.
+    A topic is sent together with its alias until paho accepted one such message, afterwards the alias alone.
+    """
+    def __init__(self, client, maximum: int = 65535):
+        self.client = client
+        self.maximum = maximum
+        # aliases the broker accepts on the current connection, none before the CONNACK
+        self.limit = 0
+        # topic -> alias assigned on the current connection, alias -> topic and the topics known to the broker
+        self.aliases = {}
+        self.topics = {}
+        self.known = {}
+        self.__lock = threading.Lock()
+
+    def connected(self, client, properties):
+        """
+        Function to be called from the on_connect callback of 'client' with the CONNACK 'properties',
+        calls for other clients (e.g. the logical devices of a shared connection) are ignored.
+        Aliases of the previous connection are void. Unacknowledged QoS 1/2 messages that paho
+        sends again right after on_connect get their topic back, which also maps their alias again.
+        """
+        if client is not self.client:
+            return
+        with self.__lock:
+            previous = self.topics
+            self.limit = min(self.maximum, getattr(properties, "TopicAliasMaximum", None) or 0)
+            self.aliases = {}
+            self.topics = {}
+            self.known = {}
+        if not previous:
+            return
+        # pylint: disable=protected-access
+        with client._out_message_mutex:
+            for message in client._out_messages.values():
+                alias = getattr(message.properties, "TopicAlias", None)
+                if not message._topic and alias in previous:
+                    message._topic = previous[alias].encode('utf-8')
+
+    def resolve(self, topic: str) -> tuple:
+        """
+        Function returning the topic to publish 'topic' with (empty once its alias is known to the broker)
+        and its alias, None if the aliases are exhausted or not supported by the broker.
+        """
+        alias = self.known.get(topic)
+        if alias is not None:
+            return "", alias
+        alias = self.aliases.get(topic)
+        if alias is None:
+            with self.__lock:
+                alias = self.aliases.get(topic)
+                if alias is None:
+                    if len(self.aliases) >= self.limit:
+                        return topic, None
+                    alias = self.aliases[topic] = len(self.aliases) + 1
+                    self.topics[alias] = topic
+        return topic, alias
+
+    def sent(self, topic: str, alias: int):
+        """
+        Function to be called once paho accepted a message published with 'topic' and 'alias' (see resolve()),
+        the following messages omit the topic.
+        """
+        if alias is not None and topic:
+            self.known[topic] = alias